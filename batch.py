@@ -0,0 +1,202 @@
+"""Runs a file of prompts concurrently, each in its own copy of the calculator project.
+
+    python batch.py prompts.txt [--concurrency N] [--output report.jsonl] [--log agent.log]
+
+One prompt per line, blank lines and lines starting with # are skipped.
+Session i works in sandbox_workspace/batch/<i>/calculator with its own
+message history; at most --concurrency sessions run at a time and share one
+pool of sandbox containers. Python changes are not reviewed, the workspaces
+are kept for inspection after the run. The report has one JSON object per
+session, a summary table is printed at the end.
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+
+import main
+from functions import run_python_file, write_file
+from functions.sandbox_pool import FORKSERVER, SandboxPool
+from workspace import sync_workspace
+
+BATCH_DIR = "batch"
+
+
+def read_prompts(path):
+    with open(path) as file:
+        return [
+            line.strip()
+            for line in file
+            if line.strip() and not line.lstrip().startswith("#")
+        ]
+
+
+def session_workspace(index):
+    """Returns (working_directory, working_directory_run) of session index, the latter relative to the sandbox."""
+    run_dir = os.path.join(BATCH_DIR, f"{index:04d}", "calculator")
+    return os.path.join(main.sandbox, run_dir), run_dir
+
+
+def summarize(index, prompt, messages, elapsed, error=None):
+    """Returns the report entry of one session."""
+    model_contents = [content for content in messages if content.role == "model"]
+    tool_calls = sum(
+        1
+        for content in model_contents
+        for part in content.parts or []
+        if part.function_call is not None
+    )
+    answer = ""
+    done = False
+    if model_contents and messages[-1].role == "model":
+        parts = messages[-1].parts or []
+        answer = "".join(part.text for part in parts if part.text)
+        done = answer != "" and all(part.function_call is None for part in parts)
+    return {
+        "session": index,
+        "prompt": prompt,
+        "status": "error" if error else ("done" if done else "unfinished"),
+        "error": error,
+        "iterations": len(model_contents),
+        "tool_calls": tool_calls,
+        "seconds": elapsed,
+        "workspace": session_workspace(index)[0],
+        "answer": answer,
+    }
+
+
+async def run_session(client, index, prompt, semaphore, max_iterations, token_budget, turn_budget=8000):
+    async with semaphore:
+        workspace = session_workspace(index)
+        sync_workspace("calculator", workspace[0], reset=True)
+        start = time.perf_counter()
+        messages = []
+        error = None
+        try:
+            messages = await main.run_agent(
+                client,
+                prompt,
+                max_iterations=max_iterations,
+                on_text=lambda text: None,
+                token_budget=token_budget,
+                turn_budget=turn_budget,
+                workspace=workspace,
+            )
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        return summarize(index, prompt, messages, time.perf_counter() - start, error)
+
+
+async def run_batch(client, prompts, concurrency=4, max_iterations=20, token_budget=32000, turn_budget=8000):
+    """Runs every prompt as its own agent session, returns the report entries in prompt order."""
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(
+        *(
+            run_session(client, index, prompt, semaphore, max_iterations, token_budget, turn_budget)
+            for index, prompt in enumerate(prompts)
+        )
+    )
+
+
+def format_report(results, elapsed):
+    lines = [f"{'session':>7} {'status':10} {'iterations':>10} {'tool calls':>10} {'seconds':>8}  answer"]
+    for result in results:
+        answer = (result["error"] or result["answer"]).replace("\n", " ")
+        if len(answer) > 60:
+            answer = answer[:57] + "..."
+        lines.append(
+            f"{result['session']:7} {result['status']:10} {result['iterations']:10} "
+            f"{result['tool_calls']:10} {result['seconds']:8.1f}  {answer}"
+        )
+    done = sum(1 for result in results if result["status"] == "done")
+    lines.append(
+        f"{done}/{len(results)} sessions done in {elapsed:.1f} s, "
+        f"{60 * len(results) / max(elapsed, 1e-9):.1f} sessions per minute"
+    )
+    return "\n".join(lines)
+
+
+def main_batch(client, args):
+    prompts = read_prompts(args.prompts)
+    # Unattended, there is nobody to review changes in concurrent sessions
+    write_file.REVIEW_CHANGES = False
+
+    pool = None
+    if args.pool_size > 0:
+        forkserver = FORKSERVER + ("--preload", args.preload) if args.forkserver else None
+        pool = SandboxPool(size=args.pool_size, forkserver=forkserver)
+        run_python_file.set_pool(pool)
+
+    log = open(args.log, "w") if args.log else open(os.devnull, "w")
+    start = time.perf_counter()
+    try:
+        # Sessions print as they go, keep their output out of the report
+        with log, contextlib.redirect_stdout(log):
+            results = asyncio.run(
+                run_batch(
+                    client,
+                    prompts,
+                    concurrency=args.concurrency,
+                    max_iterations=args.max_iterations,
+                    token_budget=args.token_budget,
+                    turn_budget=args.turn_budget,
+                )
+            )
+    finally:
+        if pool is not None:
+            run_python_file.set_pool(None)
+            pool.close()
+    elapsed = time.perf_counter() - start
+
+    if args.output:
+        with open(args.output, "w") as out:
+            for result in results:
+                out.write(json.dumps(result) + "\n")
+    print(format_report(results, elapsed))
+    return results
+
+
+if __name__ == "__main__":
+    argparser = main.ExitOneArgumentParser(description="Run a file of prompts concurrently")
+    argparser.add_argument("prompts", help="File with one prompt per line")
+    argparser.add_argument(
+        "--concurrency", type=int, default=4, help="Number of sessions running at the same time"
+    )
+    argparser.add_argument("--max-iterations", type=int, default=20)
+    argparser.add_argument("--token-budget", type=int, default=32000)
+    argparser.add_argument("--turn-budget", type=int, default=8000)
+    argparser.add_argument(
+        "--pool-size",
+        type=int,
+        default=2,
+        help="Number of warm sandbox containers shared by all sessions, 0 starts a new container per run",
+    )
+    argparser.add_argument("--forkserver", action="store_true")
+    argparser.add_argument("--preload", default="")
+    argparser.add_argument("--rpm", type=int, help="Limit model requests per minute over all sessions")
+    argparser.add_argument("--tpm", type=int, help="Limit prompt tokens per minute over all sessions")
+    argparser.add_argument("--max-retries", type=int, default=5)
+    argparser.add_argument("--deadline", type=float, default=300.0)
+    argparser.add_argument("--output", help="Write the report as JSON lines to this file")
+    argparser.add_argument("--log", help="Write the output of the sessions to this file")
+    args = argparser.parse_args()
+
+    # Like main.py, only import the SDK once the arguments are fine
+    from dotenv import load_dotenv
+    from google import genai
+    from ratelimit import RateLimiter, RetryingClient
+
+    load_dotenv()
+    # One client, so all sessions share the rate limits
+    client = RetryingClient(
+        genai.Client(api_key=os.environ.get("GEMINI_API_KEY")),
+        RateLimiter(args.rpm, args.tpm),
+        max_retries=args.max_retries,
+        deadline=args.deadline,
+    )
+    results = main_batch(client, args)
+    print(f"Model calls: {client.metrics}")
+    sys.exit(0 if all(result["status"] == "done" for result in results) else 1)
@@ -0,0 +1,190 @@
+"""Offline benchmark of the agent loop in main.py.
+
+Replays scripted model responses through fake_genai.FakeClient and runs the
+real tools, with fake_docker.py standing in for docker. Needs no network and
+no API key. Prints one JSON object per scenario:
+
+    python bench_agent.py [--scenario NAME] [--repeat N] [--latency SECONDS] [--output FILE]
+
+Reported per scenario: wall time, per-iteration latency, per tool call
+latency, bytes of history sent with each request and peak RSS.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import main
+from fake_genai import FakeClient, call_chunk, text_chunk
+from functions import run_python_file, write_file
+
+FAKE_DOCKER = [sys.executable, os.path.abspath("fake_docker.py")]
+
+
+def explore():
+    """Lists the workspace and reads a few files in one turn."""
+    return [
+        [
+            text_chunk("Let me look around."),
+            call_chunk("get_files_info", directory=".", recursive=True),
+            call_chunk("get_file_content", file_path="main.py"),
+            call_chunk("get_file_content", file_path="pkg/calculator.py"),
+            call_chunk("get_file_content", file_path="pkg/render.py"),
+        ],
+        [text_chunk("The calculator evaluates infix expressions.")],
+    ]
+
+
+def fix_bug():
+    """Reads, edits and runs a file over several turns."""
+    return [
+        [call_chunk("get_file_content", file_path="pkg/render.py")],
+        [
+            call_chunk(
+                "edit_file",
+                file_path="pkg/render.py",
+                search="indent: int = 2",
+                replace="indent: int = 4",
+            )
+        ],
+        [call_chunk("run_python_file", file_path="main.py", args=["3 + 5"])],
+        [call_chunk("run_python_file", file_path="tests.py")],
+        [text_chunk("Changed the indentation, the tests pass.")],
+    ]
+
+
+def long_session():
+    """Twenty turns of reads, grows the history until it is compacted."""
+    responses = []
+    for i in range(19):
+        responses.append(
+            [
+                text_chunk(f"Reading again, attempt {i}."),
+                call_chunk("get_file_content", file_path="lorem.txt"),
+                call_chunk("get_file_content", file_path="pkg/calculator.py"),
+            ]
+        )
+    responses.append([text_chunk("Done reading.")])
+    return responses
+
+
+SCENARIOS = {
+    "explore": explore,
+    "fix_bug": fix_bug,
+    "long_session": long_session,
+}
+
+
+class Timings:
+    """Wraps a function of the main module and records the duration of each call."""
+
+    def __init__(self, name):
+        self.name = name
+        self.original = getattr(main, name)
+        self.durations = []
+
+    def __enter__(self):
+        if self.name == "call_agent":
+
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await self.original(*args, **kwargs)
+                finally:
+                    self.durations.append(time.perf_counter() - start)
+
+        else:
+
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return self.original(*args, **kwargs)
+                finally:
+                    self.durations.append(time.perf_counter() - start)
+
+        setattr(main, self.name, timed)
+        return self
+
+    def __exit__(self, *exc):
+        setattr(main, self.name, self.original)
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_scenario(name, latency=0.0):
+    client = FakeClient(SCENARIOS[name](), latency=latency)
+    with tempfile.TemporaryDirectory() as sandbox:
+        main.sandbox = sandbox
+        main.working_directory = os.path.join(sandbox, "calculator")
+        os.environ["FAKE_DOCKER_WORKSPACE"] = sandbox
+        args = argparse.Namespace(
+            prompt=f"benchmark {name}",
+            verbose=False,
+            pool_size=0,
+            token_budget=32000,
+            turn_budget=8000,
+            notify_unchanged=False,
+            reset_workspace=False,
+            max_output=run_python_file.MAX_OUTPUT_BYTES,
+            spill_output=False,
+            trace=None,
+            trace_chrome=None,
+        )
+        with Timings("call_agent") as iterations, Timings("call_function") as tools:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                main.main(client, args)
+                elapsed = time.perf_counter() - start
+
+    request_bytes = client.aio.models.request_bytes
+    return {
+        "scenario": name,
+        "wall_time_s": elapsed,
+        "iterations": len(iterations.durations),
+        "iteration_latency_s": iterations.durations,
+        "tool_calls": len(tools.durations),
+        "tool_call_latency_s": tools.durations,
+        "history_bytes_sent": request_bytes,
+        "total_history_bytes_sent": sum(request_bytes),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def main_bench():
+    argparser = argparse.ArgumentParser(description="Offline benchmark of the agent loop")
+    argparser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    argparser.add_argument("--repeat", type=int, default=1)
+    argparser.add_argument(
+        "--latency", type=float, default=0.0, help="Simulated model latency in seconds"
+    )
+    argparser.add_argument("--output", help="Write JSON lines to this file instead of stdout")
+    args = argparser.parse_args()
+
+    # Non-interactive, and run python files with the fake docker
+    write_file.REVIEW_CHANGES = False
+    run_python_file.DOCKER = FAKE_DOCKER
+    os.environ["PYTHONDONTWRITEBYTECODE"] = "1"
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for name in args.scenario or sorted(SCENARIOS):
+            for repeat in range(args.repeat):
+                result = run_scenario(name, latency=args.latency)
+                result["repeat"] = repeat
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main_bench()
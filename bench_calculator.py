@@ -0,0 +1,58 @@
+"""Compares the streaming calculator evaluator with _evaluate_infix on a long expression.
+
+Usage: python bench_calculator.py [--tokens 1000000]
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "calculator"))
+from pkg.calculator import Calculator  # noqa: E402
+
+
+def generate_expression(tokens, seed=0):
+    rng = random.Random(seed)
+    terms = [str(rng.randint(1, 9))]
+    while len(terms) < tokens - 1:
+        terms.append(rng.choice("+-*/"))
+        terms.append(str(rng.randint(1, 9)))
+    return " ".join(terms)
+
+
+def chunks(text, size=64 * 1024):
+    stream = io.StringIO(text)
+    while chunk := stream.read(size):
+        yield chunk
+
+
+def measure(name, function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:28} {elapsed:8.3f} s {peak / 1024 / 1024:10.2f} MiB  result={result:.6g}")
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    argparser.add_argument("--tokens", type=int, default=1_000_000)
+    args = argparser.parse_args()
+
+    calculator = Calculator()
+    expression = generate_expression(args.tokens)
+    print(f"{args.tokens} tokens, {len(expression)} characters")
+    print(f"{'':28} {'time':>10} {'peak memory':>14}")
+    measure("_evaluate_infix(split())", lambda: calculator._evaluate_infix(expression.split()))
+    measure("evaluate_stream(str)", lambda: calculator.evaluate_stream(expression))
+    measure("evaluate_stream(chunks)", lambda: calculator.evaluate_stream(chunks(expression)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Startup time of the main.py command line, each run in a new process.
+
+    python bench_startup.py [--scenario NAME] [--repeat N] [--binary PATH] [--output FILE]
+
+Scenarios:
+    help              main.py --help
+    argument_error    main.py without a prompt, exits with code 1
+    first_model_call  a session answered by the first model call
+    full_run          a session with tool calls over three model calls
+
+Model calls go to a local fake_genai.FakeGeminiServer through --base-url,
+so the real SDK is imported and used, without network or API key. Sessions
+run with --pool-size 0 and only use tools that need no docker, in a
+temporary sandbox_workspace. With --binary, e.g. the PyInstaller build in
+dist/, that is timed instead of `python main.py`.
+
+Prints one JSON object per scenario with the wall time of every run.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from google.genai import types
+
+from fake_genai import FakeGeminiServer, call_chunk, chunk, text_chunk
+
+PROJECT_DIR = os.path.dirname(os.path.realpath(__file__))
+MAIN = os.path.join(PROJECT_DIR, "main.py")
+
+
+def first_model_call():
+    return [[text_chunk("The calculator evaluates infix expressions.")]]
+
+
+def full_run():
+    return [
+        # Two calls in one response, run concurrently
+        [
+            chunk(
+                types.Part(function_call=types.FunctionCall(name="get_files_info", args={"directory": "pkg"})),
+                types.Part(function_call=types.FunctionCall(name="get_outline", args={"path": "pkg/calculator.py"})),
+            )
+        ],
+        [call_chunk("get_file_content", file_path="pkg/render.py", start_line=1, end_line=10)],
+        [text_chunk("render.py formats results as JSON.")],
+    ]
+
+
+# name -> (arguments after the command, expected exit code, model responses)
+SCENARIOS = {
+    "help": (["--help"], 0, None),
+    "argument_error": ([], 1, None),
+    "first_model_call": (["What does the calculator do?"], 0, first_model_call),
+    "full_run": (["How are results rendered?"], 0, full_run),
+}
+
+
+def run_once(command, name):
+    args, expected, responses = SCENARIOS[name]
+    env = dict(os.environ, GEMINI_API_KEY="fake")
+    with tempfile.TemporaryDirectory() as cwd:
+        # main.py syncs ./calculator into ./sandbox_workspace
+        os.symlink(os.path.join(PROJECT_DIR, "calculator"), os.path.join(cwd, "calculator"))
+        server = FakeGeminiServer(responses() if responses else [])
+        with server:
+            if responses:
+                args = args + ["--pool-size", "0", "--base-url", server.url]
+            start = time.perf_counter()
+            result = subprocess.run(
+                command + args, cwd=cwd, env=env, stdin=subprocess.DEVNULL, capture_output=True, text=True
+            )
+            elapsed = time.perf_counter() - start
+    if result.returncode != expected:
+        raise RuntimeError(
+            f"{name}: exited with {result.returncode}, expected {expected}\n{result.stdout}\n{result.stderr}"
+        )
+    return elapsed, len(server.requests)
+
+
+def run_scenario(command, name, repeat):
+    runs = []
+    model_calls = 0
+    for _ in range(repeat):
+        elapsed, model_calls = run_once(command, name)
+        runs.append(elapsed)
+    return {
+        "scenario": name,
+        "command": " ".join(command),
+        "model_calls": model_calls,
+        "min_s": min(runs),
+        "median_s": statistics.median(runs),
+        "max_s": max(runs),
+        "runs_s": runs,
+    }
+
+
+def main_bench():
+    argparser = argparse.ArgumentParser(description="Startup time of the main.py command line")
+    argparser.add_argument("--scenario", choices=list(SCENARIOS), action="append")
+    argparser.add_argument("--repeat", type=int, default=5)
+    argparser.add_argument("--binary", help="Time this executable instead of python main.py")
+    argparser.add_argument("--output", help="Write JSON lines to this file instead of stdout")
+    args = argparser.parse_args()
+
+    command = [os.path.abspath(args.binary)] if args.binary else [sys.executable, MAIN]
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for name in args.scenario or list(SCENARIOS):
+            out.write(json.dumps(run_scenario(command, name, args.repeat)) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main_bench()
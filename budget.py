@@ -0,0 +1,112 @@
+"""Shares a token budget across the function responses of one model turn.
+
+Each tool caps its own output, but the model can batch many calls in one
+turn. Before the responses of a turn are added to the conversation,
+ContextBudget gives them min(turn_tokens, context left after the history)
+tokens together and shares that out by water-filling: responses smaller
+than an equal share are kept whole, what they leave unused is split equally
+among the larger ones. Those are cut to their share, keeping the head and the
+tail with a marker saying how much was left out. However many calls the
+model makes, a turn adds about turn_tokens to the prompt.
+"""
+
+from google.genai import types
+
+from history import CHARS_PER_TOKEN
+
+# Input limit of gemini-2.0-flash
+CONTEXT_TOKENS = 1_048_576
+# Left free for the model's reply
+RESERVE_TOKENS = 8192
+TRUNCATED = "\n... [{} chars omitted to fit the context budget of this turn, request a smaller part] ...\n"
+# Kept of every response, even when many calls share a small budget
+MIN_CHARS = 256
+
+
+def allocate(sizes, budget) -> list[int]:
+    """Returns the chars kept of each response, summing to at most budget (or MIN_CHARS each)."""
+    shares = [0] * len(sizes)
+    remaining = budget
+    left = len(sizes)
+    for i in sorted(range(len(sizes)), key=sizes.__getitem__):
+        shares[i] = min(sizes[i], max(remaining // left, MIN_CHARS))
+        remaining -= shares[i]
+        left -= 1
+    return shares
+
+
+def truncate(text, limit) -> str:
+    """Cuts text to about limit chars, keeping whole lines at the start and the end where possible."""
+    if len(text) <= limit:
+        return text
+    keep = max(limit - len(TRUNCATED.format(len(text))), 0)
+    head_size = keep - keep // 2
+    tail_size = keep // 2
+    head = text[:head_size]
+    cut = head.rfind("\n")
+    if cut >= head_size // 2:
+        head = head[: cut + 1]
+    tail = text[len(text) - tail_size:] if tail_size else ""
+    cut = tail.find("\n")
+    if 0 <= cut < tail_size // 2:
+        tail = tail[cut + 1:]
+    return head + TRUNCATED.format(len(text) - len(head) - len(tail)) + tail
+
+
+def _size(response):
+    return sum(len(str(value)) for value in response.values())
+
+
+def _truncate_response(response, limit):
+    keys = [key for key, value in response.items() if isinstance(value, str)]
+    fixed = _size(response) - sum(len(response[key]) for key in keys)
+    shares = allocate([len(response[key]) for key in keys], max(limit - fixed, 0))
+    return dict(response, **{key: truncate(response[key], share) for key, share in zip(keys, shares)})
+
+
+class ContextBudget:
+    """Cuts the function responses of a turn to share turn_tokens, see the module docstring."""
+
+    def __init__(
+        self, turn_tokens=8000, context_tokens=CONTEXT_TOKENS, reserve_tokens=RESERVE_TOKENS, on_truncate=None
+    ):
+        self.turn_tokens = turn_tokens
+        self.context_tokens = context_tokens
+        self.reserve_tokens = reserve_tokens
+        # Called with the function name of every response that was cut
+        self.on_truncate = on_truncate
+        # Over all turns, for tracing
+        self.omitted_chars = 0
+
+    def turn_budget(self, history_tokens) -> int:
+        """Tokens the function responses of a turn may use after history_tokens of conversation."""
+        left = self.context_tokens - self.reserve_tokens - history_tokens
+        return max(min(self.turn_tokens, left), 0)
+
+    def fit(self, contents, history_tokens) -> list[types.Content]:
+        """Returns contents with the function responses cut to share the budget of the turn."""
+        found = [
+            (i, j, part.function_response)
+            for i, content in enumerate(contents)
+            for j, part in enumerate(content.parts or [])
+            if part.function_response is not None
+        ]
+        sizes = [_size(response.response or {}) for _, _, response in found]
+        budget = self.turn_budget(history_tokens) * CHARS_PER_TOKEN
+        if sum(sizes) <= budget:
+            return contents
+
+        contents = list(contents)
+        for (i, j, response), size, share in zip(found, sizes, allocate(sizes, budget)):
+            if share >= size:
+                continue
+            cut = _truncate_response(response.response, share)
+            self.omitted_chars += size - _size(cut)
+            if self.on_truncate is not None:
+                self.on_truncate(response.name)
+            parts = list(contents[i].parts)
+            parts[j] = parts[j].model_copy(
+                update={"function_response": response.model_copy(update={"response": cut})}
+            )
+            contents[i] = types.Content(role=contents[i].role, parts=parts)
+        return contents
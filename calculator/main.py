@@ -2,7 +2,36 @@
 
 import sys
 from pkg.calculator import Calculator
-from pkg.render import format_json_output
+from pkg.render import format_json_error, format_json_output
+
+
+# Records written to out at once
+BATCH_LINES = 1000
+
+
+def run_batch(calculator, lines, out):
+    """Evaluates one expression per line, writes one JSON object per line to out.
+
+    An expression that fails produces an error record instead of stopping the batch.
+    """
+    records = []
+    append = records.append
+    evaluate = calculator.evaluate
+    for line in lines:
+        expression = line.strip()
+        if not expression:
+            continue
+        try:
+            append(format_json_output(expression, evaluate(expression), indent=None))
+        except Exception as e:
+            append(format_json_error(expression, e))
+        if len(records) >= BATCH_LINES:
+            records.append("")
+            out.write("\n".join(records))
+            records.clear()
+    if records:
+        records.append("")
+        out.write("\n".join(records))
 
 
 def main():
@@ -10,9 +39,19 @@ def main():
     if len(sys.argv) <= 1:
         print("Calculator App")
         print("Usage: python main.py '<expression>'")
+        print("       python main.py --batch [file]  (one expression per line, default stdin)")
         print("Example: python main.py '2 + 5'")
         return
 
+    if sys.argv[1] == "--batch":
+        path = sys.argv[2] if len(sys.argv) > 2 else "-"
+        if path == "-":
+            run_batch(calculator, sys.stdin, sys.stdout)
+        else:
+            with open(path) as lines:
+                run_batch(calculator, lines, sys.stdout)
+        return
+
     expression = " ".join(sys.argv[1:])
     try:
         result = calculator.evaluate(expression)
@@ -1,61 +1,361 @@
 # calculator.py
 
+import operator
+import re
+from array import array
+from collections import OrderedDict
+from itertools import repeat
+
+try:
+    import numpy as np
+except ImportError:  # evaluate_batch falls back to array.array
+    np = None
+
+VARIABLE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+TOKEN = re.compile(
+    r"\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)|([A-Za-z_][A-Za-z0-9_]*)|(\S))"
+)
+# Longest piece of a chunk carried over to the next one while looking for whitespace
+MAX_CARRY = 4096
+# Text up to the last operator or parenthesis, a + or - after e may be part of a number
+BOUNDARY = re.compile(r".*(?:[()*/]|(?<![eE])[+-])", re.DOTALL)
+
+
+def tokenize(source):
+    """Yields the tokens of source, a string or an iterable of string chunks.
+
+    Whitespace between tokens is optional, numbers are yielded as floats.
+    """
+    if isinstance(source, str):
+        source = (source,)
+    carry = ""
+    for chunk in source:
+        text = carry + chunk
+        # A token may continue in the next chunk, keep what follows the last whitespace
+        cut = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t")) + 1
+        if cut == 0 and len(text) > MAX_CARRY:
+            # No whitespace, cut after an operator, or keep the whole run
+            boundary = BOUNDARY.match(text)
+            if boundary is not None:
+                cut = boundary.end()
+        carry = text[cut:]
+        yield from _tokens(text[:cut])
+    yield from _tokens(carry)
+
+
+def _tokens(text):
+    for match in TOKEN.finditer(text):
+        number, name, other = match.groups()
+        if number is not None:
+            yield float(number)
+        else:
+            yield name or other
+
 
 class Calculator:
-    def __init__(self):
+    def __init__(self, cache_size=1024):
+        # Builtins rather than lambdas, compiled programs call them directly
         self.operators = {
-            "+": lambda x, y: x + y,
-            "-": lambda x, y: x - y,
-            "*": lambda x, y: x * y,
-            "/": lambda x, y: x / y,
+            "+": operator.add,
+            "-": operator.sub,
+            "*": operator.mul,
+            "/": operator.truediv,
         }
 
         self.precendence = {"+": 1, "-": 1, "*": 2, "/": 2}
 
-    def evaluate(self, expression: str) -> float:
+        # compiled programs, keyed on the expression as given
+        self.cache_size = cache_size
+        self._programs = OrderedDict()
+
+    def evaluate(self, expression: str, **variables) -> float:
         expression = expression.strip()
         if not expression or expression == "":
             return None
 
+        program = self._programs.get(expression)
+        if program is not None:
+            self._programs.move_to_end(expression)
+            return self._run(program, variables)
+        # A miss compiles and evaluates in one pass
+        program, value = self._compile_tokens(expression.split(), variables, True)
+        self._cache(expression, program)
+        return value
+
+    def evaluate_batch(self, expression: str, **arrays):
+        """Evaluates expression once for every row of the variable arrays.
+
+        Uses vectorized NumPy operations when NumPy is installed and returns a
+        numpy array, otherwise an array.array of doubles. As for evaluate(),
+        dividing by zero raises ZeroDivisionError and NaN propagates.
+        """
+        expression = expression.strip()
+        if not expression:
+            return None
+        program = self.compile(expression)
+        if np is not None:
+            return self._run_numpy(program, arrays)
+        return self._run_array(program, arrays)
+
+    def evaluate_stream(self, source, **variables) -> float:
+        """Evaluates a possibly very long expression, a string or an iterable of chunks.
+
+        Tokens are read lazily and reduced as soon as precedence allows, so
+        memory is bounded by the nesting depth rather than the length of the
+        expression. Supports parentheses and unary minus.
+        """
+        evaluator = _StreamEvaluator(self.operators, self.precendence, variables)
+        for token in tokenize(source):
+            evaluator.feed(token)
+        return evaluator.result()
+
+    def compile(self, expression: str) -> tuple:
+        """Compiles expression to a program in reverse polish notation.
+
+        Programs are kept in a bounded LRU cache, so evaluating the same
+        expression again skips tokenizing and parsing. The expression is looked
+        up as given first, then with its whitespace normalized.
+        """
+        program = self._programs.get(expression)
+        if program is not None:
+            self._programs.move_to_end(expression)
+            return program
+
         tokens = expression.split()
-        return self._evaluate_infix(tokens)
+        program = self._programs.get(" ".join(tokens))
+        if program is None:
+            program, _ = self._compile_tokens(tokens)
+        self._cache(expression, program)
+        return program
+
+    def _cache(self, expression, program):
+        if self.cache_size > 0:
+            self._programs[expression] = program
+            if len(self._programs) > self.cache_size:
+                self._programs.popitem(last=False)
 
     def _evaluate_infix(self, tokens):
-        values = []
+        return self._compile_tokens(tokens, run=True)[1]
+
+    def _compile_tokens(self, tokens, variables=None, run=False):
+        """Returns the program for tokens and, with run, its value for variables."""
+        program = []
+        emit = program.append
         operators = []
+        values = []  # only with run
+        push = values.append
+        pop = values.pop
+        functions = self.operators
+        precendence = self.precendence
+        depth = 0  # number of values on the stack when the program runs
 
         for token in tokens:
-            if token in self.operators:
-                while (
-                    operators
-                    and operators[-1] in self.operators
-                    and self.precendence[operators[-1]] >= self.precendence[token]
-                ):
-                    self._apply_operator(operators, values)
+            if token in functions:
+                level = precendence[token]
+                while operators and precendence[operators[-1]] >= level:
+                    operator = operators.pop()
+                    if depth < 2:
+                        raise ValueError(f"Not enough operands for operator {operator}")
+                    depth -= 1
+                    function = functions[operator]
+                    emit(function)
+                    if run:
+                        b = pop()
+                        push(function(pop(), b))
                 operators.append(token)
-            else:
-                try:
-                    values.append(float(token))
-                except ValueError:
+                continue
+            try:
+                value = float(token)
+                emit(value)
+            except ValueError:
+                if not VARIABLE.fullmatch(token):
                     raise ValueError(f"Invalid operand: {token}")
+                emit(token)
+                if run:
+                    value = float(_lookup(variables, token))
+            if run:
+                push(value)
+            depth += 1
 
         while operators:
-            self._apply_operator(operators, values)
+            operator = operators.pop()
+            if depth < 2:
+                raise ValueError(f"Not enough operands for operator {operator}")
+            depth -= 1
+            function = functions[operator]
+            emit(function)
+            if run:
+                b = pop()
+                push(function(pop(), b))
 
-        if len(values) != 1:
+        if depth != 1:
             raise ValueError("Invalid expression")
 
+        return tuple(program), values[0] if run else None
+
+    def _run(self, program, variables=None):
+        values = []
+        push = values.append
+        pop = values.pop
+        for item in program:
+            if item.__class__ is float:
+                push(item)
+            elif item.__class__ is str:
+                push(float(_lookup(variables, item)))
+            else:
+                b = pop()
+                push(item(pop(), b))
         return values[0]
 
-    def _apply_operator(self, operators, values):
-        if not operators:
+    def _symbols(self):
+        return {function: symbol for symbol, function in self.operators.items()}
+
+    def _run_numpy(self, program, arrays):
+        symbols = self._symbols()
+        vector_operators = {
+            "+": np.add,
+            "-": np.subtract,
+            "*": np.multiply,
+            "/": np.divide,
+        }
+        values = []
+        # inf - inf and similar give nan silently, as for python floats
+        with np.errstate(all="ignore"):
+            for item in program:
+                if item.__class__ is float:
+                    values.append(item)
+                elif item.__class__ is str:
+                    values.append(np.asarray(_lookup(arrays, item), dtype=np.float64))
+                else:
+                    b = values.pop()
+                    a = values.pop()
+                    symbol = symbols[item]
+                    if symbol == "/" and np.any(np.asarray(b) == 0):
+                        raise ZeroDivisionError("float division by zero")
+                    values.append(vector_operators[symbol](a, b))
+        shape = np.broadcast_shapes(*(np.shape(v) for v in arrays.values()))
+        return np.broadcast_to(np.asarray(values[0], dtype=np.float64), shape)
+
+    def _run_array(self, program, arrays):
+        symbols = self._symbols()
+        vector_operators = {
+            "+": operator.add,
+            "-": operator.sub,
+            "*": operator.mul,
+            "/": operator.truediv,
+        }
+        lengths = {len(values) for values in arrays.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Variable arrays have different lengths: {sorted(lengths)}")
+        length = lengths.pop() if lengths else 1
+
+        values = []
+        for item in program:
+            if item.__class__ is float:
+                values.append(item)
+            elif item.__class__ is str:
+                values.append(array("d", _lookup(arrays, item)))
+            else:
+                b = values.pop()
+                a = values.pop()
+                function = vector_operators[symbols[item]]
+                if function is operator.truediv and (0.0 in b if isinstance(b, array) else b == 0):
+                    raise ZeroDivisionError("float division by zero")
+                if isinstance(a, float) and isinstance(b, float):
+                    values.append(function(a, b))
+                else:
+                    a = repeat(a) if isinstance(a, float) else a
+                    b = repeat(b) if isinstance(b, float) else b
+                    values.append(array("d", map(function, a, b)))
+
+        result = values[0]
+        if isinstance(result, float):
+            return array("d", repeat(result, length))
+        return result
+
+
+class _StreamEvaluator:
+    """Operator precedence parser behind Calculator.evaluate_stream, fed one token at a time."""
+
+    def __init__(self, operators, precendence, variables):
+        self.operators = operators
+        self.precendence = dict(precendence, neg=3)
+        self.precendence["("] = 0
+        self.variables = variables
+        self.values = []
+        self.stack = []  # operator symbols, "(" and "neg" for unary minus
+        self.expect_operand = True
+
+    def feed(self, token):
+        if token.__class__ is float:
+            self._operand(token)
+        elif token in self.operators:
+            self._operator(token)
+        elif token == "(":
+            if not self.expect_operand:
+                raise ValueError("Invalid expression")
+            self.stack.append("(")
+        elif token == ")":
+            self._close()
+        elif VARIABLE.fullmatch(token):
+            self._operand(float(_lookup(self.variables, token)))
+        else:
+            raise ValueError(f"Invalid operand: {token}")
+
+    def result(self):
+        if not self.values and not self.stack:
+            return None
+        if self.expect_operand:
+            raise ValueError("Invalid expression")
+        while self.stack:
+            if self.stack[-1] == "(":
+                raise ValueError("Unbalanced parentheses")
+            self._reduce()
+        return self.values[0]
+
+    def _operand(self, value):
+        if not self.expect_operand:
+            raise ValueError("Invalid expression")
+        self.values.append(value)
+        self.expect_operand = False
+
+    def _operator(self, token):
+        if self.expect_operand:
+            if token == "-":
+                self.stack.append("neg")
+            elif token != "+":
+                raise ValueError(f"Not enough operands for operator {token}")
             return
+        while self.stack and self.precendence[self.stack[-1]] >= self.precendence[token]:
+            self._reduce()
+        self.stack.append(token)
+        self.expect_operand = True
 
-        operator = operators.pop()
+    def _close(self):
+        if self.expect_operand:
+            raise ValueError("Invalid expression")
+        while self.stack and self.stack[-1] != "(":
+            self._reduce()
+        if not self.stack:
+            raise ValueError("Unbalanced parentheses")
+        self.stack.pop()
+
+    def _reduce(self):
+        operator = self.stack.pop()
+        values = self.values
+        if operator == "neg":
+            if not values:
+                raise ValueError("Not enough operands for operator -")
+            values.append(-values.pop())
+            return
         if len(values) < 2:
             raise ValueError(f"Not enough operands for operator {operator}")
-
         b = values.pop()
-        a = values.pop()
-        operation = self.operators[operator](a, b)
-        values.append(operation)
+        values.append(self.operators[operator](values.pop(), b))
+
+
+def _lookup(variables, name):
+    try:
+        return variables[name]
+    except (KeyError, TypeError):
+        raise ValueError(f"Unknown variable: {name}") from None
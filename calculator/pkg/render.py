@@ -1,10 +1,31 @@
 import json
+from json.encoder import encode_basestring_ascii
+
+# JSON for the float specials, as written by json.dumps
+_SPECIAL_FLOATS = {"inf": "Infinity", "-inf": "-Infinity", "nan": "NaN"}
+
+
+def _number(result) -> str:
+    if isinstance(result, float):
+        if result.is_integer():
+            return str(int(result))
+        text = repr(result)
+        return _SPECIAL_FLOATS.get(text, text)
+    return json.dumps(result)
 
 
 def format_json_output(expression: str, result: float, indent: int = 2) -> str:
+    if indent is None:
+        # One line, as json.dumps would write it, without building a dict per call
+        return f'{{"expression": {encode_basestring_ascii(expression)}, "result": {_number(result)}}}'
+
     if isinstance(result, float) and result.is_integer():
         result = int(result)
 
     output_data = {"expression": expression, "result": result}
 
     return json.dumps(output_data, indent=indent)
+
+
+def format_json_error(expression: str, error: Exception) -> str:
+    return f'{{"expression": {encode_basestring_ascii(expression)}, "error": {encode_basestring_ascii(str(error))}}}'
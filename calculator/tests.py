@@ -1,7 +1,15 @@
 # tests.py
 
+import io
+import json
+import math
 import unittest
+from array import array
+
+import pkg.calculator
 from pkg.calculator import Calculator
+from main import run_batch
+from pkg.render import format_json_error, format_json_output
 
 
 class TestCalculator(unittest.TestCase):
@@ -44,6 +52,160 @@ class TestCalculator(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.calculator.evaluate("+ 3")
 
+    def test_compiled_program_is_cached(self):
+        program = self.calculator.compile("3 * 4 + 5")
+        self.assertIs(self.calculator.compile(" 3  * 4 +   5 "), program)
+        self.assertEqual(self.calculator.evaluate("3  * 4 + 5"), 17)
+
+    def test_evaluate_caches_program(self):
+        self.assertEqual(self.calculator.evaluate("x - 2 * 3", x=10), 4)
+        program = self.calculator.compile("x - 2 * 3")
+        self.assertEqual(self.calculator._run(program, {"x": 1}), -5)
+        self.assertEqual(self.calculator.evaluate("x - 2 * 3", x=1), -5)
+
+    def test_cache_is_bounded(self):
+        calculator = Calculator(cache_size=2)
+        for expression in ["1 + 1", "2 + 2", "3 + 3"]:
+            calculator.evaluate(expression)
+        self.assertEqual(list(calculator._programs), ["2 + 2", "3 + 3"])
+
+    def test_division_by_zero_is_not_cached_away(self):
+        for _ in range(2):
+            with self.assertRaises(ZeroDivisionError):
+                self.calculator.evaluate("2 / 0")
+
+    def test_variables(self):
+        self.assertEqual(self.calculator.evaluate("x * 2 + y", x=3, y=1), 7)
+        with self.assertRaises(ValueError):
+            self.calculator.evaluate("x + 1")
+
+
+class TestEvaluateStream(unittest.TestCase):
+    def setUp(self):
+        self.calculator = Calculator()
+
+    def test_matches_evaluate(self):
+        for expression in ["3 + 5", "2 * 3 - 8 / 2 + 5", "10 / 4 - 1"]:
+            self.assertEqual(
+                self.calculator.evaluate_stream(expression),
+                self.calculator.evaluate(expression),
+            )
+
+    def test_no_whitespace_parentheses_and_unary_minus(self):
+        self.assertEqual(self.calculator.evaluate_stream("2*(3+4)--1"), 15)
+        self.assertEqual(self.calculator.evaluate_stream("-(2+3)*2"), -10)
+        self.assertEqual(self.calculator.evaluate_stream("x*-y", x=2, y=3), -6)
+
+    def test_chunks(self):
+        chunks = iter(["1", "0 + 2", "*(3", "-1e", "-1)"])
+        self.assertAlmostEqual(self.calculator.evaluate_stream(chunks), 15.8)
+
+    def test_long_expression(self):
+        expression = " + ".join(["1"] * 100000)
+        self.assertEqual(self.calculator.evaluate_stream(expression), 100000)
+
+    def test_long_expression_without_whitespace(self):
+        expression = "+".join(["12345678"] * 5000) + "-1e+3*(2-1)"
+        expected = 12345678 * 5000 - 1000
+        self.assertEqual(self.calculator.evaluate_stream(expression), expected)
+        chunks = (expression[i:i + 1000] for i in range(0, len(expression), 1000))
+        self.assertEqual(self.calculator.evaluate_stream(chunks), expected)
+
+    def test_invalid(self):
+        for expression in ["(1 + 2", "1 + 2)", "1 +", "$ 3", "2 3", "*"]:
+            with self.assertRaises(ValueError, msg=expression):
+                self.calculator.evaluate_stream(expression)
+        self.assertIsNone(self.calculator.evaluate_stream("  "))
+
+
+class TestEvaluateBatch(unittest.TestCase):
+    def setUp(self):
+        self.calculator = Calculator()
+        self.numpy = pkg.calculator.np
+
+    def tearDown(self):
+        pkg.calculator.np = self.numpy
+
+    def backends(self):
+        # NumPy when installed, and always the array.array fallback
+        backends = [None] if self.numpy is None else [self.numpy, None]
+        for np in backends:
+            pkg.calculator.np = np
+            with self.subTest(numpy=np is not None):
+                yield
+
+    def test_matches_scalar_path(self):
+        x = [1.0, 2.0, float("nan"), -4.5]
+        y = [3.0, 0.5, 1.0, 2.0]
+        for _ in self.backends():
+            result = self.calculator.evaluate_batch("x * 2 + y / 4 - 1", x=x, y=y)
+            for i, value in enumerate(result):
+                expected = self.calculator.evaluate("x * 2 + y / 4 - 1", x=x[i], y=y[i])
+                if math.isnan(expected):
+                    self.assertTrue(math.isnan(value))
+                else:
+                    self.assertEqual(value, expected)
+
+    def test_division_by_zero(self):
+        for _ in self.backends():
+            with self.assertRaises(ZeroDivisionError):
+                self.calculator.evaluate_batch("x / y", x=[1.0, 2.0], y=[1.0, 0.0])
+            with self.assertRaises(ZeroDivisionError):
+                self.calculator.evaluate_batch("x / 0", x=[1.0])
+
+    def test_constant_expression(self):
+        for _ in self.backends():
+            result = self.calculator.evaluate_batch("2 + 3 + x * 0", x=array("d", [1, 2]))
+            self.assertEqual(list(result), [5.0, 5.0])
+
+    def test_unknown_variable(self):
+        for _ in self.backends():
+            with self.assertRaises(ValueError):
+                self.calculator.evaluate_batch("x + z", x=[1.0])
+
+
+class TestRunBatch(unittest.TestCase):
+    def test_json_lines(self):
+        out = io.StringIO()
+        run_batch(Calculator(), ["3 + 5\n", "\n", "2 / 0\n", "10 / 4"], out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(
+            records,
+            [
+                {"expression": "3 + 5", "result": 8},
+                {"expression": "2 / 0", "error": "float division by zero"},
+                {"expression": "10 / 4", "result": 2.5},
+            ],
+        )
+
+    def test_compact_records_match_json_dumps(self):
+        for expression, result in [
+            ('say "hi" \\ ø', 2.5),
+            ("x", 3.0),
+            ("x", -0.1),
+            ("x", 1e300),
+            ("x", 1e-7),
+            ("x", float("inf")),
+            ("x", float("-inf")),
+            ("x", float("nan")),
+        ]:
+            expected = json.dumps(
+                {"expression": expression, "result": int(result) if result.is_integer() else result}
+            )
+            self.assertEqual(format_json_output(expression, result, indent=None), expected)
+        error = ValueError('bad "token" ø')
+        self.assertEqual(
+            format_json_error("1 $ 2", error), json.dumps({"expression": "1 $ 2", "error": str(error)})
+        )
+
+    def test_written_in_batches(self):
+        out = io.StringIO()
+        lines = [f"{i} + 1" for i in range(2500)]
+        run_batch(Calculator(), lines, out)
+        results = [json.loads(line)["result"] for line in out.getvalue().splitlines()]
+        self.assertEqual(results, list(range(1, 2501)))
+        self.assertTrue(out.getvalue().endswith("}\n"))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,78 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Functions that only read the workspace, the argument holding the path they read
+READ_ONLY = {
+    "get_files_info": "directory",
+    "get_file_content": "file_path",
+    "search_code": "directory",
+    "get_outline": "path",
+}
+# Functions that change a single path, everything else may change the whole workspace
+WRITES_PATH = {
+    "write_file": "file_path",
+    "edit_file": "file_path",
+}
+
+
+def _access(name, args):
+    """Returns (is_write, path) for a function call, path "." means the whole workspace."""
+    if name in READ_ONLY:
+        return False, os.path.normpath(args.get(READ_ONLY[name]) or ".")
+    if name in WRITES_PATH:
+        return True, os.path.normpath(args.get(WRITES_PATH[name]) or ".")
+    return True, "."
+
+
+def _overlaps(path_a, path_b):
+    if path_a == "." or path_b == ".":
+        return True
+    parts_a = path_a.split(os.sep)
+    parts_b = path_b.split(os.sep)
+    n = min(len(parts_a), len(parts_b))
+    return parts_a[:n] == parts_b[:n]
+
+
+class FunctionCallScheduler:
+    """Runs function calls on a bounded thread pool.
+
+    Calls are submitted in the order the model made them, a call only waits for
+    earlier calls it conflicts with: two calls conflict when at least one of
+    them writes and their paths overlap. Read-only calls run concurrently.
+    """
+
+    def __init__(self, run, max_workers=4):
+        self.run = run
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._submitted = []  # (is_write, path, future)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, function_call):
+        is_write, path = _access(function_call.name or "", function_call.args or {})
+        depends_on = [
+            future
+            for other_write, other_path, future in self._submitted
+            if (is_write or other_write) and _overlaps(path, other_path)
+        ]
+
+        def task():
+            # Earlier tasks were submitted first, so they are running or done
+            wait(depends_on)
+            return self.run(function_call)
+
+        future = self._executor.submit(task)
+        self._submitted.append((is_write, path, future))
+        return future
+
+    def map(self, function_calls):
+        """Runs all function_calls, returns their results in call order."""
+        futures = [self.submit(item) for item in function_calls]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,126 @@
+"""Record and replay model responses, to make repeated runs fast and deterministic.
+
+CassetteClient wraps a genai.Client (or anything with the same
+aio.models.generate_content_stream) and stores each request hash with its
+streamed response chunks in an append-only, gzip compressed JSON lines file.
+
+Modes:
+    record  always call the API, append the response to the cassette
+    replay  only serve responses from the cassette, fail on a miss
+    cache   serve from the cassette, call the API and record on a miss
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+MODES = ("record", "replay", "cache")
+
+
+def _dump(value):
+    if value is None:
+        return None
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, (list, tuple)):
+        return [_dump(item) for item in value]
+    return value
+
+
+def request_hash(model, contents, config=None) -> str:
+    request = {"model": model, "contents": _dump(contents), "config": _dump(config)}
+    encoded = json.dumps(request, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """Append-only gzip file of {"request": hash, "chunks": [...]} records, the last record for a hash wins."""
+
+    def __init__(self, path):
+        self.path = path
+        self._records = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            # Every append is its own gzip member, gzip.open reads them all
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                for line in file:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._records[record["request"]] = record["chunks"]
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, key):
+        # main.py only imports google.genai once the model is used
+        from google.genai import types
+
+        chunks = self._records.get(key)
+        if chunks is None:
+            return None
+        return [types.GenerateContentResponse.model_validate(chunk) for chunk in chunks]
+
+    def append(self, key, chunks):
+        chunks = [_dump(chunk) for chunk in chunks]
+        line = json.dumps({"request": key, "chunks": chunks}) + "\n"
+        with self._lock:
+            self._records[key] = chunks
+            with open(self.path, "ab") as file, gzip.GzipFile(fileobj=file, mode="wb") as gz:
+                gz.write(line.encode("utf-8"))
+
+
+class _CassetteModels:
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content_stream(self, model, contents, config=None):
+        client = self._client
+        key = request_hash(model, contents, config)
+        if client.mode != "record":
+            chunks = client.cassette.get(key)
+            if chunks is not None:
+                client.hits += 1
+
+                async def replay():
+                    for chunk in chunks:
+                        yield chunk
+
+                return replay()
+            if client.mode == "replay":
+                raise KeyError(
+                    f"No recorded response for request {key} in {client.cassette.path}"
+                )
+
+        client.misses += 1
+        stream = await client.client.aio.models.generate_content_stream(
+            model=model, contents=contents, config=config
+        )
+
+        async def record():
+            # Pass chunks on as they arrive, store the response once it is complete
+            recorded = []
+            async for chunk in stream:
+                recorded.append(chunk)
+                yield chunk
+            client.cassette.append(key, recorded)
+
+        return record()
+
+
+class CassetteClient:
+    """Wraps client so model calls are recorded to, or replayed from, the cassette at path."""
+
+    def __init__(self, client, path, mode="cache"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {mode}, expected one of {MODES}")
+        if client is None and mode != "replay":
+            raise ValueError(f"A client is required in {mode} mode")
+        self.client = client
+        self.mode = mode
+        self.cassette = Cassette(path)
+        self.hits = 0
+        self.misses = 0
+        self.aio = SimpleNamespace(models=_CassetteModels(self))
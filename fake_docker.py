@@ -0,0 +1,147 @@
+"""Local stand-in for the docker cli, runs "containers" as plain processes.
+
+Only implements the subset of commands used by functions/sandbox_pool.py and
+functions/run_python_file.py, so they can be tested without a docker daemon:
+
+    python fake_docker.py compose run [--rm] [-d] [--name NAME] [-w DIR] SERVICE CMD...
+    python fake_docker.py exec [-i] [-w DIR] NAME CMD...
+    python fake_docker.py inspect -f FORMAT NAME
+    python fake_docker.py diff NAME
+    python fake_docker.py rm -f NAME
+
+Environment:
+    FAKE_DOCKER_STATE      directory with one sub directory per running container
+    FAKE_DOCKER_WORKSPACE  host directory mounted as the container workdir (./sandbox_workspace)
+
+Each container gets a FAKE_DOCKER_ROOTFS directory, any file written there is
+reported by `diff`, which lets tests simulate a dirty container.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import uuid
+
+CONTAINER_WORKDIR = "/usr/src/app"
+
+
+def state_dir():
+    path = os.environ.get(
+        "FAKE_DOCKER_STATE", os.path.join(tempfile.gettempdir(), "fake_docker")
+    )
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def workspace_dir():
+    return os.path.realpath(os.environ.get("FAKE_DOCKER_WORKSPACE", "sandbox_workspace"))
+
+
+def container_dir(name):
+    return os.path.join(state_dir(), name)
+
+
+def rootfs_dir(name):
+    return os.path.join(container_dir(name), "rootfs")
+
+
+def error(message, code=1):
+    print(f"Error: {message}", file=sys.stderr)
+    return code
+
+
+def execute(cmd, workdir=None, rootfs=None):
+    cwd = workspace_dir()
+    if workdir:
+        if workdir.startswith(CONTAINER_WORKDIR):
+            workdir = os.path.relpath(workdir, CONTAINER_WORKDIR)
+        cwd = os.path.join(cwd, workdir)
+
+    if cmd and cmd[0] == "python":
+        cmd = [sys.executable] + cmd[1:]
+
+    env = dict(os.environ)
+    if rootfs:
+        env["FAKE_DOCKER_ROOTFS"] = rootfs
+    try:
+        return subprocess.run(cmd, cwd=cwd, env=env).returncode
+    except FileNotFoundError as e:
+        return error(str(e), 127)
+
+
+def compose_run(args):
+    detach = False
+    name = None
+    workdir = None
+    while args and args[0].startswith("-"):
+        option = args.pop(0)
+        if option in ("-d", "--detach"):
+            detach = True
+        elif option == "--name":
+            name = args.pop(0)
+        elif option in ("-w", "--workdir"):
+            workdir = args.pop(0)
+    if not args:
+        return error("service name required")
+    cmd = args[1:]  # args[0] is the service name
+
+    if not detach:
+        return execute(cmd, workdir=workdir)
+
+    name = name or uuid.uuid4().hex[:12]
+    os.makedirs(rootfs_dir(name))
+    print(name)
+    return 0
+
+
+def exec_(args):
+    workdir = None
+    while args and args[0].startswith("-"):
+        option = args.pop(0)
+        if option in ("-w", "--workdir"):
+            workdir = args.pop(0)
+    if not args:
+        return error("container name required")
+    name, cmd = args[0], args[1:]
+    if not os.path.isdir(container_dir(name)):
+        return error(f"No such container: {name}")
+    return execute(cmd, workdir=workdir, rootfs=rootfs_dir(name))
+
+
+def inspect(args):
+    name = args[-1]
+    print("true" if os.path.isdir(container_dir(name)) else "false")
+    return 0 if os.path.isdir(container_dir(name)) else 1
+
+
+def diff(args):
+    name = args[-1]
+    if not os.path.isdir(container_dir(name)):
+        return error(f"No such container: {name}")
+    for root, _dirs, files in os.walk(rootfs_dir(name)):
+        for file in files:
+            print("A /" + os.path.relpath(os.path.join(root, file), rootfs_dir(name)))
+    return 0
+
+
+def rm(args):
+    for name in args:
+        if name.startswith("-"):
+            continue
+        shutil.rmtree(container_dir(name), ignore_errors=True)
+    return 0
+
+
+def main(argv):
+    if argv[:2] == ["compose", "run"]:
+        return compose_run(argv[2:])
+    commands = {"exec": exec_, "inspect": inspect, "diff": diff, "rm": rm}
+    if not argv or argv[0] not in commands:
+        return error(f"unsupported command: {' '.join(argv)}")
+    return commands[argv[0]](argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
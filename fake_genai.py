@@ -0,0 +1,192 @@
+"""Local stand-in for genai.Client that replays scripted streamed responses.
+
+Used by the tests and bench_agent.py, needs no network and no API key:
+
+    client = FakeClient([
+        [call_chunk("get_files_info", directory=".")],
+        [text_chunk("The directory contains main.py")],
+    ])
+    asyncio.run(main.run_agent(client, "What is in the directory?"))
+
+Each response is a list of chunks. A chunk is a GenerateContentResponse or an
+async callable returning one, which lets a test wait for something to happen
+in the middle of a stream. For concurrent sessions, responses can be a dict
+from the prompt (the text of the first message) to that session's responses.
+
+FakeGeminiServer is a local HTTP server for testing the real genai.Client,
+including its error handling, e.g. a 429 followed by a response:
+
+    with FakeGeminiServer([error(429, retry_after=1), [text_chunk("Hi")]]) as server:
+        client = server.client()
+"""
+
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from google import genai
+from google.genai import types
+
+STATUS = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 503: "UNAVAILABLE", 504: "DEADLINE_EXCEEDED"}
+
+
+def chunk(*parts, prompt_tokens=None, response_tokens=None):
+    usage_metadata = None
+    if prompt_tokens is not None or response_tokens is not None:
+        usage_metadata = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens, candidates_token_count=response_tokens
+        )
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=list(parts)))],
+        usage_metadata=usage_metadata,
+    )
+
+
+def text_chunk(text, **kwargs):
+    return chunk(types.Part(text=text), **kwargs)
+
+
+def call_chunk(name, **args):
+    return chunk(types.Part(function_call=types.FunctionCall(name=name, args=args)))
+
+
+class FakeModels:
+    def __init__(self, responses, latency=0.0, chunk_latency=0.0):
+        if isinstance(responses, dict):
+            self.responses = {prompt: list(items) for prompt, items in responses.items()}
+        else:
+            self.responses = list(responses)
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.requests = []
+        # Size of the json encoded contents of each request
+        self.request_bytes = []
+
+    def _record(self, contents, config):
+        contents = list(contents)
+        self.requests.append(contents)
+        self.request_bytes.append(
+            sum(len(content.model_dump_json(exclude_none=True)) for content in contents)
+        )
+        responses = self.responses
+        if isinstance(responses, dict):
+            responses = responses.get(contents[0].parts[0].text, [])
+        if not responses:
+            raise IndexError("FakeClient has no scripted response left")
+        return responses.pop(0)
+
+    async def generate_content_stream(self, model, contents, config=None):
+        chunks = self._record(contents, config)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        async def stream():
+            for item in chunks:
+                if self.chunk_latency:
+                    await asyncio.sleep(self.chunk_latency)
+                if callable(item):
+                    item = await item()
+                yield item
+
+        return stream()
+
+
+class FakeClient:
+    """Stand-in for genai.Client, replays a list of streamed responses.
+
+    latency is the simulated time to the first chunk, chunk_latency the time
+    between chunks.
+    """
+
+    def __init__(self, responses, latency=0.0, chunk_latency=0.0):
+        self.aio = SimpleNamespace(models=FakeModels(responses, latency, chunk_latency))
+
+
+def error(code, retry_after=None, retry_delay=None):
+    """A scripted error response for FakeGeminiServer.
+
+    retry_after is sent as the Retry-After header, retry_delay as a RetryInfo
+    detail in the body, the way the Gemini API reports quota errors.
+    """
+    details = []
+    if retry_delay is not None:
+        details.append(
+            {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_delay}s"}
+        )
+    body = {
+        "error": {
+            "code": code,
+            "message": f"Scripted error {code}",
+            "status": STATUS.get(code, "UNKNOWN"),
+            "details": details,
+        }
+    }
+    headers = {}
+    if retry_after is not None:
+        headers["Retry-After"] = str(retry_after)
+    return {"code": code, "headers": headers, "body": body}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server.fake
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.requests.append(self.path)
+            response = server.responses.pop(0) if server.responses else error(500)
+
+        if isinstance(response, dict):
+            body = json.dumps(response["body"]).encode()
+            self.send_response(response["code"])
+            for key, value in response["headers"].items():
+                self.send_header(key, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        # Server sent events, one chunk per event
+        body = b"".join(
+            b"data: "
+            + json.dumps(item.model_dump(mode="json", by_alias=True, exclude_none=True)).encode()
+            + b"\r\n\r\n"
+            for item in response
+        )
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeGeminiServer:
+    """Local server for streamGenerateContent requests, answers with the scripted responses in order.
+
+    A response is a list of chunks, sent as server sent events, or an error().
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.fake = self
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def client(self):
+        return genai.Client(api_key="fake", http_options=types.HttpOptions(base_url=self.url))
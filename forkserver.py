@@ -0,0 +1,207 @@
+"""Fork server running inside the sandbox container, forks a child per python run.
+
+Started by SandboxPool with `docker exec -i CONTAINER python forkserver.py`,
+it imports the --preload modules once and then reads one JSON request per
+line from stdin:
+
+    {"file_path": "calculator/main.py", "args": ["1 + 2"], "timeout": 30, "max_bytes": 32768, "spill": null}
+
+Each request is run in a forked child with runpy, as `python file_path args`
+would, and answered with one JSON line on stdout:
+
+    {"returncode": 0, "stdout": "...", "stderr": "...", "timed_out": false}
+
+The child gets its own stdout/stderr buffers (memfd, not files in the
+container), /dev/null as stdin and its own process group, which is killed
+when the run exceeds its timeout. Only the first and last max_bytes / 2 of
+each are returned, when spill is a directory longer output is copied there
+in full. Only uses the standard library, it is copied into the sandbox image
+by Dockerfile.sandbox_executor.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import runpy
+import select
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import traceback
+
+# Same marker as functions/bounded_output.py
+OMITTED = "\n... [{} bytes omitted] ...\n"
+
+
+def _buffer(name):
+    # memfd does not change the container filesystem, which SandboxPool checks with docker diff
+    if hasattr(os, "memfd_create"):
+        return os.fdopen(os.memfd_create(name), "w+b")
+    return tempfile.TemporaryFile()
+
+
+def _read(file, max_bytes=None, spill=None):
+    """Returns the head and tail of file, copies all of it to spill when it does not fit."""
+    size = file.seek(0, os.SEEK_END)
+    file.seek(0)
+    if max_bytes is None or size <= max_bytes:
+        return file.read().decode("utf-8", errors="replace")
+    if spill:
+        with open(spill, "wb") as out:
+            shutil.copyfileobj(file, out)
+        file.seek(0)
+    head_size = max_bytes // 2
+    tail_size = max_bytes - head_size
+    head = file.read(head_size)
+    file.seek(size - tail_size)
+    tail = file.read(tail_size)
+    omitted = size - head_size - tail_size
+    return (
+        head.decode("utf-8", errors="replace")
+        + OMITTED.format(omitted)
+        + tail.decode("utf-8", errors="replace")
+    )
+
+
+def _spill_paths(directory):
+    if not directory:
+        return None, None
+    os.makedirs(directory, exist_ok=True)
+    paths = (os.path.join(directory, "stdout.txt"), os.path.join(directory, "stderr.txt"))
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+    return paths
+
+
+def _child(request, stdout, stderr):
+    """Runs in the forked process, never returns."""
+    code = 0
+    try:
+        os.setpgid(0, 0)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(stdout.fileno(), 1)
+        os.dup2(stderr.fileno(), 2)
+        sys.stdin = open(os.devnull)
+        sys.stdout = open(1, "w", closefd=False)
+        sys.stderr = open(2, "w", closefd=False)
+
+        if request.get("cwd"):
+            os.chdir(request["cwd"])
+        path = request["file_path"]
+        sys.argv = [path] + list(request.get("args") or [])
+        sys.path[0] = os.path.dirname(os.path.abspath(path))
+        try:
+            runpy.run_path(path, run_name="__main__")
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+    except FileNotFoundError as e:
+        # Same message and code as python itself
+        print(f"python: can't open file {e.filename!r}: [Errno {e.errno}] {e.strerror}", file=sys.stderr)
+        code = 2
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _wait(pid, timeout):
+    """Returns the wait status of pid, None when it is still running after timeout seconds."""
+    if hasattr(os, "pidfd_open"):
+        fd = os.pidfd_open(pid)
+        try:
+            ready, _, _ = select.select([fd], [], [], timeout)
+        finally:
+            os.close(fd)
+        if not ready:
+            return None
+        return os.waitpid(pid, 0)[1]
+
+    deadline = time.monotonic() + timeout
+    delay = 0.0005
+    while True:
+        finished, status = os.waitpid(pid, os.WNOHANG)
+        if finished:
+            return status
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+
+def run(request):
+    timeout = request.get("timeout", 30)
+    with _buffer("stdout") as stdout, _buffer("stderr") as stderr:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            _child(request, stdout, stderr)
+
+        status = _wait(pid, timeout)
+        timed_out = status is None
+        if timed_out:
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            status = os.waitpid(pid, 0)[1]
+        max_bytes = request.get("max_bytes")
+        spill_stdout, spill_stderr = _spill_paths(request.get("spill"))
+        return {
+            "returncode": os.waitstatus_to_exitcode(status),
+            "stdout": _read(stdout, max_bytes, spill_stdout),
+            "stderr": _read(stderr, max_bytes, spill_stderr),
+            "timed_out": timed_out,
+        }
+
+
+def serve(preload=()):
+    # Keep the protocol on its own descriptor, stray prints go to stderr
+    protocol = os.fdopen(os.dup(1), "w")
+    os.dup2(2, 1)
+
+    loaded = []
+    for name in preload:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except Exception as e:
+            print(f"forkserver: unable to preload {name}: {e}", file=sys.stderr)
+    protocol.write(json.dumps({"ready": True, "preloaded": loaded}) + "\n")
+    protocol.flush()
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            response = run(json.loads(line))
+        except Exception as e:
+            response = {"error": f"{type(e).__name__}: {e}"}
+        protocol.write(json.dumps(response) + "\n")
+        protocol.flush()
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Fork server for the sandbox")
+    argparser.add_argument(
+        "--preload", default="", help="Comma separated modules to import before forking"
+    )
+    args = argparser.parse_args()
+    serve([name for name in args.preload.split(",") if name])
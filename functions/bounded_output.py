@@ -0,0 +1,163 @@
+import os
+import subprocess
+import threading
+
+# Bytes of stdout and of stderr kept from a run, half from the start and half from the end
+MAX_OUTPUT_BYTES = 32 * 1024
+# Replaces the middle of the output, forkserver.py uses the same format
+OMITTED = "\n... [{} bytes omitted] ...\n"
+# Longest partial line kept back while waiting for its end, longer lines are not filtered
+MAX_LINE_BYTES = 4096
+
+
+class _Ring:
+    """Fixed size ring buffer holding the last size bytes written."""
+
+    def __init__(self, size):
+        self.buffer = bytearray(size)
+        self.pos = 0
+        self.full = False
+
+    def write(self, data):
+        size = len(self.buffer)
+        if size == 0:
+            return
+        if len(data) >= size:
+            self.buffer[:] = data[-size:]
+            self.pos = 0
+            self.full = True
+            return
+        end = self.pos + len(data)
+        if end <= size:
+            self.buffer[self.pos:end] = data
+        else:
+            first = size - self.pos
+            self.buffer[self.pos:] = data[:first]
+            self.buffer[:end - size] = data[first:]
+        self.pos = end % size
+        self.full = self.full or end >= size
+
+    def getvalue(self):
+        if self.full:
+            return bytes(self.buffer[self.pos:] + self.buffer[:self.pos])
+        return bytes(self.buffer[:self.pos])
+
+
+class BoundedOutput:
+    """Keeps the head and tail of a byte stream, in memory bounded by max_bytes.
+
+    Lines for which skip_line(line) is true are dropped as they arrive, before
+    they count towards the limit. With spill, everything kept is also written
+    to that file.
+    """
+
+    def __init__(self, max_bytes=MAX_OUTPUT_BYTES, skip_line=None, spill=None):
+        self.head_size = max_bytes // 2
+        self.head = bytearray()
+        self.tail = _Ring(max_bytes - self.head_size)
+        self.total = 0
+        self.skip_line = skip_line
+        self._partial = b""
+        self._spill = open(spill, "wb") if spill else None
+
+    @property
+    def omitted(self):
+        return max(self.total - len(self.head) - len(self.tail.buffer), 0)
+
+    def write(self, data):
+        if self.skip_line is not None:
+            data = self._filter(data)
+        if data:
+            self._append(data)
+
+    def _append(self, data):
+        if self._spill is not None:
+            self._spill.write(data)
+        self.total += len(data)
+        room = self.head_size - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail.write(data)
+
+    def _filter(self, data):
+        data = self._partial + data
+        end = data.rfind(b"\n") + 1
+        if end == 0 and len(data) <= MAX_LINE_BYTES:
+            self._partial = data
+            return b""
+        if end == 0:
+            end = len(data)
+        self._partial = data[end:]
+        return b"".join(
+            line for line in data[:end].splitlines(keepends=True) if not self.skip_line(line)
+        )
+
+    def close(self):
+        """Flushes a last line without a newline, and closes the spill file."""
+        partial, self._partial = self._partial, b""
+        if partial and not self.skip_line(partial):
+            self._append(partial)
+        if self._spill is not None:
+            self._spill.close()
+
+    def getvalue(self):
+        head = self.head.decode("utf-8", errors="replace")
+        tail = self.tail.getvalue().decode("utf-8", errors="replace")
+        if self.omitted:
+            return head + OMITTED.format(self.omitted) + tail
+        return head + tail
+
+
+def _pump(pipe, output):
+    for data in iter(lambda: pipe.read1(65536), b""):
+        output.write(data)
+    pipe.close()
+
+
+def run_bounded(cmd, timeout, max_bytes=MAX_OUTPUT_BYTES, spill=None, skip_stderr_line=None, **kwargs):
+    """Like subprocess.run(cmd, capture_output=True, text=True, timeout=timeout) with bounded output.
+
+    Output is read as it is produced, at most max_bytes of stdout and of
+    stderr are kept. With spill, a directory, output that does not fit is
+    written in full to stdout.txt and stderr.txt there.
+    """
+    spill_files = _spill_paths(spill) if spill else (None, None)
+    stdout = BoundedOutput(max_bytes, spill=spill_files[0])
+    stderr = BoundedOutput(max_bytes, skip_line=skip_stderr_line, spill=spill_files[1])
+    with subprocess.Popen(
+        cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs
+    ) as process:
+        threads = [
+            threading.Thread(target=_pump, args=(process.stdout, stdout), daemon=True),
+            threading.Thread(target=_pump, args=(process.stderr, stderr), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+            for output, path in zip((stdout, stderr), spill_files):
+                output.close()
+                # Only keep spill files of truncated output
+                if path is not None and not output.omitted:
+                    os.remove(path)
+    return subprocess.CompletedProcess(
+        cmd, process.returncode, stdout.getvalue(), stderr.getvalue()
+    )
+
+
+def _spill_paths(directory):
+    """Returns the (stdout, stderr) spill files in directory, removing those of an earlier run."""
+    os.makedirs(directory, exist_ok=True)
+    paths = (os.path.join(directory, "stdout.txt"), os.path.join(directory, "stderr.txt"))
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+    return paths
@@ -0,0 +1,135 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+# Reply used instead of the full result when the model already has it
+UNCHANGED = "is unchanged since your last read"
+
+
+def signature(path):
+    """Cheap validator for a cached result, changes when the file or directory changes."""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _sizeof(value):
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(_sizeof(item) for item in value) + 8 * len(value)
+    if isinstance(value, dict):
+        return sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class ToolCache:
+    """LRU cache of workspace tool results, bounded by the total size of the values.
+
+    Entries are keyed on (kind, resolved path, arguments) and validated with the
+    (mtime, size) signature of the path, so a file changed by any means is read
+    again. Directory listings are also invalidated explicitly by write_file, as
+    a file changing size does not change the mtime of its directory.
+
+    Callbacks added with subscribe() are told about every invalidation, with
+    the path, or None when anything in the workspace may have changed.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, notify_unchanged=False):
+        self.max_bytes = max_bytes
+        self.notify_unchanged = notify_unchanged
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (signature, value, size)
+        self._seen = {}  # key -> signature last returned to the model
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def get(self, key, sig):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != sig:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, sig, value):
+        size = _sizeof(value)
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (sig, value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def seen_unchanged(self, key, sig):
+        """Records that the result for key was returned, True if it was returned before with the same signature."""
+        with self._lock:
+            unchanged = self._seen.get(key) == sig
+            self._seen[key] = sig
+            return unchanged
+
+    def forget_seen(self, kind=None):
+        """Call when earlier results, of one kind or all, are no longer in the conversation."""
+        with self._lock:
+            if kind is None:
+                self._seen.clear()
+            else:
+                for key in [key for key in self._seen if key[0] == kind]:
+                    del self._seen[key]
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def _notify(self, path):
+        for callback in self._subscribers:
+            callback(path)
+
+    def invalidate(self, path):
+        """Drops entries for path, anything below it, and listings of its parents."""
+        path = os.path.realpath(path)
+        parents = set()
+        parent = os.path.dirname(path)
+        while parent not in parents:
+            parents.add(parent)
+            parent = os.path.dirname(parent)
+
+        def affected(key):
+            return key[1] == path or key[1].startswith(path + os.sep) or key[1] in parents
+
+        self._drop(affected)
+        self._notify(path)
+
+    def invalidate_kind(self, kind):
+        """Drops all entries of one kind, e.g. listings after a script may have changed files."""
+        self._drop(lambda key: key[0] == kind)
+        self._notify(None)
+
+    def _drop(self, affected):
+        with self._lock:
+            for key in [key for key in self._entries if affected(key)]:
+                self._discard(key)
+            for key in [key for key in self._seen if affected(key)]:
+                del self._seen[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._seen.clear()
+            self._bytes = 0
+        self._notify(None)
+
+
+# Shared by the workspace tools
+tool_cache = ToolCache()
@@ -0,0 +1,216 @@
+import os
+import re
+
+from functions.write_file import _atomic_write, review_changes
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def get_schema():
+    from google.genai import types
+
+    return types.FunctionDeclaration(
+        name=edit_file.__name__,
+        description=edit_file.__doc__,
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "file_path": types.Schema(
+                    type=types.Type.STRING,
+                    description="Filename relative to the working directory to edit",
+                ),
+                "search": types.Schema(
+                    type=types.Type.STRING,
+                    description="Exact text to replace, must occur exactly once in the file",
+                ),
+                "replace": types.Schema(
+                    type=types.Type.STRING,
+                    description="Replacement for search, or for the lines start_line to end_line",
+                ),
+                "start_line": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="First line to replace, the first line in the file is 1",
+                ),
+                "end_line": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Last line to replace (inclusive), defaults to start_line",
+                ),
+                "diff": types.Schema(
+                    type=types.Type.STRING,
+                    description="Unified diff to apply to the file, as produced by diff -u",
+                ),
+            },
+        ),
+    )
+
+
+def _replace_search(content, search, replace) -> str:
+    if search == "":
+        raise ValueError("search must not be empty")
+    count = content.count(search)
+    if count == 0:
+        raise ValueError("search text not found in file")
+    if count > 1:
+        raise ValueError(
+            f"search text found {count} times, include more surrounding lines to make it unique"
+        )
+    return content.replace(search, replace, 1)
+
+
+def _replace_lines(content, start_line, end_line, replace) -> str:
+    lines = content.splitlines(keepends=True)
+    start_line = int(start_line)
+    end_line = int(end_line) if end_line is not None else start_line
+    if start_line < 1 or end_line < start_line - 1 or end_line > len(lines):
+        raise ValueError(
+            f"Invalid line range {start_line}-{end_line}, the file has {len(lines)} lines"
+        )
+    if replace and not replace.endswith("\n") and end_line < len(lines):
+        replace += "\n"
+    return "".join(lines[: start_line - 1]) + replace + "".join(lines[end_line:])
+
+
+def _apply_diff(content, diff) -> str:
+    lines = content.splitlines(keepends=True)
+    result = []
+    position = 0  # index in lines of the first line not yet copied
+    hunks = 0
+    diff_lines = diff.splitlines(keepends=True)
+    i = 0
+    while i < len(diff_lines):
+        header = HUNK_HEADER.match(diff_lines[i])
+        i += 1
+        if header is None:
+            continue  # file headers and anything else outside of hunks
+        hunks += 1
+
+        old, new = [], []
+        while i < len(diff_lines) and not _ends_hunk(diff_lines, i):
+            line = diff_lines[i]
+            i += 1
+            if line.startswith("\\"):  # \ No newline at end of file
+                continue
+            tag, text = line[:1], line[1:]
+            if text == "" and tag not in " -+":
+                tag, text = " ", "\n"  # blank context line with the space stripped
+            if tag in (" ", "-"):
+                old.append(text)
+            if tag == " ":
+                new.append(len(old) - 1)  # the context line as it is in the file
+            elif tag == "+":
+                new.append(text)
+            if tag not in " -+":
+                raise ValueError(f"Hunk {hunks} has an invalid line: {line!r}")
+
+        # Prefer the position from the header, then the closest match after the previous hunk.
+        # Without old lines the header gives the line to insert after.
+        expected = int(header.group(1)) - (1 if old else 0)
+        expected = max(expected, position)
+        start = _find_lines(lines, old, expected, position)
+        if start is None:
+            raise ValueError(
+                f"Hunk {hunks} does not apply, the file does not contain:\n{''.join(old)}"
+            )
+        result.extend(lines[position:start])
+        result.extend(lines[start + item] if isinstance(item, int) else item for item in new)
+        position = start + len(old)
+
+    if hunks == 0:
+        raise ValueError("diff contains no hunks (lines starting with @@)")
+    result.extend(lines[position:])
+    return "".join(result)
+
+
+def _ends_hunk(diff_lines, i):
+    line = diff_lines[i]
+    if line.startswith(("@@", "diff ")):
+        return True
+    # The file header of the next file in the diff
+    return (
+        line.startswith("--- ")
+        and i + 1 < len(diff_lines)
+        and diff_lines[i + 1].startswith("+++ ")
+    )
+
+
+def _matches(lines, old, start):
+    return all(
+        lines[start + k].rstrip("\r\n") == text.rstrip("\r\n")
+        for k, text in enumerate(old)
+    )
+
+
+def _find_lines(lines, old, expected, minimum):
+    last = len(lines) - len(old)
+    candidates = sorted(range(minimum, last + 1), key=lambda n: abs(n - expected))
+    for start in candidates:
+        if _matches(lines, old, start):
+            return start
+    return None
+
+
+def _edit_file(
+    working_directory,
+    file_path,
+    search=None,
+    replace=None,
+    start_line=None,
+    end_line=None,
+    diff=None,
+) -> tuple[str, str]:
+    """Applies one edit to file_path, returns the old and new content."""
+    working_directory = os.path.realpath(working_directory)
+    path = os.path.realpath(os.path.join(working_directory, file_path))
+
+    path_inside_working_directory = (
+        os.path.commonpath([working_directory, path]) == working_directory
+    )
+
+    if not path_inside_working_directory:
+        raise ValueError(
+            f'Cannot edit "{file_path}" as it is outside the permitted working directory'
+        )
+
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f'File not found or is not a regular file: "{file_path}"')
+
+    # newline="" keeps \r\n, so search text matches what get_file_content returned
+    # and untouched lines keep their endings
+    with open(path, "r", newline="") as file:
+        content = file.read()
+
+    if diff is not None:
+        new_content = _apply_diff(content, diff)
+    elif search is not None:
+        new_content = _replace_search(content, search, replace or "")
+    elif start_line is not None:
+        new_content = _replace_lines(content, start_line, end_line, replace or "")
+    else:
+        raise ValueError("Provide search and replace, start_line and replace, or diff")
+
+    _atomic_write(path, new_content)
+    return content, new_content
+
+
+def edit_file(
+    working_directory,
+    file_path,
+    search=None,
+    replace=None,
+    start_line=None,
+    end_line=None,
+    diff=None,
+) -> str:
+    """Constrained to the working directory, makes a targeted change to an existing file without resending all of it.
+    Either replace a unique search text, replace the lines start_line to end_line, or apply a unified diff."""
+    try:
+        old_content, new_content = _edit_file(
+            working_directory, file_path, search, replace, start_line, end_line, diff
+        )
+        review_changes(file_path, old_content, new_content)
+        return (
+            f'Successfully edited "{file_path}" '
+            f"({len(old_content)} -> {len(new_content)} characters)"
+        )
+    except Exception as e:
+        return f"Error: {str(e)}"
@@ -1,11 +1,18 @@
+import mmap
 import os
+import threading
 
-from google.genai import types
+from functions.cache import UNCHANGED, signature, tool_cache
+from functions.tracing import tracer
 
 MAX_CHARS = 10000
+# Every LINE_INDEX_STRIDE'th line start is kept in the sparse line index
+LINE_INDEX_STRIDE = 1000
 
 
 def get_schema():
+    from google.genai import types
+
     return types.FunctionDeclaration(
         name=get_file_content.__name__,
         description=get_file_content.__doc__,
@@ -16,12 +23,28 @@ def get_schema():
                     type=types.Type.STRING,
                     description="Filename relative to the working directory to read.",
                 ),
+                "offset": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Optional byte offset to start reading from.",
+                ),
+                "length": types.Schema(
+                    type=types.Type.INTEGER,
+                    description=f"Optional number of bytes to read from offset, at most {MAX_CHARS}.",
+                ),
+                "start_line": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Optional first line to read, the first line in the file is 1.",
+                ),
+                "end_line": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Optional last line to read (inclusive).",
+                ),
             },
         ),
     )
 
 
-def _get_file_content(working_directory, file_path, max_chars=-1) -> tuple[str, bool]:
+def _resolve(working_directory, file_path):
     working_directory = os.path.realpath(working_directory)
     path = os.path.realpath(os.path.join(working_directory, file_path))
 
@@ -38,22 +61,159 @@ def _get_file_content(working_directory, file_path, max_chars=-1) -> tuple[str,
         raise FileNotFoundError(
             f'File not found or is not a regular file: "{file_path}"'
         )
+    return path
+
 
-    with open(path, "r") as file:
+def _get_file_content(working_directory, file_path, max_chars=-1) -> tuple[str, bool]:
+    path = _resolve(working_directory, file_path)
+
+    sig = signature(path)
+    key = ("get_file_content", path, max_chars)
+    cached = tool_cache.get(key, sig)
+    if cached is not None:
+        return cached
+
+    # newline="" keeps \r\n, so the offset of a truncated read is the byte offset in the file
+    with tracer.span("file_read", path=path) as span, open(path, "r", encoding="utf-8", newline="") as file:
         if max_chars < 0:
-            return file.read(), False
-        # read one extra char to detect truncation
-        data = file.read(max_chars + 1)
-        is_truncated = len(data) > max_chars
-        return data[:max_chars], is_truncated
+            result = file.read(), False
+        else:
+            # read one extra char to detect truncation
+            data = file.read(max_chars + 1)
+            is_truncated = len(data) > max_chars
+            result = data[:max_chars], is_truncated
+        span["chars"] = len(result[0])
+
+    tool_cache.put(key, sig, result)
+    return result
+
+
+class LineIndex:
+    """Sparse index of line start offsets, extended lazily as later lines are requested."""
 
+    def __init__(self):
+        self.offsets = [0]  # start of line 1 + i * LINE_INDEX_STRIDE
+        self.complete = False
+        # Shared through tool_cache by concurrent reads of the same file
+        self._lock = threading.Lock()
 
-def get_file_content(working_directory, file_path, max_chars=MAX_CHARS) -> str:
-    f"""Constrained to the working directory, returns file content as string, output is limited to {MAX_CHARS} bytes."""
+    def seek(self, mm, line):
+        """Returns the byte offset where line (1-based) starts, or None past the end of the file."""
+        checkpoint = (line - 1) // LINE_INDEX_STRIDE
+        with self._lock:
+            while len(self.offsets) <= checkpoint and not self.complete:
+                pos = _skip_lines(mm, self.offsets[-1], LINE_INDEX_STRIDE)
+                if pos is None or pos >= len(mm):
+                    self.complete = True
+                else:
+                    self.offsets.append(pos)
+            if checkpoint >= len(self.offsets):
+                return None
+            start = self.offsets[checkpoint]
+        return _skip_lines(mm, start, (line - 1) % LINE_INDEX_STRIDE)
+
+
+def _skip_lines(mm, pos, count):
+    for _ in range(count):
+        pos = mm.find(b"\n", pos)
+        if pos < 0:
+            return None
+        pos += 1
+    return pos
+
+
+def _is_continuation(mm, pos):
+    # utf-8 continuation bytes look like 0b10xxxxxx
+    return pos < len(mm) and mm[pos] & 0xC0 == 0x80
+
+
+def _read_window(
+    path, offset=None, length=None, start_line=None, end_line=None, max_chars=MAX_CHARS
+) -> tuple[str, dict | None]:
+    """Reads a byte or line window, returns the text and the arguments to read the next window."""
+    if os.path.getsize(path) == 0:
+        return "", None
+
+    with tracer.span("file_read", path=path, window=True), open(path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        size = len(mm)
+        if start_line is not None or end_line is not None:
+            start_line = max(int(start_line or 1), 1)
+            sig = signature(path)
+            index = tool_cache.get(("line_index", path), sig)
+            if index is None:
+                index = LineIndex()
+                tool_cache.put(("line_index", path), sig, index)
+            start = index.seek(mm, start_line)
+            if start is None:
+                return "", None
+
+            end = size
+            if end_line is not None and int(end_line) >= start_line:
+                end = _skip_lines(mm, start, int(end_line) - start_line + 1) or size
+            if end - start <= max_chars:
+                next_window = None
+                if end < size and end_line is not None:
+                    next_window = {"start_line": int(end_line) + 1}
+                return mm[start:end].decode("utf-8", errors="replace"), next_window
+
+            # Too long, return as many whole lines as fit
+            cut = mm.rfind(b"\n", start, start + max_chars)
+            if cut < 0:
+                end = start + max_chars
+                while end > start and _is_continuation(mm, end):
+                    end -= 1
+                return mm[start:end].decode("utf-8", errors="replace"), {"offset": end}
+            data = mm[start:cut + 1]
+            next_line = start_line + data.count(b"\n")
+            return data.decode("utf-8", errors="replace"), {"start_line": next_line}
+
+        start = min(max(int(offset or 0), 0), size)
+        while start < size and _is_continuation(mm, start):
+            start += 1
+        if length is None:
+            length = max_chars
+        end = min(start + min(int(length), max_chars), size)
+        while end > start and _is_continuation(mm, end):
+            end -= 1
+        next_window = {"offset": end} if end < size else None
+        return mm[start:end].decode("utf-8", errors="replace"), next_window
+
+
+def get_file_content(
+    working_directory,
+    file_path,
+    max_chars=MAX_CHARS,
+    offset=None,
+    length=None,
+    start_line=None,
+    end_line=None,
+) -> str:
+    """Constrained to the working directory, returns file content as string, output is limited to 10000 bytes.
+    Use offset/length or start_line/end_line to read a window of a larger file."""
+    window = (offset, length, start_line, end_line)
     try:
-        content, truncated = _get_file_content(working_directory, file_path, max_chars)
-        if truncated:
-            content += f'...File "{file_path}" truncated at {max_chars} characters'
+        path = _resolve(working_directory, file_path)
+        if window == (None, None, None, None):
+            content, truncated = _get_file_content(working_directory, file_path, max_chars)
+            next_window = None
+            if truncated:
+                next_window = {"offset": len(content.encode("utf-8"))}
+        else:
+            content, next_window = _read_window(path, *window, max_chars=max_chars)
+
+        if tool_cache.notify_unchanged:
+            key = ("get_file_content", path, max_chars, window)
+            if tool_cache.seen_unchanged(key, signature(path)):
+                return f'File "{file_path}" {UNCHANGED}.'
+        if next_window is not None:
+            arguments = ", ".join(f"{k}={v}" for k, v in next_window.items())
+            if window == (None, None, None, None):
+                content += f'...File "{file_path}" truncated at {max_chars} characters'
+            else:
+                content += f'...File "{file_path}" continues'
+            content += f", call again with {arguments} to read the next window"
         return content
     except Exception as e:
         return f"Error: {str(e)}"
@@ -1,9 +1,22 @@
+import fnmatch
 import os
 
-from google.genai import types
+from functions.cache import UNCHANGED, signature, tool_cache
+from functions.tracing import tracer
+
+DEFAULT_EXCLUDE = (".git", ".venv", "__pycache__")
+# Entries returned per call in recursive mode, continue with cursor
+LIST_LIMIT = 500
+SORT_KEYS = {
+    "name": lambda item: item["name"],
+    "size": lambda item: -item["size"],
+    "mtime": lambda item: -item["mtime"],
+}
 
 
 def get_schema():
+    from google.genai import types
+
     return types.FunctionDeclaration(
         name=get_files_info.__name__,
         description=get_files_info.__doc__,
@@ -18,12 +31,96 @@ def get_schema():
                         "If not provided, lists files in the working directory itself."
                     ),
                 ),
+                "recursive": types.Schema(
+                    type=types.Type.BOOLEAN,
+                    description="List sub directories as well, one compact line per entry.",
+                ),
+                "max_depth": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Optional maximum depth when recursive, 1 lists only the directory itself.",
+                ),
+                "include": types.Schema(
+                    type=types.Type.ARRAY,
+                    items=types.Schema(type=types.Type.STRING),
+                    description='Optional glob patterns of files to list. Example: ["*.py"]',
+                ),
+                "exclude": types.Schema(
+                    type=types.Type.ARRAY,
+                    items=types.Schema(type=types.Type.STRING),
+                    description=f"Optional glob patterns to skip, default {list(DEFAULT_EXCLUDE)}.",
+                ),
+                "sort": types.Schema(
+                    type=types.Type.STRING,
+                    description=f"Order of entries within a directory, one of {list(SORT_KEYS)}.",
+                ),
+                "cursor": types.Schema(
+                    type=types.Type.INTEGER,
+                    description="Continue a truncated recursive listing from this cursor.",
+                ),
             },
         ),
     )
 
 
-def _get_files_info(working_directory, directory="."):
+def _scan(path):
+    """Returns the entries of one directory, cached until the directory changes."""
+    sig = signature(path)
+    key = ("get_files_info", path)
+    items = tool_cache.get(key, sig)
+    if items is None:
+        items = []
+        with tracer.span("list_dir", path=path) as span, os.scandir(path) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                    size, mtime = st.st_size, st.st_mtime
+                except OSError:  # e.g. a broken symlink
+                    size, mtime = 0, 0.0
+                items.append(
+                    {
+                        "name": entry.name,
+                        "is_directory": entry.is_dir(),
+                        "size": size,
+                        "mtime": mtime,
+                    }
+                )
+            span["entries"] = len(items)
+        tool_cache.put(key, sig, items)
+    return items
+
+
+def _matches(name, rel_path, patterns):
+    return any(
+        fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern)
+        for pattern in patterns
+    )
+
+
+def _descend(working_directory, dir_path, visited):
+    """True for a directory inside the working directory that was not listed yet."""
+    # A symlinked directory may point outside the workspace or back at a parent
+    real_path = os.path.realpath(dir_path)
+    if os.path.commonpath([working_directory, real_path]) != working_directory:
+        return False
+    try:
+        st = os.stat(real_path)
+    except OSError:
+        return False
+    if (st.st_dev, st.st_ino) in visited:
+        return False
+    visited.add((st.st_dev, st.st_ino))
+    return True
+
+
+def _get_files_info(
+    working_directory,
+    directory=".",
+    recursive=False,
+    max_depth=None,
+    include=None,
+    exclude=DEFAULT_EXCLUDE,
+    sort=None,
+):
     working_directory = os.path.realpath(working_directory)
     path = os.path.realpath(os.path.join(working_directory, directory))
 
@@ -39,29 +136,104 @@ def _get_files_info(working_directory, directory="."):
     if not os.path.isdir(path):
         raise FileNotFoundError(f'"{directory}" is not a directory')
 
-    for file in os.listdir(path):
-        file_path = os.path.join(path, file)
-        is_directory = os.path.isdir(file_path)
-        size = os.path.getsize(file_path)
+    if sort is not None and sort not in SORT_KEYS:
+        raise ValueError(f'Unknown sort "{sort}", expected one of {list(SORT_KEYS)}')
+    if not recursive:
+        max_depth = 1
+    exclude = exclude or ()
+
+    def entries(dir_path):
+        items = _scan(dir_path)
+        if sort is not None:
+            items = sorted(items, key=SORT_KEYS[sort])
+        return iter(items)
+
+    visited = set()
+    _descend(working_directory, path, visited)
+    # Depth first, so a directory is followed by its contents
+    stack = [(entries(path), path, "", 1)]
+    while stack:
+        it, dir_path, prefix, depth = stack[-1]
+        item = next(it, None)
+        if item is None:
+            stack.pop()
+            continue
 
-        yield {
-            "name": file,
-            "is_directory": is_directory,
-            "size": size,
-        }
+        rel_path = prefix + item["name"]
+        if _matches(item["name"], rel_path, exclude):
+            continue
+        if item["is_directory"]:
+            if include is None:
+                yield dict(item, name=rel_path)
+            sub_directory = os.path.join(dir_path, item["name"])
+            if (max_depth is None or depth < max_depth) and _descend(
+                working_directory, sub_directory, visited
+            ):
+                stack.append((entries(sub_directory), sub_directory, rel_path + "/", depth + 1))
+        elif include is None or _matches(item["name"], rel_path, include):
+            yield dict(item, name=rel_path)
 
 
-def get_files_info(working_directory, directory="."):
-    """Lists files in the specified directory along with their sizes, constrained to the working directory."""
+def get_files_info(
+    working_directory,
+    directory=".",
+    recursive=False,
+    max_depth=None,
+    include=None,
+    exclude=None,
+    sort=None,
+    cursor=0,
+    limit=LIST_LIMIT,
+):
+    """Lists files in the specified directory along with their sizes, constrained to the working directory.
+    Set recursive to list a whole tree, use include/exclude globs and cursor to narrow down large listings."""
     if directory == ".":
         ret = "Results for current directory:\n"
     else:
         ret = f"Results for '{directory}' directory:\n"
 
+    if exclude is None:
+        exclude = DEFAULT_EXCLUDE
+    if recursive and sort is None:
+        # A stable order, so the cursor continues where the last call stopped
+        sort = "name"
     try:
-        for item in _get_files_info(working_directory, directory):
-            ret += f"- {item['name']}: file_size={item['size']} bytes, is_dir={item['is_directory']}"
-            ret += "\n"
+        items = _get_files_info(
+            working_directory, directory, recursive, max_depth, include, exclude, sort
+        )
+        if not recursive:
+            items = list(items)
+            if tool_cache.notify_unchanged and cursor == 0:
+                path = os.path.realpath(os.path.join(working_directory, directory))
+                key = (
+                    "get_files_info",
+                    path,
+                    tuple(include) if include else None,
+                    tuple(exclude),
+                    sort,
+                )
+                if tool_cache.seen_unchanged(key, signature(path)):
+                    return ret + f"Listing {UNCHANGED}.\n"
+            for item in items:
+                ret += f"- {item['name']}: file_size={item['size']} bytes, is_dir={item['is_directory']}"
+                ret += "\n"
+            return ret
+
+        # One compact line per entry, directories end with a slash
+        cursor = int(cursor or 0)
+        count = 0
+        for count, item in enumerate(items, start=1):
+            if count <= cursor:
+                continue
+            if count > cursor + limit:
+                ret += f"... listing truncated, call again with cursor={cursor + limit} for more\n"
+                break
+            if item["is_directory"]:
+                ret += f"{item['name']}/\n"
+            else:
+                ret += f"{item['name']} {item['size']}\n"
+        else:
+            ret += f"{count} entries\n"
     except Exception as e:
         ret += f"\tError: {str(e)}\n"
 
@@ -0,0 +1,144 @@
+import ast
+import os
+
+from functions.cache import signature, tool_cache
+from functions.get_files_info import DEFAULT_EXCLUDE
+from functions.tracing import tracer
+
+# Outline lines returned per call, narrow down with a subdirectory or a single file
+OUTLINE_LIMIT = 500
+DOC_CHARS = 80
+
+
+def get_schema():
+    from google.genai import types
+
+    return types.FunctionDeclaration(
+        name=get_outline.__name__,
+        description=get_outline.__doc__,
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "path": types.Schema(
+                    type=types.Type.STRING,
+                    description="Python file or directory to outline, relative to the working directory. "
+                    "Defaults to the whole working directory.",
+                ),
+            },
+        ),
+    )
+
+
+def _first_line(node):
+    doc = ast.get_docstring(node, clean=True)
+    if not doc:
+        return ""
+    line = doc.strip().splitlines()[0]
+    if len(line) > DOC_CHARS:
+        line = line[:DOC_CHARS] + "..."
+    return f"  # {line}"
+
+
+def _signature(node):
+    args = ast.unparse(node.args)
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns is not None else ""
+    return f"({args}){returns}"
+
+
+def _outline_body(body, depth):
+    """Yields (depth, line) for the classes and functions in body, and the methods of classes."""
+    for node in body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            start = min([node.lineno] + [dec.lineno for dec in node.decorator_list])
+            decorators = "".join(f"@{ast.unparse(dec)} " for dec in node.decorator_list)
+            if isinstance(node, ast.ClassDef):
+                bases = ", ".join(ast.unparse(base) for base in node.bases + node.keywords)
+                head = f"class {node.name}({bases})" if bases else f"class {node.name}"
+            else:
+                prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+                head = f"{prefix} {node.name}{_signature(node)}"
+            yield depth, f"{decorators}{head} [{start}-{node.end_lineno}]{_first_line(node)}"
+            # Nested functions are implementation details, only look inside classes
+            if isinstance(node, ast.ClassDef):
+                yield from _outline_body(node.body, depth + 1)
+        elif isinstance(node, (ast.If, ast.Try)):
+            # Definitions guarded by `if` or `try`, e.g. optional imports
+            for block in (node.body, node.orelse, getattr(node, "finalbody", [])):
+                yield from _outline_body(block, depth)
+            for handler in getattr(node, "handlers", []):
+                yield from _outline_body(handler.body, depth)
+
+
+def _outline_file(path) -> tuple[int, list[str]]:
+    """Returns the line count and outline lines of one python file, cached until the file changes."""
+    sig = signature(path)
+    key = ("get_outline", path)
+    cached = tool_cache.get(key, sig)
+    if cached is not None:
+        return cached
+
+    with tracer.span("file_read", path=path, outline=True), open(path, "rb") as file:
+        source = file.read()
+    line_count = source.count(b"\n") + (not source.endswith(b"\n") and source != b"")
+    try:
+        tree = ast.parse(source, filename=path)
+    except (SyntaxError, ValueError) as e:
+        lines = [f"  SyntaxError: {getattr(e, 'msg', e)} (line {getattr(e, 'lineno', '?')})"]
+    else:
+        lines = []
+        doc = _first_line(tree)
+        if doc:
+            lines.append(doc)
+        lines.extend("  " * (depth + 1) + line for depth, line in _outline_body(tree.body, 0))
+
+    tool_cache.put(key, sig, (line_count, lines))
+    return line_count, lines
+
+
+def _python_files(working_directory, path):
+    for dir_path, dir_names, file_names in os.walk(path):
+        dir_names[:] = sorted(name for name in dir_names if name not in DEFAULT_EXCLUDE)
+        for name in sorted(file_names):
+            if not name.endswith(".py"):
+                continue
+            file_path = os.path.join(dir_path, name)
+            # Skip symlinks to files outside the working directory
+            real_path = os.path.realpath(file_path)
+            if os.path.commonpath([working_directory, real_path]) == working_directory:
+                yield file_path
+
+
+def _get_outline(working_directory, path=".") -> str:
+    working_directory = os.path.realpath(working_directory)
+    target = os.path.realpath(os.path.join(working_directory, path))
+    if os.path.commonpath([working_directory, target]) != working_directory:
+        raise ValueError(
+            f'Cannot outline "{path}" as it is outside the permitted working directory'
+        )
+    if os.path.isdir(target):
+        files = _python_files(working_directory, target)
+    elif os.path.isfile(target):
+        files = [target]
+    else:
+        raise FileNotFoundError(f'File or directory not found: "{path}"')
+
+    out = []
+    for file_path in files:
+        line_count, lines = _outline_file(file_path)
+        if len(out) + 1 + len(lines) > OUTLINE_LIMIT and out:
+            out.append("... outline truncated, call again with a subdirectory or a single file")
+            break
+        out.append(f"{os.path.relpath(file_path, working_directory)} [1-{line_count}]")
+        out.extend(lines)
+    if not out:
+        return f'No python files in "{path}"'
+    return "\n".join(out)
+
+
+def get_outline(working_directory, path="."):
+    """Outlines python files: classes, functions with their signatures, line ranges and the first docstring line.
+    Read only the symbols you need with get_file_content start_line/end_line instead of whole files."""
+    try:
+        return _get_outline(working_directory, path)
+    except Exception as e:
+        return f"Error: {str(e)}"
@@ -1,10 +1,35 @@
-import subprocess
 import os
 
-from google.genai import types
+from functions import bounded_output
+from functions.cache import tool_cache
+from functions.sandbox_pool import PROJECT_DIR, WORKSPACE
+from functions.tracing import tracer
+
+DOCKER = ["docker"]
+# Bytes of stdout and of stderr returned to the model, the middle of longer output is omitted
+MAX_OUTPUT_BYTES = bounded_output.MAX_OUTPUT_BYTES
+# Write output that does not fit in full to SPILL_DIR in the working directory
+SPILL_OUTPUT = False
+SPILL_DIR = ".run_output"
+
+# Optional SandboxPool of warm containers, see set_pool()
+_pool = None
+
+
+def set_pool(pool):
+    """Run python files in the given SandboxPool instead of a new container per call, None to disable."""
+    global _pool
+    _pool = pool
+
+
+def get_pool():
+    """The SandboxPool set with set_pool(), also used by run_tests, or None."""
+    return _pool
 
 
 def get_schema():
+    from google.genai import types
+
     return types.FunctionDeclaration(
         name=run_python_file.__name__,
         description=run_python_file.__doc__,
@@ -53,12 +78,30 @@ def _run_python_file(working_directory, file_path: str, args=None) -> tuple[str,
     # Path executed inside docker, make sure to use the correct relative path
     path = os.path.join(working_directory, file_path)
 
-    cmd = ["docker", "compose", "run", "--rm", "sandbox_executor", "python", path]
+    cmd = ["python", path]
     cmd.extend(args)
 
-    result = subprocess.run(
-        cmd, capture_output=True, text=True, timeout=30, cwd=working_directory
-    )
+    # Relative to the workspace, like the working directory
+    spill = os.path.join(working_directory, SPILL_DIR) if SPILL_OUTPUT else None
+    with tracer.span("docker_run", file_path=file_path, pool=_pool is not None) as span:
+        if _pool is not None:
+            result = _pool.run(cmd, timeout=30, max_bytes=MAX_OUTPUT_BYTES, spill=spill)
+        else:
+            cmd = DOCKER + ["compose", "run", "--rm", "sandbox_executor"] + cmd
+            result = bounded_output.run_bounded(
+                cmd,
+                30,
+                max_bytes=MAX_OUTPUT_BYTES,
+                spill=os.path.join(WORKSPACE, spill) if spill else None,
+                skip_stderr_line=is_container_message,
+                cwd=PROJECT_DIR,
+            )
+        span["returncode"] = result.returncode
+        span["stdout_bytes"] = len(result.stdout)
+        span["stderr_bytes"] = len(result.stderr)
+    # The script may have changed file sizes without changing directory mtimes
+    tool_cache.invalidate_kind("get_files_info")
+
     if result.returncode != 0:
         if result.returncode == 2 and "can't open file" in result.stderr:
             raise FileNotFoundError(
@@ -68,17 +111,24 @@ def _run_python_file(working_directory, file_path: str, args=None) -> tuple[str,
             f"Process exited with code {result.returncode}\nSTDOUT:{result.stdout}\nSTDERR:{result.stderr}"
         )
 
-    # Trim any container creation messages from stderr
-    stderr = list()
-    trim_end = (" Created", " Creating")
-    trim_contains = "Container "
-    for line in result.stderr.splitlines():
-        if trim_contains in line and line.strip().endswith(trim_end):
-            continue
-        stderr.append(line)
-    stderr = "\n".join(stderr)
+    return result.stdout, result.stderr.rstrip("\n")
+
 
-    return result.stdout, stderr
+def is_container_message(line: bytes) -> bool:
+    """True for the container creation messages docker compose writes to stderr."""
+    return b"Container " in line and line.strip().endswith((b" Created", b" Creating"))
+
+
+def _spilled(working_directory):
+    """Returns the spill files written by the last run, relative to the working directory."""
+    if not SPILL_OUTPUT:
+        return []
+    spill = os.path.join(WORKSPACE, working_directory, SPILL_DIR)
+    return [
+        os.path.join(SPILL_DIR, name)
+        for name in ("stdout.txt", "stderr.txt")
+        if os.path.isfile(os.path.join(spill, name))
+    ]
 
 
 def run_python_file(working_directory, file_path: str, args=None) -> str:
@@ -98,6 +148,9 @@ def run_python_file(working_directory, file_path: str, args=None) -> str:
         if stderr:
             ret += f"\nSTDERR:\n{stderr}"
 
+        for path in _spilled(working_directory):
+            ret += f"\nFull output written to {path}, read it with get_file_content"
+
     except Exception as e:
         return ret + f"\nError: {str(e)}"
 
@@ -0,0 +1,288 @@
+import ast
+import fnmatch
+import json
+import os
+import posixpath
+import re
+import threading
+
+from functions import bounded_output, run_python_file
+from functions.cache import signature, tool_cache
+from functions.get_files_info import DEFAULT_EXCLUDE
+from functions.sandbox_pool import CONTAINER_WORKDIR, PROJECT_DIR, WORKSPACE
+from functions.tracing import tracer
+
+# unittest's default discovery pattern, matches tests.py and test_*.py
+TEST_PATTERN = "test*.py"
+TIMEOUT = 120
+# Failures listed with their traceback, and traceback lines kept of each
+MAX_FAILURES = 10
+TRACEBACK_LINES = 15
+# Prefixes the result line printed by RUNNER, test output may come before it
+MARKER = "@@run_tests@@ "
+# Id of a failed fixture, e.g. "setUpClass (test_add.TestAdd)" or "setUpModule (test_add)"
+FIXTURE_ID = re.compile(r"\w+ \((.+)\)")
+
+# Runs in the sandbox as `python -c RUNNER [module ...]`, prints one JSON result line
+RUNNER = f"""
+import json, sys, time, unittest
+loader = unittest.defaultTestLoader
+names = sys.argv[1:]
+suite = loader.loadTestsFromNames(names) if names else loader.discover(".", pattern={TEST_PATTERN!r})
+result = unittest.TestResult()
+start = time.perf_counter()
+suite.run(result)
+problems = [("FAIL", t, e) for t, e in result.failures + [(t, "unexpected success") for t in result.unexpectedSuccesses]]
+problems += [("ERROR", t, e) for t, e in result.errors]
+print("\\n" + {MARKER!r} + json.dumps({{
+    "run": result.testsRun,
+    "skipped": len(result.skipped) + len(result.expectedFailures),
+    "problems": [[kind, test.id(), "\\n".join(e.splitlines()[-{TRACEBACK_LINES}:])] for kind, test, e in problems],
+    "seconds": time.perf_counter() - start,
+}}))
+"""
+
+# Per working directory: signatures of its python files at the last run and the test modules that failed
+_last_runs = {}
+_lock = threading.Lock()
+
+
+def get_schema():
+    from google.genai import types
+
+    return types.FunctionDeclaration(
+        name=run_tests.__name__,
+        description=run_tests.__doc__,
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "test_files": types.Schema(
+                    type=types.Type.ARRAY,
+                    items=types.Schema(type=types.Type.STRING),
+                    description="Optional test files relative to the working directory to run, "
+                    "instead of the tests affected by changes. Example: [\"tests.py\"]",
+                ),
+                "run_all": types.Schema(
+                    type=types.Type.BOOLEAN,
+                    description="Optional, run every test file instead of only the affected ones.",
+                ),
+            },
+        ),
+    )
+
+
+def _python_files(root):
+    """Yields the relative path of every python file under root."""
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(
+            name for name in dir_names if name not in DEFAULT_EXCLUDE and not name.startswith(".")
+        )
+        for name in sorted(file_names):
+            if name.endswith(".py"):
+                yield os.path.relpath(os.path.join(dir_path, name), root)
+
+
+def _module_name(rel_path):
+    parts = rel_path[: -len(".py")].split(os.sep)
+    if parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts)
+
+
+def _imports(path, module) -> list[str]:
+    """Returns the modules path imports, cached until the file changes.
+
+    Includes the parent packages of every import and, for `from x import y`,
+    x.y in case y is a module.
+    """
+    sig = signature(path)
+    key = ("imports", path)
+    cached = tool_cache.get(key, sig)
+    if cached is not None:
+        return cached
+
+    with open(path, "rb") as file:
+        source = file.read()
+    try:
+        tree = ast.parse(source, filename=path)
+    except (SyntaxError, ValueError):
+        tree = ast.Module(body=[], type_ignores=[])
+    is_package = os.path.basename(path) == "__init__.py"
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                package = module.split(".")
+                # A module's package is its parent, a package is its own
+                package = package[: len(package) - node.level + is_package]
+                base = ".".join(package + ([base] if base else []))
+            if base:
+                names.add(base)
+            names.update(f"{base}.{alias.name}" if base else alias.name for alias in node.names)
+    result = set()
+    for name in names:
+        parts = name.split(".")
+        result.update(".".join(parts[:i]) for i in range(1, len(parts) + 1))
+    result = sorted(result)
+    tool_cache.put(key, sig, result)
+    return result
+
+
+def _affected(root, files, changed) -> set[str]:
+    """Returns the modules that import, directly or not, any of the changed modules."""
+    importers = {}
+    for rel in files:
+        module = _module_name(rel)
+        for name in _imports(os.path.join(root, rel), module):
+            importers.setdefault(name, set()).add(module)
+    affected = set()
+    stack = list(changed)
+    while stack:
+        module = stack.pop()
+        if module in affected:
+            continue
+        affected.add(module)
+        stack.extend(importers.get(module, ()))
+    return affected
+
+
+def _select(root, test_files, run_all):
+    """Returns (test modules to run, all test modules, changed files) and the snapshot of this run."""
+    files = list(_python_files(root))
+    snapshot = {rel: signature(os.path.join(root, rel)) for rel in files}
+    tests = sorted(_module_name(rel) for rel in files if fnmatch.fnmatch(os.path.basename(rel), TEST_PATTERN))
+
+    if test_files:
+        selected = []
+        for test_file in test_files:
+            rel = os.path.normpath(test_file)
+            if rel.startswith(os.pardir) or os.path.isabs(rel):
+                raise ValueError(
+                    f'Cannot run "{test_file}" as it is outside the permitted working directory'
+                )
+            if rel not in snapshot:
+                raise FileNotFoundError(f'Test file not found: "{test_file}"')
+            selected.append(_module_name(rel))
+        return selected, tests, None, snapshot
+
+    with _lock:
+        last = _last_runs.get(root)
+    if run_all or last is None:
+        return tests, tests, None, snapshot
+
+    old = last["snapshot"]
+    changed = sorted(rel for rel in snapshot.keys() | old.keys() if snapshot.get(rel) != old.get(rel))
+    affected = _affected(root, files, [_module_name(rel) for rel in changed])
+    selected = [module for module in tests if module in affected or module in last["failing"]]
+    return selected, tests, changed, snapshot
+
+
+def _run(working_directory, modules) -> tuple[dict | None, object]:
+    """Runs the test modules in the sandbox, returns the parsed result line and the process."""
+    cmd = ["python", "-c", RUNNER] + modules
+    pool = run_python_file.get_pool()
+    with tracer.span("docker_run", tests=len(modules), pool=pool is not None) as span:
+        if pool is not None:
+            process = pool.run(cmd, timeout=TIMEOUT, workdir=working_directory)
+        else:
+            workdir = posixpath.join(CONTAINER_WORKDIR, working_directory)
+            process = bounded_output.run_bounded(
+                run_python_file.DOCKER + ["compose", "run", "--rm", "-w", workdir, "sandbox_executor"] + cmd,
+                TIMEOUT,
+                skip_stderr_line=run_python_file.is_container_message,
+                cwd=PROJECT_DIR,
+            )
+        span["returncode"] = process.returncode
+    # Tests may have written files
+    tool_cache.invalidate_kind("get_files_info")
+
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith(MARKER):
+            return json.loads(line[len(MARKER):]), process
+    return None, process
+
+
+def _format(result, modules, tests, changed) -> str:
+    problems = result["problems"]
+    failed = {test_id for _, test_id, _ in problems}
+    counts = [f"{result['run'] - len(failed) - result['skipped']} passed"]
+    for kind in ("FAIL", "ERROR"):
+        count = sum(1 for problem in problems if problem[0] == kind)
+        if count:
+            counts.append(f"{count} {'failed' if kind == 'FAIL' else 'errors'}")
+    if result["skipped"]:
+        counts.append(f"{result['skipped']} skipped")
+
+    lines = [
+        f"Ran {result['run']} tests from {len(modules)} of {len(tests)} test modules "
+        f"in {result['seconds']:.2f}s: {', '.join(counts)}"
+    ]
+    if changed is not None:
+        lines.append(f"Selected by changes to: {', '.join(changed) or 'nothing'}")
+    for kind, test_id, traceback in problems[:MAX_FAILURES]:
+        lines.append(f"{kind}: {test_id}")
+        lines.extend("    " + line for line in traceback.splitlines())
+    if len(problems) > MAX_FAILURES:
+        lines.append(f"... {len(problems) - MAX_FAILURES} more failing tests")
+    return "\n".join(lines)
+
+
+def _in_module(test_id, module) -> bool:
+    """True when test_id is a test, fixture or failed import of the test module."""
+    fixture = FIXTURE_ID.fullmatch(test_id)
+    if fixture is not None:
+        test_id = fixture.group(1)
+    # Test ids are module.Class.method, or end with the module name when it failed to import
+    return test_id == module or test_id.startswith(module + ".") or test_id.endswith("." + module)
+
+
+def _run_tests(working_directory, test_files=None, run_all=False) -> str:
+    pool = run_python_file.get_pool()
+    workspace = pool.workspace if pool is not None else WORKSPACE
+    root = os.path.realpath(os.path.join(workspace, working_directory))
+    if os.path.commonpath([os.path.realpath(workspace), root]) != os.path.realpath(workspace):
+        raise ValueError(f'"{working_directory}" is outside the sandbox workspace')
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f'Working directory not found: "{working_directory}"')
+
+    modules, tests, changed, snapshot = _select(root, test_files, run_all)
+    if not modules:
+        return (
+            f"No tests affected by changes since the last run ({len(tests)} test modules), "
+            "use run_all to run every test"
+        )
+
+    result, process = _run(working_directory, modules)
+    if result is None:
+        raise RuntimeError(
+            f"Test run exited with code {process.returncode}\nSTDOUT:{process.stdout}\nSTDERR:{process.stderr}"
+        )
+
+    failed = {
+        module
+        for module in modules
+        for _, test_id, _ in result["problems"]
+        if _in_module(test_id, module)
+    }
+    with _lock:
+        last = _last_runs.get(root)
+        # Modules that were not run keep failing until they are run again
+        failing = (last["failing"] - set(modules) if last else set()) | failed
+        if not test_files:
+            _last_runs[root] = {"snapshot": snapshot, "failing": failing}
+        elif last is not None:
+            # Changes since the last run are not covered by the chosen files, keep the snapshot
+            last["failing"] = failing
+    return _format(result, modules, tests, changed)
+
+
+def run_tests(working_directory, test_files=None, run_all=False) -> str:
+    """Runs the unittest tests in the sandbox and returns a compact pass/fail summary with the tracebacks of failures.
+    By default only runs the test files affected by the python files changed since the last run, found through imports."""
+    try:
+        return _run_tests(working_directory, test_files, run_all)
+    except Exception as e:
+        return f"Error: {str(e)}"
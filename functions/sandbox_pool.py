@@ -0,0 +1,292 @@
+import json
+import os
+import posixpath
+import queue
+import select
+import subprocess
+import threading
+import time
+import uuid
+
+from functions.bounded_output import MAX_OUTPUT_BYTES, run_bounded
+
+# Root of this project, where docker-compose.yaml lives
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# Host directory mounted as the container workdir, see docker-compose.yaml
+WORKSPACE = os.path.join(PROJECT_DIR, "sandbox_workspace")
+# Where docker-compose.yaml mounts the workspace in the container
+CONTAINER_WORKDIR = "/usr/src/app"
+SERVICE = "sandbox_executor"
+# Fork server copied into the image by Dockerfile.sandbox_executor, see forkserver.py
+FORKSERVER = ("python", "/opt/forkserver/forkserver.py")
+
+
+class SandboxContainer:
+    def __init__(self, name):
+        self.name = name
+        self.runs = 0
+        self.last_health_check = time.monotonic()
+        # forkserver.py process, None until started, False when it failed to start
+        self.worker = None
+
+    def stop_worker(self):
+        if self.worker:
+            self.worker.kill()
+            self.worker.wait()
+            self.worker.stdin.close()
+            self.worker.stdout.close()
+        self.worker = None
+
+
+class SandboxPool:
+    """Pool of pre-started sandbox_executor containers, reused through docker exec.
+
+    Containers are started with `docker compose run` so they get the same
+    memory/cpu limits and network as a one-off run. A container is recycled
+    after max_runs executions, when a run times out, when it fails a health
+    check or when it has changed files outside of the mounted workspace.
+
+    With forkserver, the command starting forkserver.py in the container (e.g.
+    FORKSERVER + ("--preload", "json,decimal")), python files are run by a
+    child forked from a warm interpreter instead of a new python process.
+    Falls back to docker exec when the fork server does not start, e.g. the
+    image was built before it was added.
+    """
+
+    def __init__(
+        self,
+        size=2,
+        max_runs=50,
+        health_interval=30.0,
+        check_dirty=True,
+        docker=("docker",),
+        project_dir=PROJECT_DIR,
+        forkserver=None,
+        workspace=WORKSPACE,
+    ):
+        if size < 1:
+            raise ValueError(f"Pool size must be at least 1, got {size}")
+        self.size = size
+        self.max_runs = max_runs
+        self.health_interval = health_interval
+        self.check_dirty = check_dirty
+        self.docker = list(docker)
+        self.project_dir = project_dir
+        self.forkserver = list(forkserver) if forkserver else None
+        self.workspace = workspace
+
+        self._idle = queue.Queue()
+        self._containers = set()
+        self._spawning = []
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _docker(self, *args, timeout=60):
+        return subprocess.run(
+            self.docker + list(args),
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+            cwd=self.project_dir,
+        )
+
+    def _spawn(self):
+        name = f"sandbox_pool_{uuid.uuid4().hex[:12]}"
+        result = self._docker(
+            "compose", "run", "-d", "--rm", "--name", name,
+            SERVICE, "sleep", "infinity",
+        )
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"Unable to start sandbox container {name}: {result.stderr}"
+            )
+        container = SandboxContainer(name)
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._containers.add(container)
+        if closed:
+            self._docker("rm", "-f", name)
+            return None
+        self._idle.put(container)
+        return container
+
+    def _spawn_in_background(self):
+        thread = threading.Thread(target=self._spawn, daemon=True)
+        with self._lock:
+            self._spawning = [t for t in self._spawning if t.is_alive()]
+            self._spawning.append(thread)
+        thread.start()
+
+    def _remove(self, container):
+        with self._lock:
+            self._containers.discard(container)
+        container.stop_worker()
+        self._docker("rm", "-f", container.name)
+
+    def _recycle(self, container):
+        self._remove(container)
+        if not self._closed:
+            self._spawn_in_background()
+
+    def _is_healthy(self, container):
+        result = self._docker("inspect", "-f", "{{.State.Running}}", container.name)
+        container.last_health_check = time.monotonic()
+        return result.returncode == 0 and result.stdout.strip() == "true"
+
+    def _is_dirty(self, container):
+        # Lists changes to the container filesystem, the workspace bind mount is not included
+        result = self._docker("diff", container.name)
+        return result.returncode != 0 or result.stdout.strip() != ""
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threads = [threading.Thread(target=self._spawn) for _ in range(self.size)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def _acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                container = self._idle.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                raise TimeoutError("No sandbox container became available") from None
+
+            age = time.monotonic() - container.last_health_check
+            if age < self.health_interval or self._is_healthy(container):
+                return container
+            self._recycle(container)
+
+    def _release(self, container, dirty=False):
+        if (
+            dirty
+            or self._closed
+            or container.runs >= self.max_runs
+            or (self.check_dirty and self._is_dirty(container))
+        ):
+            self._recycle(container)
+        else:
+            self._idle.put(container)
+
+    def _start_worker(self, container, timeout=30):
+        worker = subprocess.Popen(
+            self.docker + ["exec", "-i", container.name] + self.forkserver,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            cwd=self.project_dir,
+        )
+        container.worker = worker
+        try:
+            ready = json.loads(self._readline(worker, timeout))
+        except (OSError, ValueError, TimeoutError):
+            ready = {}
+        if not ready.get("ready"):
+            container.stop_worker()
+            container.worker = False
+
+    def _readline(self, worker, timeout):
+        ready, _, _ = select.select([worker.stdout], [], [], timeout)
+        if not ready:
+            raise TimeoutError("No reply from the sandbox fork server")
+        line = worker.stdout.readline()
+        if not line:
+            raise OSError("The sandbox fork server exited")
+        return line
+
+    def _run_forked(self, container, cmd, timeout, max_bytes, spill, workdir=None):
+        """Runs ["python", file, args...] through the fork server of container."""
+        if container.worker is not None and container.worker.poll() is not None:
+            container.stop_worker()
+        if container.worker is None:
+            self._start_worker(container)
+        if not container.worker:
+            return None
+
+        request = {
+            "file_path": cmd[1],
+            "args": list(cmd[2:]),
+            "timeout": timeout,
+            "max_bytes": max_bytes,
+            "spill": spill,
+        }
+        if workdir:
+            # Relative to the fork server, which runs in the workspace
+            request["cwd"] = workdir
+        container.worker.stdin.write(json.dumps(request) + "\n")
+        container.worker.stdin.flush()
+        # The fork server enforces the timeout, allow a little longer for the reply
+        response = json.loads(self._readline(container.worker, timeout + 5))
+        if "error" in response:
+            raise RuntimeError(f"Sandbox fork server failed: {response['error']}")
+        if response["timed_out"]:
+            raise subprocess.TimeoutExpired(cmd, timeout, response["stdout"], response["stderr"])
+        return subprocess.CompletedProcess(
+            cmd, response["returncode"], response["stdout"], response["stderr"]
+        )
+
+    def run(
+        self, cmd, timeout=30, acquire_timeout=60, max_bytes=MAX_OUTPUT_BYTES, spill=None, workdir=None
+    ):
+        """Runs cmd in an idle container, returns a subprocess.CompletedProcess.
+
+        At most max_bytes of stdout and of stderr are kept, see run_bounded().
+        spill and workdir, where cmd runs, are directories relative to the workspace.
+        """
+        if self._closed:
+            raise RuntimeError("Sandbox pool is closed")
+        self.start()
+
+        container = self._acquire(acquire_timeout)
+        container.runs += 1
+        killed = False  # the fork server has already killed a timed out run
+        try:
+            result = None
+            if self.forkserver and len(cmd) >= 2 and cmd[0] == "python" and not cmd[1].startswith("-"):
+                try:
+                    result = self._run_forked(container, cmd, timeout, max_bytes, spill, workdir)
+                except subprocess.TimeoutExpired:
+                    killed = True
+                    raise
+            if result is None:
+                options = ["-w", posixpath.join(CONTAINER_WORKDIR, workdir)] if workdir else []
+                result = run_bounded(
+                    self.docker + ["exec"] + options + [container.name] + list(cmd),
+                    timeout,
+                    max_bytes=max_bytes,
+                    spill=os.path.join(self.workspace, spill) if spill else None,
+                    cwd=self.project_dir,
+                )
+        except BaseException:
+            # A timed out process keeps running inside the container, throw it away
+            self._release(container, dirty=not killed)
+            raise
+        self._release(container)
+        return result
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            spawning = list(self._spawning)
+        for thread in spawning:
+            thread.join()
+        with self._lock:
+            containers = list(self._containers)
+        for container in containers:
+            self._remove(container)
@@ -0,0 +1,427 @@
+import fnmatch
+import os
+import re
+import threading
+
+from functions.cache import tool_cache
+from functions.get_files_info import DEFAULT_EXCLUDE
+from functions.tracing import tracer
+
+# Matching lines shown per file, the rest are counted
+MAX_PER_FILE = 5
+# Files shown per search
+MAX_FILES = 50
+MAX_CONTEXT = 5
+# Larger files and files with a NUL byte in the first block are not indexed or searched
+MAX_FILE_BYTES = 1024 * 1024
+MAX_LINE_CHARS = 300
+
+
+def get_schema():
+    from google.genai import types
+
+    return types.FunctionDeclaration(
+        name=search_code.__name__,
+        description=search_code.__doc__,
+        parameters=types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                "pattern": types.Schema(
+                    type=types.Type.STRING,
+                    description="Text to search for, a python regular expression when regex is true.",
+                ),
+                "regex": types.Schema(
+                    type=types.Type.BOOLEAN,
+                    description="Optional, treat pattern as a regular expression. Defaults to a plain substring.",
+                ),
+                "ignore_case": types.Schema(
+                    type=types.Type.BOOLEAN,
+                    description="Optional, match regardless of case.",
+                ),
+                "directory": types.Schema(
+                    type=types.Type.STRING,
+                    description="Optional directory to search in, relative to the working directory. "
+                    "Defaults to the whole working directory.",
+                ),
+                "include": types.Schema(
+                    type=types.Type.ARRAY,
+                    items=types.Schema(type=types.Type.STRING),
+                    description="Optional glob patterns, only files whose name or relative path "
+                    "match any of them are searched, e.g. ['*.py'].",
+                ),
+                "context": types.Schema(
+                    type=types.Type.INTEGER,
+                    description=f"Optional lines of context around each match, at most {MAX_CONTEXT}. Defaults to 0.",
+                ),
+            },
+            required=["pattern"],
+        ),
+    )
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _read_text(root, rel):
+    """Returns the text of rel below root, None for binary and very large files.
+
+    Also None for a symlink to a file outside root, get_file_content refuses
+    those as well.
+    """
+    path = os.path.realpath(os.path.join(root, rel))
+    if os.path.commonpath([root, path]) != root:
+        return None
+    with open(path, "rb") as file:
+        data = file.read(MAX_FILE_BYTES + 1)
+    if len(data) > MAX_FILE_BYTES or b"\0" in data[:8192]:
+        return None
+    return data.decode("utf-8", errors="replace")
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class TrigramIndex:
+    """Inverted index from lowercased trigrams to the files under root containing them.
+
+    Built on the first search, then kept up to date: write_file and
+    workspace syncs invalidate single paths in tool_cache, which are indexed
+    again before the next search; a python run may change anything, after one
+    the next search stats every file and indexes those whose size or mtime
+    changed.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.files = {}  # relative path -> (signature, trigrams)
+        self.postings = {}  # trigram -> set of relative paths
+        self.indexed = 0  # files indexed, for tests and tracing
+        self._stale = set()
+        self._rescan = True
+        # Writers only take the pending lock, they never wait for a refresh
+        self._pending_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def changed(self, path):
+        """path changed or was removed, None when anything may have changed."""
+        with self._pending_lock:
+            if path is None:
+                self._rescan = True
+            else:
+                self._stale.add(os.path.relpath(path, self.root))
+
+    def _walk(self, rel_dir="."):
+        for dir_path, dir_names, file_names in os.walk(os.path.join(self.root, rel_dir)):
+            dir_names[:] = [name for name in dir_names if name not in DEFAULT_EXCLUDE]
+            for name in file_names:
+                yield os.path.normpath(os.path.relpath(os.path.join(dir_path, name), self.root))
+
+    def _add(self, rel, sig):
+        self._remove(rel)
+        try:
+            text = _read_text(self.root, rel)
+        except OSError:
+            return
+        grams = frozenset() if text is None else _trigrams(text.lower())
+        self.files[rel] = (sig, grams)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(rel)
+        self.indexed += 1
+
+    def _remove(self, rel):
+        entry = self.files.pop(rel, None)
+        if entry is None:
+            return
+        for gram in entry[1]:
+            paths = self.postings[gram]
+            paths.discard(rel)
+            if not paths:
+                del self.postings[gram]
+
+    def _update(self, rel):
+        """Indexes rel again, or everything below it when it is a directory."""
+        path = os.path.join(self.root, rel)
+        prefix = "" if rel == "." else rel + os.sep
+        for indexed in [name for name in self.files if name == rel or name.startswith(prefix)]:
+            if _signature(os.path.join(self.root, indexed)) is None:
+                self._remove(indexed)
+        if os.path.isdir(path):
+            names = self._walk(rel)
+        else:
+            names = [rel]
+        for name in names:
+            sig = _signature(os.path.join(self.root, name))
+            entry = self.files.get(name)
+            if sig is not None and (entry is None or entry[0] != sig or name == rel):
+                self._add(name, sig)
+
+    def refresh(self):
+        with self._lock:
+            with self._pending_lock:
+                rescan, stale = self._rescan, self._stale
+                self._rescan, self._stale = False, set()
+            if rescan:
+                self._update(".")
+                return
+            for rel in stale:
+                if not rel.startswith(os.pardir):
+                    self._update(rel)
+
+    def candidates(self, literals):
+        """Relative paths of the files that may contain every literal, case insensitively."""
+        with self._lock:
+            result = None
+            for literal in literals:
+                for gram in _trigrams(literal.lower()):
+                    paths = self.postings.get(gram)
+                    if paths is None:
+                        return set()
+                    result = set(paths) if result is None else result & paths
+            return set(self.files) if result is None else result
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _changed(path):
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    for index in indexes:
+        if path is None:
+            index.changed(None)
+        elif os.path.commonpath([index.root, path]) == index.root:
+            index.changed(path)
+        elif os.path.commonpath([index.root, path]) == path:
+            # A directory holding the whole workspace
+            index.changed(None)
+
+
+tool_cache.subscribe(_changed)
+
+
+def get_index(working_directory) -> TrigramIndex:
+    root = os.path.realpath(working_directory)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = TrigramIndex(root)
+    index.refresh()
+    return index
+
+
+# Outside a character class these are not literal, a backslash before a
+# letter or digit is a class, anchor or escape such as \d, \b or \n
+_SPECIAL = set(".^$*+?{}[]()|\\")
+_OPTIONAL = set("*?{")
+
+
+def _skip_class(pattern, i):
+    """Index after the character class starting at pattern[i] == "["."""
+    i += 1
+    if i < len(pattern) and pattern[i] == "^":
+        i += 1
+    if i < len(pattern) and pattern[i] == "]":
+        i += 1
+    while i < len(pattern) and pattern[i] != "]":
+        i += 2 if pattern[i] == "\\" else 1
+    return i + 1
+
+
+def _skip_group(pattern, i):
+    """Index after the group starting at pattern[i] == "("."""
+    depth = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            i += 2
+            continue
+        if char == "[":
+            i = _skip_class(pattern, i)
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+
+# Hex digits taken by \x, \u and \U
+_HEX_ESCAPES = {"x": 2, "u": 4, "U": 8}
+
+
+def _skip_escape(pattern, i):
+    """Index after the escape starting at pattern[i] == "\\" followed by a letter or digit."""
+    letter = pattern[i + 1]
+    i += 2
+    if letter in _HEX_ESCAPES:
+        return i + _HEX_ESCAPES[letter]
+    if letter == "N" and pattern.startswith("{", i):
+        return pattern.index("}", i) + 1
+    if letter.isdigit():
+        # An octal escape or a group reference, at most three digits
+        end = i + 2
+        while i < min(end, len(pattern)) and pattern[i].isdigit():
+            i += 1
+    return i
+
+
+def _literals(pattern):
+    """Literal strings every match of the regular expression pattern contains.
+
+    A conservative scan of the pattern text: groups and classes end a literal,
+    a quantifier that allows zero repeats drops the character before it, and
+    a pattern with alternation or verbose mode gives no literals, so the
+    search falls back to every file.
+    """
+    if re.search(r"\(\?[a-zA-Z]*x", pattern):
+        return []
+    literals = []
+    run = ""
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "|":
+            return []
+        if char == "\\" and i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+            run += pattern[i + 1]
+            i += 2
+            continue
+        if char not in _SPECIAL:
+            run += char
+            i += 1
+            continue
+        if char in _OPTIONAL:
+            run = run[:-1]
+        literals.append(run)
+        run = ""
+        if char == "[":
+            i = _skip_class(pattern, i)
+        elif char == "(":
+            i = _skip_group(pattern, i)
+        elif char == "{" and "}" in pattern[i:]:
+            i = pattern.index("}", i) + 1
+        elif char == "\\":
+            i = _skip_escape(pattern, i)
+        else:
+            i += 1
+    literals.append(run)
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+def _matches(rel_path, patterns):
+    name = os.path.basename(rel_path)
+    return any(
+        fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern)
+        for pattern in patterns
+    )
+
+
+def _format_line(rel, number, separator, line):
+    if len(line) > MAX_LINE_CHARS:
+        line = line[:MAX_LINE_CHARS] + "..."
+    return f"{rel}{separator}{number}{separator}{line}"
+
+
+def _search_file(compiled, rel, text, context):
+    """Returns the output lines for the matches in one file and the number of matches."""
+    lines = text.splitlines()
+    hits = [i for i, line in enumerate(lines) if compiled.search(line)]
+    hit_set = set(hits)
+    out = []
+    last = None
+    for i in hits[:MAX_PER_FILE]:
+        start = max(i - context, 0 if last is None else last + 1)
+        if last is not None and start > last + 1:
+            out.append("--")
+        for k in range(start, min(i + context, len(lines) - 1) + 1):
+            out.append(_format_line(rel, k + 1, ":" if k in hit_set else "-", lines[k]))
+            last = k
+    if len(hits) > MAX_PER_FILE:
+        out.append(f"{rel}: ... {len(hits) - MAX_PER_FILE} more matches")
+    return out, len(hits)
+
+
+def _search_code(
+    working_directory, pattern, regex=False, ignore_case=False, directory=".", include=None, context=0
+) -> str:
+    working_directory = os.path.realpath(working_directory)
+    path = os.path.realpath(os.path.join(working_directory, directory))
+    if os.path.commonpath([working_directory, path]) != working_directory:
+        raise ValueError(
+            f'Cannot search "{directory}" as it is outside the permitted working directory'
+        )
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f'"{directory}" is not a directory')
+    if not pattern:
+        raise ValueError("pattern must not be empty")
+
+    flags = re.IGNORECASE if ignore_case else 0
+    if regex:
+        compiled = re.compile(pattern, flags)
+        literals = _literals(pattern)
+    else:
+        compiled = re.compile(re.escape(pattern), flags)
+        literals = [pattern]
+    context = min(max(int(context or 0), 0), MAX_CONTEXT)
+
+    with tracer.span("search", pattern=pattern) as span:
+        index = get_index(working_directory)
+        prefix = os.path.relpath(path, working_directory)
+        candidates = sorted(
+            rel
+            for rel in index.candidates(literals)
+            if (prefix == "." or rel.startswith(prefix + os.sep))
+            and (include is None or _matches(rel, include))
+        )
+        out = []
+        files = 0
+        total = 0
+        for rel in candidates:
+            try:
+                text = _read_text(working_directory, rel)
+            except OSError:
+                continue
+            if text is None:
+                continue
+            lines, count = _search_file(compiled, rel, text, context)
+            if count == 0:
+                continue
+            files += 1
+            total += count
+            if files <= MAX_FILES:
+                out.extend(lines)
+        span["files"] = len(candidates)
+        span["entries"] = total
+
+    if total == 0:
+        return f'No matches for "{pattern}"'
+    if files > MAX_FILES:
+        out.append(f"... {files - MAX_FILES} more files, narrow the search with directory or include")
+    out.append(f"{total} matches in {files} files")
+    return "\n".join(out)
+
+
+def search_code(
+    working_directory, pattern, regex=False, ignore_case=False, directory=".", include=None, context=0
+):
+    """Searches the text of the files in the working directory for pattern, like grep.
+    Returns matching lines as path:line:text, context lines as path-line-text.
+    Use it to find definitions and usages instead of reading files one by one."""
+    try:
+        return _search_code(
+            working_directory, pattern, regex, ignore_case, directory, include, context
+        )
+    except re.error as e:
+        return f"Error: invalid regular expression: {e}"
+    except Exception as e:
+        return f"Error: {str(e)}"
@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Numeric span attributes with these suffixes are summed in the summary
+SUMMED = ("tokens", "bytes", "chars", "entries", "calls")
+
+
+class Tracer:
+    """Collects timed spans of an agent session.
+
+    Spans are opened with span(), attributes such as token counts and payload
+    sizes are added to the dict it yields:
+
+        with tracer.span("docker_run", file_path=file_path) as span:
+            result = run()
+            span["stdout_bytes"] = len(result.stdout)
+
+    Tracing is off until enable() is called, a disabled span only yields the
+    attributes. Spans may be recorded from any thread.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter_ns()
+
+    def enable(self):
+        self.clear()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+            self._origin = time.perf_counter_ns()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        if not self.enabled:
+            yield attrs
+            return
+        start = time.perf_counter_ns()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            end = time.perf_counter_ns()
+            record = {
+                "name": name,
+                "start_us": (start - self._origin) / 1000,
+                "duration_us": (end - start) / 1000,
+                "thread": threading.get_ident(),
+                "attrs": attrs,
+            }
+            with self._lock:
+                self.spans.append(record)
+
+    def export_jsonl(self, path):
+        """Writes one JSON object per span."""
+        with open(path, "w") as file:
+            for record in self.spans:
+                file.write(json.dumps(record, default=str) + "\n")
+
+    def export_chrome(self, path):
+        """Writes the spans as Chrome trace events, open in chrome://tracing or ui.perfetto.dev."""
+        pid = os.getpid()
+        events = [
+            {
+                "name": record["name"],
+                "cat": "agent",
+                "ph": "X",
+                "ts": record["start_us"],
+                "dur": record["duration_us"],
+                "pid": pid,
+                "tid": record["thread"],
+                "args": record["attrs"],
+            }
+            for record in self.spans
+        ]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file, default=str)
+
+    def summary(self) -> str:
+        """Returns a table of count, total, mean and max duration per span name.
+
+        Token counts and sizes (attributes ending in one of SUMMED) are summed
+        per span name, e.g. the prompt tokens of all model calls.
+        """
+        if not self.spans:
+            return "No spans recorded"
+        start = min(record["start_us"] for record in self.spans)
+        end = max(record["start_us"] + record["duration_us"] for record in self.spans)
+        wall = max(end - start, 1e-9)
+
+        durations = defaultdict(list)
+        totals = defaultdict(lambda: defaultdict(int))
+        for record in self.spans:
+            durations[record["name"]].append(record["duration_us"] / 1000)
+            for key, value in record["attrs"].items():
+                if key.endswith(SUMMED) and isinstance(value, (int, float)):
+                    totals[record["name"]][key] += value
+
+        lines = [
+            f"{'span':16} {'count':>6} {'total ms':>10} {'mean ms':>9} {'max ms':>9} {'% wall':>7}  totals"
+        ]
+        for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+            total = sum(values)
+            attrs = " ".join(f"{key}={value}" for key, value in sorted(totals[name].items()))
+            lines.append(
+                f"{name:16} {len(values):6} {total:10.1f} {total / len(values):9.1f} "
+                f"{max(values):9.1f} {100 * total / (wall / 1000):7.1f}  {attrs}"
+            )
+        lines.append(f"wall time {wall / 1000:.1f} ms")
+        return "\n".join(lines)
+
+
+tracer = Tracer()
@@ -1,9 +1,20 @@
+import difflib
 import os
+import tempfile
+import threading
 
-from google.genai import types
+from functions.cache import tool_cache
+from functions.tracing import tracer
+
+# Ask the user to review changes to python files, disable for non-interactive runs
+REVIEW_CHANGES = True
+# Writes may run concurrently, one review prompt is shown at a time
+_review_lock = threading.Lock()
 
 
 def get_schema():
+    from google.genai import types
+
     return types.FunctionDeclaration(
         name=write_file.__name__,
         description=write_file.__doc__,
@@ -23,7 +34,53 @@ def get_schema():
     )
 
 
-def _write_file(working_directory, file_path, content) -> None:
+def _atomic_write(path, content) -> None:
+    """Writes content to a temporary file next to path and renames it over path."""
+    parent = os.path.dirname(path)
+    with tracer.span("file_write", path=path, bytes=len(content)):
+        fd, tmp_path = tempfile.mkstemp(dir=parent, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", newline="") as file:
+                file.write(content)
+            if os.path.exists(path):
+                os.chmod(tmp_path, os.stat(path).st_mode)
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(tmp_path, 0o666 & ~umask)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    tool_cache.invalidate(path)
+
+
+def _read_existing(path) -> str:
+    if not os.path.isfile(path):
+        return ""
+    with open(path, "r", errors="replace") as file:
+        return file.read()
+
+
+def review_changes(file_path, old_content, new_content) -> None:
+    """Shows the diff of a python file and waits for the user to review it."""
+    if not REVIEW_CHANGES or not file_path.endswith(".py"):
+        return
+    diff = difflib.unified_diff(
+        old_content.splitlines(keepends=True),
+        new_content.splitlines(keepends=True),
+        fromfile=f"a/{file_path}",
+        tofile=f"b/{file_path}",
+    )
+    diff = "".join(diff)
+    with _review_lock:
+        print(f"Review code changes to {file_path}")
+        print(diff)
+        input("Press Enter to continue...")
+
+
+def _write_file(working_directory, file_path, content) -> str:
+    """Writes content to file_path, returns the previous content, empty for a new file."""
     working_directory = os.path.realpath(working_directory)
     path = os.path.realpath(os.path.join(working_directory, file_path))
 
@@ -40,17 +97,16 @@ def _write_file(working_directory, file_path, content) -> None:
     if not os.path.exists(parent):
         os.makedirs(parent)
 
-    with open(path, "w") as file:
-        file.write(content)
+    old_content = _read_existing(path)
+    _atomic_write(path, content)
+    return old_content
 
 
 def write_file(working_directory, file_path, content) -> str:
     """Constrained to the working directory, write file content as string to file_path."""
     try:
-        _write_file(working_directory, file_path, content)
-        if file_path.endswith(".py"):
-            print(f"Review code changes to {file_path}")
-            input("Press Enter to continue...")
+        old_content = _write_file(working_directory, file_path, content)
+        review_changes(file_path, old_content, content)
         return (
             f'Successfully wrote to "{file_path}" ({len(content)} characters written)'
         )
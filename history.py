@@ -0,0 +1,166 @@
+import os
+
+from google.genai import types
+
+from call_scheduler import READ_ONLY, WRITES_PATH
+from functions.cache import UNCHANGED
+
+# Rough estimate used for the budget, the model reports the real count after each call
+CHARS_PER_TOKEN = 4
+# Responses shorter than this are cheaper to keep than to replace with a stub
+MIN_STUB_CHARS = 200
+
+
+def estimate_tokens(content: types.Content) -> int:
+    return len(content.model_dump_json(exclude_none=True)) // CHARS_PER_TOKEN + 1
+
+
+def _call_path(name, args):
+    key = READ_ONLY.get(name) or WRITES_PATH.get(name) or "file_path"
+    return os.path.normpath(args.get(key) or ".")
+
+
+def _response_size(response):
+    return sum(len(str(value)) for value in response.values())
+
+
+class History:
+    """Conversation sent to the model, compacted to stay within a token budget.
+
+    compact() is called before each model call, it
+    - merges consecutive model contents and adjacent text parts,
+    - replaces file reads, directory listings and run outputs that were
+      superseded later in the conversation by a short stub,
+    - drops the oldest turns, a model content with its function responses,
+      until the estimate fits in token_budget. A note listing the calls of the
+      dropped turns is added to the first user message.
+    The most recent keep_turns turns are never dropped. on_elide is called
+    when results were removed from the conversation.
+    """
+
+    def __init__(self, prompt, token_budget=32000, keep_turns=2, on_elide=None):
+        self.prompt_parts = [types.Part(text=prompt)]
+        self.messages = [types.Content(role="user", parts=list(self.prompt_parts))]
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.on_elide = on_elide
+        self.dropped_calls = []
+        # (estimated tokens sent, prompt tokens reported by the model) per model call
+        self.usage = []
+
+    def estimate_tokens(self):
+        return sum(estimate_tokens(content) for content in self.messages)
+
+    def record_usage(self, prompt_token_count):
+        self.usage.append((self.estimate_tokens(), prompt_token_count))
+
+    def compact(self):
+        self._merge()
+        elided = self._stub_stale_responses()
+        elided += self._drop_old_turns()
+        if elided and self.on_elide is not None:
+            self.on_elide()
+        return self.messages
+
+    def _merge(self):
+        merged = []
+        for content in self.messages:
+            if merged and content.role == "model" and merged[-1].role == "model":
+                merged[-1] = types.Content(
+                    role="model", parts=merged[-1].parts + content.parts
+                )
+            else:
+                merged.append(content)
+
+        for i, content in enumerate(merged):
+            parts = []
+            for part in content.parts or []:
+                if parts and _is_plain_text(part) and _is_plain_text(parts[-1]):
+                    parts[-1] = types.Part(text=parts[-1].text + part.text)
+                else:
+                    parts.append(part)
+            if len(parts) != len(content.parts or []):
+                merged[i] = types.Content(role=content.role, parts=parts)
+        self.messages = merged
+
+    def _calls(self):
+        """Yields (name, args, content index, part index) for each answered function call."""
+        pending = []
+        for i, content in enumerate(self.messages):
+            for j, part in enumerate(content.parts or []):
+                if part.function_call is not None:
+                    pending.append(part.function_call)
+                elif part.function_response is not None and pending:
+                    call = pending.pop(0)
+                    yield call.name or "", call.args or {}, i, j
+
+    def _is_superseded(self, name, path, later):
+        for later_name, later_path in later:
+            if later_name in WRITES_PATH and (
+                path == "." or later_path == path or later_path.startswith(path + os.sep)
+            ):
+                return True
+            if later_name == name and later_path == path:
+                return True
+        return False
+
+    def _stub_stale_responses(self):
+        stubbed = 0
+        calls = list(self._calls())
+        later = []
+        for name, args, i, j in reversed(calls):
+            path = _call_path(name, args)
+            response = self.messages[i].parts[j].function_response.response or {}
+            if name in READ_ONLY or name == "run_python_file":
+                if _response_size(response) > MIN_STUB_CHARS and self._is_superseded(
+                    name, path, later
+                ):
+                    stub = {
+                        "result": f"[Output of {name}({path}) omitted, "
+                        "it was superseded later in the conversation]"
+                    }
+                    self.messages[i].parts[j] = types.Part.from_function_response(
+                        name=name, response=stub
+                    )
+                    stubbed += 1
+            # A reply saying the result is unchanged relies on the earlier result
+            if UNCHANGED not in str(response.get("result", "")):
+                later.append((name, path))
+        return stubbed
+
+    def _drop_old_turns(self):
+        starts = [i for i, content in enumerate(self.messages) if content.role == "model"]
+        if not starts:
+            return 0
+
+        prompt = self.messages[: starts[0]]
+        turns = [
+            self.messages[start:end]
+            for start, end in zip(starts, starts[1:] + [len(self.messages)])
+        ]
+        tokens = sum(estimate_tokens(content) for content in self.messages)
+        dropped = 0
+        while len(turns) > self.keep_turns and tokens > self.token_budget:
+            turn = turns.pop(0)
+            dropped += 1
+            tokens -= sum(estimate_tokens(content) for content in turn)
+            for content in turn:
+                for part in content.parts or []:
+                    if part.function_call is not None:
+                        args = part.function_call.args or {}
+                        name = part.function_call.name or ""
+                        self.dropped_calls.append(f"{name}({_call_path(name, args)})")
+
+        if self.dropped_calls:
+            note = types.Part(
+                text="[Earlier turns were omitted to save space, they called: "
+                + ", ".join(self.dropped_calls)
+                + ". Call the functions again if you need their results.]"
+            )
+            prompt[0] = types.Content(role="user", parts=self.prompt_parts + [note])
+        self.messages = prompt + [content for turn in turns for content in turn]
+        return dropped
+
+
+def _is_plain_text(part):
+    return part.text is not None and not part.thought and part.function_call is None
@@ -1,16 +1,40 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import json
 import os
 import sys
-import shutil
 from pathlib import Path
-
-from google import genai
-from google.genai import types
-from dotenv import load_dotenv
+from typing import TYPE_CHECKING
 
 import argparse
 
 # this project
-from functions import get_files_info, get_file_content, run_python_file, write_file
+from functions import (
+    edit_file,
+    get_files_info,
+    get_file_content,
+    get_outline,
+    run_python_file,
+    run_tests,
+    search_code,
+    write_file,
+)
+from functions.cache import tool_cache
+from functions.tracing import tracer
+from functions.sandbox_pool import FORKSERVER, SandboxPool
+from call_scheduler import FunctionCallScheduler
+from cassette import MODES as CASSETTE_MODES, CassetteClient
+from workspace import sync_workspace
+
+# google.genai takes a few hundred ms to import, it is imported where the
+# model is used so --help and argument errors return right away
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
+    from budget import ContextBudget
+    from history import History
 
 system_prompt = """
 You are a helpful AI coding agent.
@@ -22,6 +46,10 @@ You can perform the following operations without asking:
 - Read file contents
 - Execute Python files with optional arguments
 - Write or overwrite files
+- Edit files with search/replace, line ranges or unified diffs
+- Search the code for text or regular expressions
+- Outline python files, their classes and functions with line ranges
+- Run the unit tests affected by your changes
 
 All paths you provide should be relative to the working directory.
 You do not need to specify the working directory in your function calls
@@ -29,21 +57,42 @@ as it is automatically injected for security reasons.
 
 Keep as much of the existing code as you can, make only the neccesary changes
 to resolve the issue without replacing the entire code.
+Prefer edit_file over write_file to change existing files.
+Use get_outline to find the symbols you need and read only their line ranges.
+After changing code, check it with run_tests.
 """
-available_functions = types.Tool(
-    function_declarations=[
-        get_files_info.get_schema(),
-        get_file_content.get_schema(),
-        run_python_file.get_schema(),
-        write_file.get_schema(),
-    ]
+MODEL = "gemini-2.0-flash-001"
+
+# Tool modules offered to the model, each has a get_schema()
+TOOLS = (
+    get_files_info,
+    get_file_content,
+    run_python_file,
+    write_file,
+    edit_file,
+    search_code,
+    get_outline,
+    run_tests,
 )
 
+
+@functools.cache
+def available_functions():
+    """Returns the types.Tool declaring every tool, built on first use."""
+    from google.genai import types
+
+    return types.Tool(function_declarations=[module.get_schema() for module in TOOLS])
+
+
 functions = {
     "get_files_info": get_files_info.get_files_info,
     "get_file_content": get_file_content.get_file_content,
     "run_python_file": run_python_file.run_python_file,
     "write_file": write_file.write_file,
+    "edit_file": edit_file.edit_file,
+    "search_code": search_code.search_code,
+    "get_outline": get_outline.get_outline,
+    "run_tests": run_tests.run_tests,
 }
 
 sandbox = Path("sandbox_workspace")
@@ -59,7 +108,18 @@ class ExitOneArgumentParser(argparse.ArgumentParser):
         self.exit(1, f"{self.prog}: error: {message}\n")
 
 
-def call_function(function_call_part: types.FunctionCall, verbose: bool = False):
+def call_function(
+    function_call_part: types.FunctionCall, verbose: bool = False, workspace=None
+):
+    """Runs a function call, workspace is a (working_directory, working_directory_run) pair.
+
+    working_directory_run is relative to the sandbox mount, by default the
+    module level working directories are used.
+    """
+    from google.genai import types
+
+    if workspace is None:
+        workspace = (working_directory, working_directory_run)
     name = function_call_part.name or ""
     args = function_call_part.args or {}
     if verbose:
@@ -67,17 +127,21 @@ def call_function(function_call_part: types.FunctionCall, verbose: bool = False)
     else:
         print(f" - Calling function: {name}")
 
-    if name not in functions:
-        response = {"error": f"Unknown function: {name}"}
-    else:
-        cwd = working_directory
-        if name == "run_python_file":
-            cwd = working_directory_run
-        func = functions[name]
-        try:
-            response = {"result": func(working_directory=cwd, **args)}
-        except TypeError as e:  # if missing args
-            response = {"error": str(e)}
+    with tracer.span("call_function", function=name) as span:
+        if name not in functions:
+            response = {"error": f"Unknown function: {name}"}
+        else:
+            cwd = workspace[0]
+            if name in ("run_python_file", "run_tests"):
+                cwd = workspace[1]
+            func = functions[name]
+            try:
+                response = {"result": func(working_directory=cwd, **args)}
+            except TypeError as e:  # if missing args
+                response = {"error": str(e)}
+        if tracer.enabled:
+            span["args_bytes"] = len(json.dumps(args, default=str))
+            span["response_bytes"] = len(json.dumps(response, default=str))
 
     content = types.Content(
         role="user",
@@ -98,38 +162,124 @@ def get_function_response(ret):
 
 
 def get_parts_from_response(resp):
-    for candidate in getattr(resp, "candidates", []):
-        for key, content in getattr(candidate, "content", []):
+    for candidate in getattr(resp, "candidates", None) or []:
+        for key, content in getattr(candidate, "content", None) or []:
             if key == "parts":
                 for part in content:
                     yield part
 
 
-def call_agent(prompt, messages, config, verbose=False):
-    is_done = False
-    resp = client.models.generate_content(
-        model="gemini-2.0-flash-001",
-        contents=messages,
-        config=config,
-    )
+def print_text(text):
+    print(text, end="", flush=True)
+
 
-    # Add what the agent wanted to do to the conversation:
+async def _stream_turn(client, messages, config, scheduler, on_text, verbose=False):
+    """Streams one model response, submitting function calls to scheduler as they arrive.
+
+    Returns the response text, the model parts, the futures of the function
+    calls and the last usage metadata.
+    """
     response_text = ""
-    for part in get_parts_from_response(resp):
-        messages.append(types.Content(role="model", parts=[part]))
-        if verbose:
-            d = part.model_dump(exclude_unset=True)
-            print("part", d)
-        if part.text is not None:
-            response_text += part.text
-
-    print("Agent:", response_text)
-    # Run what the agent wants and add it to the conversation
-    func_responses = list()
-    if resp.function_calls:
-        for item in resp.function_calls:
-            # print(f"Calling function: {item.name}({item.args})")
-            ret = call_function(item, verbose=verbose)
+    model_parts = []
+    pending = []
+    usage_metadata = None
+    with tracer.span("model", model=MODEL) as span:
+        if tracer.enabled:
+            span["request_bytes"] = sum(
+                len(content.model_dump_json(exclude_none=True)) for content in messages
+            )
+        stream = await client.aio.models.generate_content_stream(
+            model=MODEL,
+            contents=messages,
+            config=config,
+        )
+        async for chunk in stream:
+            for part in get_parts_from_response(chunk):
+                model_parts.append(part)
+                if verbose:
+                    d = part.model_dump(exclude_unset=True)
+                    print("part", d)
+                if part.text is not None:
+                    response_text += part.text
+                    on_text(part.text)
+                if part.function_call is not None:
+                    future = scheduler.submit(part.function_call)
+                    pending.append(asyncio.wrap_future(future))
+            if chunk.usage_metadata is not None:
+                usage_metadata = chunk.usage_metadata
+        span["function_calls"] = len(pending)
+        if usage_metadata is not None:
+            span["prompt_tokens"] = usage_metadata.prompt_token_count or 0
+            span["response_tokens"] = usage_metadata.candidates_token_count or 0
+    return response_text, model_parts, pending, usage_metadata
+
+
+async def _gather_responses(pending, history, context_budget=None):
+    """Waits for the function calls of a turn, cut to the turn budget of context_budget."""
+    rets = await asyncio.gather(*pending)
+    if context_budget is not None and rets:
+        with tracer.span("context_budget", responses=len(rets)) as span:
+            omitted = context_budget.omitted_chars
+            rets = context_budget.fit(rets, history.estimate_tokens())
+            span["omitted_chars"] = context_budget.omitted_chars - omitted
+    return rets
+
+
+def _print_usage(prompt, history, usage_metadata):
+    print(f"User prompt: {prompt}")
+    if usage_metadata is not None:
+        print(
+            f"Prompt tokens: {usage_metadata.prompt_token_count} "
+            f"(history ~{history.usage[-1][0]} tokens, budget {history.token_budget})"
+        )
+        print(f"Response tokens: {usage_metadata.candidates_token_count}")
+
+
+async def call_agent(
+    client: genai.Client,
+    prompt,
+    history: History,
+    config,
+    verbose=False,
+    on_text=None,
+    workspace=None,
+    context_budget: ContextBudget | None = None,
+):
+    """Streams one model response, tool calls start as soon as their part arrives.
+
+    Text is passed to on_text as it streams, by default it is printed. With
+    context_budget, the function responses are cut to share its turn budget.
+    """
+    from google.genai import types
+
+    is_done = False
+    messages = history.compact()
+    if on_text is None:
+        print("Agent: ", end="")
+        on_text = print_text
+
+    # Independent calls run concurrently, responses are kept in call order
+    with FunctionCallScheduler(
+        lambda item: call_function(item, verbose=verbose, workspace=workspace)
+    ) as scheduler:
+        response_text, model_parts, pending, usage_metadata = await _stream_turn(
+            client, messages, config, scheduler, on_text, verbose
+        )
+        if on_text is print_text:
+            print()
+        # Estimate of the prompt the model saw, before this turn is added
+        prompt_token_count = None
+        if usage_metadata is not None:
+            prompt_token_count = usage_metadata.prompt_token_count
+        history.record_usage(prompt_token_count)
+
+        # Add what the agent wanted to do to the conversation
+        if model_parts:
+            messages.append(types.Content(role="model", parts=model_parts))
+
+        # Add what the agent did to the conversation
+        func_responses = list()
+        for ret in await _gather_responses(pending, history, context_budget):
             messages.append(ret)
             func_responses.extend(get_function_response(ret))
 
@@ -139,10 +289,7 @@ def call_agent(prompt, messages, config, verbose=False):
             print(f"func_response[{key}] = {item[key]}")
 
     if verbose:
-        print(f"User prompt: {prompt}")
-        if resp.usage_metadata is not None:
-            print(f"Prompt tokens: {resp.usage_metadata.prompt_token_count}")
-            print(f"Response tokens: {resp.usage_metadata.candidates_token_count}")
+        _print_usage(prompt, history, usage_metadata)
 
     # Done?
     if response_text != "" and len(func_responses) == 0:
@@ -152,29 +299,100 @@ def call_agent(prompt, messages, config, verbose=False):
     return messages, is_done
 
 
-def main(client: genai.Client, args):
-    # # Remove destination to ensure a clean copy (comment out to merge instead)
-    # if sandbox.exists():
-    #     shutil.rmtree(sandbox)
-    os.makedirs(sandbox, exist_ok=True)
-    shutil.copytree("calculator", working_directory, dirs_exist_ok=True)
-    print("working_directory", working_directory)
-
-    prompt = args.prompt
-    verbose = args.verbose
-    max_iterations = 20
-
-    part = types.Part(text=prompt)
-    messages = [types.Content(role="user", parts=[part])]
+async def run_agent(
+    client: genai.Client,
+    prompt,
+    verbose=False,
+    max_iterations=20,
+    on_text=None,
+    token_budget=32000,
+    workspace=None,
+    turn_budget=8000,
+):
+    """Runs the agent loop for prompt until the model is done, returns the conversation.
+
+    Each call gets its own history, workspace is passed on to call_function().
+    The function responses of one turn share turn_budget tokens, None for no limit.
+    """
+    from google.genai import types
+    from budget import ContextBudget
+    from history import History
+
+    history = History(
+        prompt, token_budget=token_budget, on_elide=tool_cache.forget_seen
+    )
     config = types.GenerateContentConfig(
-        system_instruction=system_prompt, tools=[available_functions]
+        system_instruction=system_prompt, tools=[available_functions()]
+    )
+    # A cut response is not what the model would get back again unchanged
+    context_budget = (
+        ContextBudget(turn_budget, on_truncate=tool_cache.forget_seen) if turn_budget else None
     )
 
     for iteration in range(max_iterations):
-        messages, is_done = call_agent(prompt, messages, config, verbose=verbose)
+        with tracer.span("iteration", iteration=iteration):
+            messages, is_done = await call_agent(
+                client,
+                prompt,
+                history,
+                config,
+                verbose=verbose,
+                on_text=on_text,
+                workspace=workspace,
+                context_budget=context_budget,
+            )
         if is_done:
             break
 
+    if verbose:
+        print("Iteration, history estimate, prompt tokens:")
+        for iteration, (estimate, prompt_tokens) in enumerate(history.usage):
+            print(f"{iteration:9} {estimate:18} {prompt_tokens}")
+    return messages
+
+
+def main(client: genai.Client, args):
+    # Only copies what changed, --reset-workspace also removes files left by earlier sessions
+    os.makedirs(sandbox, exist_ok=True)
+    sync_workspace("calculator", working_directory, reset=args.reset_workspace)
+    print("working_directory", working_directory)
+
+    tool_cache.notify_unchanged = args.notify_unchanged
+    run_python_file.MAX_OUTPUT_BYTES = args.max_output
+    run_python_file.SPILL_OUTPUT = args.spill_output
+    if args.trace or args.trace_chrome:
+        tracer.enable()
+
+    pool = None
+    if args.pool_size > 0:
+        forkserver = None
+        if args.forkserver:
+            forkserver = FORKSERVER + ("--preload", args.preload)
+        pool = SandboxPool(size=args.pool_size, forkserver=forkserver)
+        run_python_file.set_pool(pool)
+
+    try:
+        return asyncio.run(
+            run_agent(
+                client,
+                args.prompt,
+                verbose=args.verbose,
+                token_budget=args.token_budget,
+                turn_budget=args.turn_budget,
+            )
+        )
+    finally:
+        if pool is not None:
+            run_python_file.set_pool(None)
+            pool.close()
+        if tracer.enabled:
+            tracer.disable()
+            if args.trace:
+                tracer.export_jsonl(args.trace)
+            if args.trace_chrome:
+                tracer.export_chrome(args.trace_chrome)
+            print(tracer.summary())
+
 
 if __name__ == "__main__":
     argparser = ExitOneArgumentParser(description="Boot.dev AI Agent")
@@ -184,12 +402,119 @@ if __name__ == "__main__":
     argparser.add_argument(
         "--verbose", action="store_true", help="Enable verbose output"
     )
+    argparser.add_argument(
+        "--pool-size",
+        type=int,
+        default=2,
+        help="Number of warm sandbox containers to reuse, 0 starts a new container per run",
+    )
+    argparser.add_argument(
+        "--forkserver",
+        action="store_true",
+        help="Run python files in children forked from a warm interpreter in each pooled container, "
+        "needs an image built with `make install`",
+    )
+    argparser.add_argument(
+        "--preload",
+        default="",
+        help="Comma separated modules the fork server imports once, e.g. json,decimal",
+    )
+    argparser.add_argument(
+        "--max-output",
+        type=int,
+        default=run_python_file.MAX_OUTPUT_BYTES,
+        help="Bytes of stdout and of stderr of a run sent to the model, the middle of longer output is omitted",
+    )
+    argparser.add_argument(
+        "--spill-output",
+        action="store_true",
+        help=f"Write output that does not fit in full to {run_python_file.SPILL_DIR}/ in the working directory",
+    )
+    argparser.add_argument(
+        "--notify-unchanged",
+        action="store_true",
+        help="Reply with a short note instead of the full content when a file is read again unchanged",
+    )
+    argparser.add_argument(
+        "--token-budget",
+        type=int,
+        default=32000,
+        help="Approximate number of history tokens to send to the model, older turns are compacted",
+    )
+    argparser.add_argument(
+        "--turn-budget",
+        type=int,
+        default=8000,
+        help="Approximate number of tokens the function responses of one turn share, "
+        "longer responses are cut in the middle, 0 for no limit",
+    )
+    argparser.add_argument(
+        "--reset-workspace",
+        action="store_true",
+        help="Restore a pristine copy of the calculator project, removing files left by earlier sessions",
+    )
+    argparser.add_argument(
+        "--trace",
+        help="Write a JSON lines file of timed spans (model calls, tool calls, docker runs, file I/O) and print a summary",
+    )
+    argparser.add_argument(
+        "--trace-chrome",
+        help="Write the spans as Chrome trace events, open in chrome://tracing or ui.perfetto.dev",
+    )
+    argparser.add_argument(
+        "--cassette",
+        help="Gzip JSON lines file to record model responses to, or replay them from",
+    )
+    argparser.add_argument(
+        "--cassette-mode",
+        choices=CASSETTE_MODES,
+        default="cache",
+        help="record: always call the model, replay: never call the model, cache: call the model on a miss",
+    )
+    argparser.add_argument(
+        "--rpm", type=int, help="Limit model requests per minute, shared by concurrent calls"
+    )
+    argparser.add_argument("--tpm", type=int, help="Limit prompt tokens per minute")
+    argparser.add_argument(
+        "--max-retries",
+        type=int,
+        default=5,
+        help="Retries of a model call after a 429 or 5xx response, with backoff",
+    )
+    argparser.add_argument(
+        "--deadline",
+        type=float,
+        default=300.0,
+        help="Seconds a model call may take, including rate limit waits and retries",
+    )
+    argparser.add_argument(
+        "--base-url",
+        help="Gemini API endpoint to use instead of the default, e.g. a proxy or a local test server",
+    )
     args = argparser.parse_args()
 
+    import google.genai
+    from dotenv import load_dotenv
+    from ratelimit import RateLimiter, RetryingClient
+
     load_dotenv()
-    api_key = os.environ.get("GEMINI_API_KEY")
-    client = genai.Client(api_key=api_key)
+    client = retrying = None
+    if args.cassette is None or args.cassette_mode != "replay":
+        api_key = os.environ.get("GEMINI_API_KEY")
+        client = retrying = RetryingClient(
+            google.genai.Client(
+                api_key=api_key,
+                http_options={"base_url": args.base_url} if args.base_url else None,
+            ),
+            RateLimiter(args.rpm, args.tpm),
+            max_retries=args.max_retries,
+            deadline=args.deadline,
+        )
+    if args.cassette is not None:
+        client = CassetteClient(client, args.cassette, mode=args.cassette_mode)
     main(client, args)
+    if args.verbose and retrying is not None:
+        print(f"Model calls: {retrying.metrics}")
 
     # item = types.FunctionCall(
     #    name="run_python_file", args={"file_path": "main.py", "args": ("1 + 1",)}
@@ -0,0 +1,246 @@
+"""Rate limiting and retries for model calls.
+
+RetryingClient wraps a genai.Client (or anything with the same
+aio.models.generate_content_stream) the way CassetteClient does:
+
+    limiter = RateLimiter(requests_per_minute=15, tokens_per_minute=1_000_000)
+    client = RetryingClient(genai.Client(api_key=api_key), limiter)
+
+Every call first reserves one request and the estimated prompt tokens from
+the limiter, shared by all sessions using the client. A 429 or transient 5xx
+before the first chunk is retried with jittered exponential backoff, or after
+the delay the server asks for. A 429 also pauses the limiter and lowers its
+request rate, which recovers again with successful calls. Each call must
+finish within its deadline, including waits and retries.
+"""
+
+import asyncio
+import email.utils
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+from google.genai import errors
+
+from functions.tracing import tracer
+from history import estimate_tokens
+
+RETRY_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Refills at per_minute units per minute up to capacity, reservations may go into debt."""
+
+    def __init__(self, per_minute, capacity=None, clock=time.monotonic):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60
+        self.capacity = capacity if capacity is not None else per_minute
+        self.level = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount) -> float:
+        """Takes amount, returns the seconds to wait until it is covered."""
+        self._refill()
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def adjust(self, amount):
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+
+class RateLimiter:
+    """Requests per minute and tokens per minute limits, None for no limit.
+
+    Waiting callers are served in the order they reserved. throttled() pauses
+    every caller and halves the request rate, succeeded() raises it back
+    towards the configured rate.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, clock=time.monotonic):
+        self.clock = clock
+        self.requests = TokenBucket(requests_per_minute, clock=clock) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, clock=clock) if tokens_per_minute else None
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens) -> float:
+        with self._lock:
+            delay = max(self.paused_until - self.clock(), 0.0)
+            if self.requests is not None:
+                delay = max(delay, self.requests.reserve(1))
+            if self.tokens is not None:
+                delay = max(delay, self.tokens.reserve(tokens))
+            return delay
+
+    async def acquire(self, tokens) -> float:
+        """Waits until a request of tokens is allowed, returns the seconds waited."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            with tracer.span("throttle", reason="rate_limit", seconds=delay):
+                await asyncio.sleep(delay)
+        return delay
+
+    def adjust_tokens(self, amount):
+        """Corrects the tokens reserved for a request once the actual count is known."""
+        if self.tokens is not None:
+            with self._lock:
+                self.tokens.adjust(amount)
+
+    def throttled(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+            if self.requests is not None:
+                # Never below one request per minute
+                self.requests.rate = max(self.requests.rate / 2, 1 / 60)
+
+    def succeeded(self):
+        if self.requests is not None:
+            with self._lock:
+                configured = self.requests.per_minute / 60
+                self.requests.rate = min(self.requests.rate + configured / 10, configured)
+
+
+def retry_after(error) -> float | None:
+    """Returns the delay the server asked for, from a Retry-After header or a RetryInfo detail."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if value:
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            try:
+                date = email.utils.parsedate_to_datetime(value)
+                return max(date.timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        details = details.get("error", details).get("details", [])
+    for detail in details if isinstance(details, list) else []:
+        if isinstance(detail, dict) and detail.get("@type", "").endswith("RetryInfo"):
+            match = re.fullmatch(r"([\d.]+)s", str(detail.get("retryDelay", "")))
+            if match:
+                return float(match.group(1))
+    return None
+
+
+async def _within(deadline, awaitable):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise TimeoutError("Model call exceeded its deadline")
+    return await asyncio.wait_for(awaitable, remaining)
+
+
+class _RetryingModels:
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content_stream(self, model, contents, config=None):
+        client = self._client
+        metrics = client.metrics
+        deadline = time.monotonic() + client.deadline
+        tokens = sum(estimate_tokens(content) for content in contents)
+
+        for attempt in range(client.max_retries + 1):
+            waited = await _within(deadline, client.limiter.acquire(tokens))
+            metrics["limiter_wait_s"] += waited
+            metrics["requests"] += 1
+            try:
+                stream = await _within(
+                    deadline,
+                    client.client.aio.models.generate_content_stream(
+                        model=model, contents=contents, config=config
+                    ),
+                )
+                # Errors are raised with the first chunk, retry until one arrives
+                first = await _within(deadline, anext(stream))
+                break
+            except StopAsyncIteration:
+                first = None
+                break
+            except (errors.APIError, httpx.TransportError) as e:
+                delay = client.retry_delay(e, attempt)
+                if delay is None or attempt == client.max_retries:
+                    raise
+                if time.monotonic() + delay > deadline:
+                    raise TimeoutError(
+                        f"Model call exceeded its deadline, server asked to retry in {delay:.1f}s"
+                    ) from e
+                code = getattr(e, "code", None)
+                metrics["retries"] += 1
+                metrics["backoff_s"] += delay
+                if code == 429:
+                    metrics["throttled"] += 1
+                    client.limiter.throttled(delay)
+                with tracer.span("throttle", reason="backoff", code=code, seconds=delay):
+                    await asyncio.sleep(delay)
+        client.limiter.succeeded()
+
+        async def rest():
+            if first is None:
+                return
+            usage = first.usage_metadata
+            yield first
+            while True:
+                try:
+                    chunk = await _within(deadline, anext(stream))
+                except StopAsyncIteration:
+                    break
+                if chunk.usage_metadata is not None:
+                    usage = chunk.usage_metadata
+                yield chunk
+            if usage is not None and usage.prompt_token_count:
+                client.limiter.adjust_tokens(usage.prompt_token_count - tokens)
+
+        return rest()
+
+
+class RetryingClient:
+    """Wraps client so model calls are rate limited, retried and given a deadline in seconds."""
+
+    def __init__(
+        self,
+        client,
+        limiter=None,
+        max_retries=5,
+        base_delay=1.0,
+        max_delay=60.0,
+        deadline=300.0,
+    ):
+        self.client = client
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.metrics = {
+            "requests": 0,
+            "retries": 0,
+            "throttled": 0,
+            "limiter_wait_s": 0.0,
+            "backoff_s": 0.0,
+        }
+        self.aio = SimpleNamespace(models=_RetryingModels(self))
+
+    def retry_delay(self, error, attempt) -> float | None:
+        """Seconds to wait before retrying after error, None when it should not be retried."""
+        if isinstance(error, errors.APIError) and error.code not in RETRY_CODES:
+            return None
+        hint = retry_after(error)
+        if hint is not None:
+            return hint + random.uniform(0, self.base_delay)
+        # Full jitter, spreads out sessions that failed at the same time
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
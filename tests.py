@@ -1,7 +1,44 @@
+import asyncio
+import contextlib
+import io
+import json
 import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import unittest.mock
 
-from functions import get_files_info, get_file_content, run_python_file, write_file
+from google.genai import errors, types
+
+import batch
+import main
+from budget import TRUNCATED, ContextBudget, allocate, truncate
+from call_scheduler import FunctionCallScheduler
+from cassette import CassetteClient
+from fake_genai import FakeClient, FakeGeminiServer, call_chunk, chunk, error, text_chunk
+from history import History
+from ratelimit import RateLimiter, RetryingClient, TokenBucket, retry_after
+from workspace import manifest_path, sync_workspace
+
+from functions import (
+    edit_file,
+    get_files_info,
+    get_file_content,
+    get_outline,
+    run_python_file,
+    run_tests,
+    search_code,
+    write_file,
+)
+from functions.bounded_output import BoundedOutput, run_bounded
+from functions.cache import ToolCache, tool_cache
+from functions.sandbox_pool import SandboxPool
+from functions.tracing import Tracer, tracer
+
+FAKE_DOCKER = (sys.executable, os.path.abspath("fake_docker.py"))
 
 
 class TestFilesInfo(unittest.TestCase):
@@ -28,6 +65,38 @@ class TestFilesInfo(unittest.TestCase):
         with self.assertRaises(ValueError):
             list(get_files_info._get_files_info("calculator", "../"))
 
+    def test_recursive(self):
+        res = list(get_files_info._get_files_info("calculator", ".", recursive=True, sort="name"))
+        names = [item["name"] for item in res]
+        self.assertLess(names.index("pkg"), names.index("pkg/calculator.py"))
+        self.assertNotIn("pkg/__pycache__", names)
+
+        res = get_files_info._get_files_info(
+            "calculator", ".", recursive=True, max_depth=1, include=["*.py"]
+        )
+        self.assertEqual(sorted(item["name"] for item in res), ["main.py", "tests.py"])
+
+    def test_recursive_cursor(self):
+        first = get_files_info.get_files_info("calculator", recursive=True, limit=3)
+        self.assertIn("cursor=3", first)
+        rest = get_files_info.get_files_info("calculator", recursive=True, cursor=3)
+        listed = first.splitlines()[1:4] + rest.splitlines()[1:-1]
+        self.assertEqual(len(listed), len(set(listed)))
+        self.assertIn("pkg/render.py", "\n".join(listed))
+
+    def test_recursive_symlinks(self):
+        with tempfile.TemporaryDirectory() as outside, tempfile.TemporaryDirectory() as dir:
+            write_file._write_file(outside, "secret.txt", "host file")
+            write_file._write_file(dir, "pkg/a.py", "")
+            os.symlink(outside, os.path.join(dir, "escape"))
+            os.symlink("..", os.path.join(dir, "pkg", "loop"))
+            names = [item["name"] for item in get_files_info._get_files_info(dir, recursive=True)]
+            self.assertIn("escape", names)
+            self.assertNotIn("escape/secret.txt", names)
+            self.assertIn("pkg/loop", names)
+            self.assertNotIn("pkg/loop/pkg", names)
+            self.assertIn("4 entries", get_files_info.get_files_info(dir, recursive=True))
+
     def test_manual(self):
         print(get_files_info.get_files_info("calculator", "."))
         print(get_files_info.get_files_info("calculator", "pkg"))
@@ -55,6 +124,82 @@ class TestFilesContent(unittest.TestCase):
         )
         self.assertLessEqual(len(content), 10000)
 
+    def test_read_line_window(self):
+        content = get_file_content.get_file_content(
+            "calculator", "main.py", start_line=3, end_line=4
+        )
+        lines = get_file_content._get_file_content("calculator", "main.py")[0].splitlines()
+        self.assertTrue(content.startswith(f"{lines[2]}\n{lines[3]}\n"))
+        self.assertIn("start_line=5", content)
+
+    def test_read_line_window_past_stride(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_file._write_file(
+                tmp, "log.txt", "".join(f"line {i}\n" for i in range(1, 5001))
+            )
+            content = get_file_content.get_file_content(
+                tmp, "log.txt", start_line=2500, end_line=2501
+            )
+            self.assertTrue(content.startswith("line 2500\nline 2501\n"))
+            content = get_file_content.get_file_content(tmp, "log.txt", start_line=4999)
+            self.assertEqual(content, "line 4999\nline 5000\n")
+            self.assertEqual(
+                get_file_content.get_file_content(tmp, "log.txt", start_line=6000), ""
+            )
+
+    def test_concurrent_line_windows(self):
+        # Switch threads often, so reads interleave while they extend the line index
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+        for _ in range(10):
+            self.read_line_windows_concurrently()
+
+    def read_line_windows_concurrently(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_file._write_file(
+                tmp, "log.txt", "".join(f"line {i}\n" for i in range(1, 20001))
+            )
+            starts = [1 + 1000 * (19 - i % 20) for i in range(180)]
+            barrier = threading.Barrier(len(starts))
+            results = {}
+
+            def read(i, start):
+                barrier.wait()
+                results[i] = get_file_content.get_file_content(tmp, "log.txt", start_line=start, end_line=start)
+
+            threads = [threading.Thread(target=read, args=item) for item in enumerate(starts)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for i, start in enumerate(starts):
+                self.assertTrue(results[i].startswith(f"line {start}\n"), results[i])
+            content = get_file_content.get_file_content(tmp, "log.txt", start_line=19001, end_line=19001)
+            self.assertTrue(content.startswith("line 19001\n"))
+
+    def test_read_byte_window(self):
+        content = get_file_content.get_file_content("calculator", "lorem.txt")
+        self.assertIn("offset=10000", content)
+        window = get_file_content.get_file_content(
+            "calculator", "lorem.txt", offset=10000, length=20
+        )
+        with open("calculator/lorem.txt", "rb") as f:
+            f.seek(10000)
+            expected = f.read(20).decode()
+        self.assertTrue(window.startswith(expected))
+        self.assertIn("offset=10020", window)
+
+    def test_truncated_crlf_file_offset(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_file._write_file(tmp, "dos.txt", "")
+            with open(os.path.join(tmp, "dos.txt"), "wb") as f:
+                f.write(b"".join(b"line %d\r\n" % i for i in range(100)))
+            content = get_file_content.get_file_content(tmp, "dos.txt", max_chars=50)
+            self.assertIn("offset=50", content)
+            window = get_file_content.get_file_content(tmp, "dos.txt", offset=50, length=20)
+            with open(os.path.join(tmp, "dos.txt"), "rb") as f:
+                self.assertEqual(content[:50].encode() + window[:20].encode(), f.read(70))
+
     def test_manual(self):
         print(get_file_content.get_file_content("calculator", "main.py"))
         print(get_file_content.get_file_content("calculator", "pkg/calculator.py"))
@@ -104,6 +249,584 @@ class TestRunPythonFile(unittest.TestCase):
         self.assertEqual(run_python_file.get_schema().name, "run_python_file")
 
 
+class TestEditFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        write_file._write_file(self.dir, "a.txt", "one\ntwo\nthree\ntwo\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read(self):
+        return get_file_content._get_file_content(self.dir, "a.txt")[0]
+
+    def test_search_replace(self):
+        edit_file._edit_file(self.dir, "a.txt", search="one\n", replace="1\n")
+        self.assertEqual(self.read(), "1\ntwo\nthree\ntwo\n")
+
+    def test_search_must_be_unique(self):
+        with self.assertRaises(ValueError):
+            edit_file._edit_file(self.dir, "a.txt", search="two", replace="2")
+        self.assertIn("found 2 times", edit_file.edit_file(self.dir, "a.txt", search="two"))
+        self.assertEqual(self.read(), "one\ntwo\nthree\ntwo\n")
+
+    def test_replace_lines(self):
+        edit_file._edit_file(self.dir, "a.txt", start_line=2, end_line=3, replace="2\n3")
+        self.assertEqual(self.read(), "one\n2\n3\ntwo\n")
+        with self.assertRaises(ValueError):
+            edit_file._edit_file(self.dir, "a.txt", start_line=9, replace="")
+
+    def test_apply_diff(self):
+        diff = (
+            "--- a/a.txt\n+++ b/a.txt\n"
+            "@@ -3,2 +3,3 @@\n three\n-two\n+2\n+four\n"
+        )
+        edit_file._edit_file(self.dir, "a.txt", diff=diff)
+        self.assertEqual(self.read(), "one\ntwo\nthree\n2\nfour\n")
+
+    def test_diff_does_not_apply(self):
+        diff = "@@ -1,1 +1,1 @@\n-zero\n+0\n"
+        self.assertIn("does not apply", edit_file.edit_file(self.dir, "a.txt", diff=diff))
+        self.assertEqual(self.read(), "one\ntwo\nthree\ntwo\n")
+        self.assertEqual(os.listdir(self.dir), ["a.txt"])
+
+    def test_crlf_line_endings(self):
+        with open(os.path.join(self.dir, "dos.txt"), "wb") as file:
+            file.write(b"alpha\r\nbeta\r\ngamma\r\n")
+
+        def read():
+            with open(os.path.join(self.dir, "dos.txt"), "rb") as file:
+                return file.read()
+
+        content = get_file_content.get_file_content(self.dir, "dos.txt")
+        edit_file._edit_file(self.dir, "dos.txt", search=content[:11], replace="ALPHA\r\nbeta")
+        self.assertEqual(read(), b"ALPHA\r\nbeta\r\ngamma\r\n")
+        edit_file._edit_file(self.dir, "dos.txt", search="beta", replace="BETA")
+        self.assertEqual(read(), b"ALPHA\r\nBETA\r\ngamma\r\n")
+        edit_file._edit_file(self.dir, "dos.txt", diff="@@ -2,2 +2,2 @@\n BETA\n-gamma\n+GAMMA\n")
+        self.assertEqual(read(), b"ALPHA\r\nBETA\r\nGAMMA\n")
+
+    def test_outside_working_directory(self):
+        with self.assertRaises(ValueError):
+            edit_file._edit_file(self.dir, "../a.txt", search="one", replace="1")
+
+    def test_schema(self):
+        self.assertEqual(edit_file.get_schema().name, "edit_file")
+
+
+class TestSearchCode(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        write_file._write_file(
+            self.dir, "pkg/calc.py", "def add(a, b):\n    return a + b\n\n\ndef sub(a, b):\n    return a - b\n"
+        )
+        write_file._write_file(self.dir, "main.py", "from pkg.calc import add\nprint(add(1, 2))\n")
+        write_file._write_file(self.dir, "notes.txt", "Add more operators\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def search(self, pattern, **kwargs):
+        return search_code._search_code(self.dir, pattern, **kwargs)
+
+    def test_substring(self):
+        result = self.search("add(")
+        self.assertIn("main.py:2:print(add(1, 2))", result)
+        self.assertIn("pkg/calc.py:1:def add(a, b):", result)
+        self.assertNotIn("notes.txt", result)
+        self.assertTrue(result.endswith("2 matches in 2 files"))
+
+    def test_regex_and_ignore_case(self):
+        result = self.search(r"def \w+\(a", regex=True)
+        self.assertIn("pkg/calc.py:5:def sub(a, b):", result)
+        self.assertIn("2 matches in 1 files", result)
+        self.assertIn("notes.txt:1:Add more", self.search("add more", ignore_case=True))
+        self.assertIn("No matches", self.search("add more"))
+        self.assertIn("4 matches in 2 files", self.search("add|sub", regex=True, include=["*.py"]))
+
+    def test_context_and_limits(self):
+        result = self.search("return a +", context=1)
+        self.assertEqual(
+            result.splitlines()[:3],
+            ["pkg/calc.py-1-def add(a, b):", "pkg/calc.py:2:    return a + b", "pkg/calc.py-3-"],
+        )
+        write_file._write_file(self.dir, "many.txt", "match\n" * 20)
+        result = self.search("match", directory=".", include=["many.txt"])
+        self.assertIn("many.txt: ... 15 more matches", result)
+        self.assertIn("20 matches in 1 files", result)
+
+    def test_directory(self):
+        self.assertNotIn("main.py", self.search("add", directory="pkg"))
+        self.assertIn("outside", search_code.search_code(self.dir, "add", directory=".."))
+        self.assertIn("invalid regular expression", search_code.search_code(self.dir, "(", regex=True))
+
+    def test_index_updated_incrementally(self):
+        self.search("add")
+        index = search_code.get_index(self.dir)
+        indexed = index.indexed
+        self.assertEqual(index.candidates(["mul("]), set())
+
+        write_file._write_file(self.dir, "pkg/calc.py", "def mul(a, b):\n    return a * b\n")
+        self.assertIn("pkg/calc.py:1:def mul(a, b):", self.search("mul("))
+        self.assertEqual(index.indexed, indexed + 1)
+        self.assertNotIn("calc.py", self.search("def add"))
+
+        # Changed behind the back of the tools, found after a run may have changed files
+        with open(os.path.join(self.dir, "notes.txt"), "w") as file:
+            file.write("Add division\n")
+        tool_cache.invalidate_kind("get_files_info")
+        self.assertIn("notes.txt:1:Add division", self.search("division"))
+        self.assertEqual(index.indexed, indexed + 2)
+        os.remove(os.path.join(self.dir, "main.py"))
+        tool_cache.invalidate(os.path.join(self.dir, "main.py"))
+        self.assertNotIn("main.py", self.search("print"))
+
+    def test_literals(self):
+        self.assertEqual(search_code._literals(r"def\s+foo"), ["def", "foo"])
+        self.assertEqual(search_code._literals("ab|cd"), [])
+        self.assertEqual(search_code._literals("colou?r"), ["colo"])
+        self.assertEqual(search_code._literals(r"foo\.bar[xy]+baz{2}"), ["foo.bar"])
+        self.assertEqual(search_code._literals(r"main(\w+|x)tail"), ["main", "tail"])
+        self.assertEqual(search_code._literals("(?x) d e f"), [])
+
+    def test_escapes_with_arguments(self):
+        write_file._write_file(self.dir, "letters.txt", "Abcdef\n")
+        for pattern in [
+            r"\x41bcdef",
+            r"\u0041bcdef",
+            r"\U00000041bcdef",
+            r"\N{LATIN CAPITAL LETTER A}bcdef",
+            r"\101bcdef",
+            r"(A)\1?bcdef",
+        ]:
+            self.assertEqual(search_code._literals(pattern), ["bcdef"], pattern)
+            self.assertIn("letters.txt:1:Abcdef", self.search(pattern, regex=True), pattern)
+
+    def test_symlink_outside_working_directory(self):
+        with tempfile.TemporaryDirectory() as outside:
+            write_file._write_file(outside, "passwd", "root:x:0:0\n")
+            os.symlink(os.path.join(outside, "passwd"), os.path.join(self.dir, "link.txt"))
+            self.assertIn("No matches", self.search("root"))
+            self.assertIn("No matches", self.search("ro+t", regex=True))
+            self.assertIn("outside", get_file_content.get_file_content(self.dir, "link.txt"))
+
+    def test_schema(self):
+        self.assertEqual(search_code.get_schema().name, "search_code")
+
+
+class TestGetOutline(unittest.TestCase):
+    def test_calculator(self):
+        result = get_outline.get_outline("calculator", "pkg/calculator.py")
+        lines = result.splitlines()
+        self.assertEqual(lines[0], "pkg/calculator.py [1-361]")
+        self.assertIn("  class Calculator [55-274]", lines)
+        self.assertIn("    def evaluate(self, expression: str, **variables) -> float [71-83]", lines)
+        self.assertTrue(any(line.startswith("  def tokenize(source) [24-43]  # Yields") for line in lines))
+
+    def test_directory_and_cache(self):
+        with tempfile.TemporaryDirectory() as dir:
+            write_file._write_file(
+                dir, "a.py", '"""Module a."""\n\n@decorator\nasync def run(x=1):\n    def inner():\n        pass\n'
+            )
+            write_file._write_file(dir, "pkg/b.py", "class B(Base):\n    def m(self): ...\n")
+            write_file._write_file(dir, "broken.py", "def (\n")
+            write_file._write_file(dir, "notes.txt", "def not_python(): pass\n")
+            self.assertEqual(
+                get_outline.get_outline(dir).splitlines(),
+                [
+                    "a.py [1-6]",
+                    "  # Module a.",
+                    "  @decorator async def run(x=1) [3-6]",
+                    "broken.py [1-1]",
+                    "  SyntaxError: invalid syntax (line 1)",
+                    "pkg/b.py [1-2]",
+                    "  class B(Base) [1-2]",
+                    "    def m(self) [2-2]",
+                ],
+            )
+            hits = tool_cache.hits
+            get_outline.get_outline(dir, "pkg")
+            self.assertEqual(tool_cache.hits, hits + 1)
+            write_file._write_file(dir, "pkg/b.py", "def f(): pass\n")
+            self.assertIn("def f() [1-1]", get_outline.get_outline(dir, "pkg"))
+
+    def test_symlink_outside_working_directory(self):
+        with tempfile.TemporaryDirectory() as outside, tempfile.TemporaryDirectory() as dir:
+            write_file._write_file(outside, "secret.py", "def secret_fn(password='hunter2'):\n    pass\n")
+            write_file._write_file(dir, "a.py", "def a():\n    pass\n")
+            os.symlink(os.path.join(outside, "secret.py"), os.path.join(dir, "link.py"))
+            outline = get_outline.get_outline(dir, ".")
+            self.assertIn("def a()", outline)
+            self.assertNotIn("hunter2", outline)
+            self.assertIn("outside", get_outline.get_outline(dir, "link.py"))
+
+    def test_errors(self):
+        self.assertIn("outside", get_outline.get_outline("calculator", ".."))
+        self.assertIn("not found", get_outline.get_outline("calculator", "missing.py"))
+
+    def test_schema(self):
+        self.assertEqual(get_outline.get_schema().name, "get_outline")
+
+
+class TestToolCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        write_file._write_file(self.dir, "a.txt", "hello")
+        tool_cache.clear()
+
+    def tearDown(self):
+        tool_cache.notify_unchanged = False
+        tool_cache.clear()
+        self.tmp.cleanup()
+
+    def test_repeated_read_hits_cache(self):
+        get_file_content._get_file_content(self.dir, "a.txt")
+        hits = tool_cache.hits
+        content, _ = get_file_content._get_file_content(self.dir, "a.txt")
+        self.assertEqual(content, "hello")
+        self.assertEqual(tool_cache.hits, hits + 1)
+
+    def test_write_invalidates(self):
+        get_file_content._get_file_content(self.dir, "a.txt")
+        list(get_files_info._get_files_info(self.dir))
+        write_file._write_file(self.dir, "a.txt", "hello world")
+        content, _ = get_file_content._get_file_content(self.dir, "a.txt")
+        self.assertEqual(content, "hello world")
+        sizes = [item["size"] for item in get_files_info._get_files_info(self.dir)]
+        self.assertEqual(sizes, [11])
+
+    def test_evicts_to_max_bytes(self):
+        cache = ToolCache(max_bytes=10)
+        cache.put(("kind", "a"), 1, "x" * 6)
+        cache.put(("kind", "b"), 1, "x" * 6)
+        self.assertIsNone(cache.get(("kind", "a"), 1))
+        self.assertEqual(cache.get(("kind", "b"), 1), "x" * 6)
+        self.assertIsNone(cache.get(("kind", "b"), 2))
+
+    def test_notify_unchanged(self):
+        tool_cache.notify_unchanged = True
+        self.assertEqual(get_file_content.get_file_content(self.dir, "a.txt"), "hello")
+        self.assertIn("unchanged", get_file_content.get_file_content(self.dir, "a.txt"))
+        write_file._write_file(self.dir, "a.txt", "changed")
+        self.assertEqual(get_file_content.get_file_content(self.dir, "a.txt"), "changed")
+        tool_cache.forget_seen()
+        self.assertEqual(get_file_content.get_file_content(self.dir, "a.txt"), "changed")
+
+    def test_notify_unchanged_listing_with_filter(self):
+        tool_cache.notify_unchanged = True
+        listing = get_files_info.get_files_info(self.dir, include=["*.txt"])
+        self.assertIn("- a.txt", listing)
+        self.assertNotIn("Error", listing)
+        self.assertIn("unchanged", get_files_info.get_files_info(self.dir, include=["*.txt"]))
+
+
+class TestSandboxPool(unittest.TestCase):
+    def setUp(self):
+        self.state = tempfile.TemporaryDirectory()
+        self.environ = dict(os.environ)
+        os.environ["FAKE_DOCKER_STATE"] = self.state.name
+        os.environ["FAKE_DOCKER_WORKSPACE"] = os.getcwd()
+        # keep __pycache__ out of the calculator directory listed by other tests
+        os.environ["PYTHONDONTWRITEBYTECODE"] = "1"
+        self.pool = SandboxPool(size=2, max_runs=2, docker=FAKE_DOCKER)
+        self.pool.start()
+
+    def tearDown(self):
+        run_python_file.set_pool(None)
+        self.pool.close()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        self.state.cleanup()
+
+    def containers(self):
+        return sorted(os.listdir(self.state.name))
+
+    def test_run_in_pool(self):
+        run_python_file.set_pool(self.pool)
+        stdout, stderr = run_python_file._run_python_file(
+            "calculator", "main.py", ["2 + 3 * 4"]
+        )
+        self.assertIn('"result": 14', stdout)
+        self.assertEqual(stderr, "")
+        self.assertEqual(len(self.containers()), 2)
+
+    def test_run_non_existent_file_in_pool(self):
+        run_python_file.set_pool(self.pool)
+        with self.assertRaises(FileNotFoundError):
+            _ = run_python_file._run_python_file(
+                "calculator", "pkg/non_existent.py", ["2 + 2"]
+            )
+
+    def test_recycle_after_max_runs(self):
+        before = set(self.containers())
+        for _ in range(4):
+            self.pool.run(["python", "-c", "pass"])
+        self.assertEqual(before & set(self.containers()), set())
+        self.pool.close()
+        self.assertEqual(self.containers(), [])
+
+    def test_recycle_dirty_container(self):
+        before = set(self.containers())
+        script = "import os; open(os.path.join(os.environ['FAKE_DOCKER_ROOTFS'], 'tmp'), 'w').close()"
+        result = self.pool.run(["python", "-c", script])
+        self.assertEqual(result.returncode, 0)
+        # the replacement is started in the background
+        container = self.pool._acquire(timeout=10)
+        self.pool._release(container)
+        container = self.pool._acquire(timeout=10)
+        self.pool._release(container)
+        self.assertEqual(len(before & set(self.containers())), 1)
+
+    def test_bounded_output(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            script = os.path.join(tmp, "flood.py")
+            with open(script, "w") as file:
+                file.write("import sys\nprint('start')\nfor i in range(100000): print(i)\nprint('end', file=sys.stderr)\n")
+            spill = os.path.join(tmp, "spill")
+            result = self.pool.run(["python", script], max_bytes=1000, spill=spill)
+            self.assertTrue(result.stdout.startswith("start\n0\n1\n"))
+            self.assertTrue(result.stdout.endswith("99999\n"))
+            self.assertIn("bytes omitted] ...", result.stdout)
+            self.assertLess(len(result.stdout), 1100)
+            self.assertEqual(result.stderr, "end\n")
+            with open(os.path.join(spill, "stdout.txt")) as file:
+                self.assertEqual(len(file.read().splitlines()), 100001)
+            self.assertFalse(os.path.exists(os.path.join(spill, "stderr.txt")))
+
+    def test_unhealthy_container_is_replaced(self):
+        self.pool.health_interval = 0
+        for name in self.containers():
+            os.rmdir(os.path.join(self.state.name, name, "rootfs"))
+            os.rmdir(os.path.join(self.state.name, name))
+        result = self.pool.run(["python", "-c", "print('hello')"])
+        self.assertEqual(result.stdout.strip(), "hello")
+
+
+class TestForkServerPool(TestSandboxPool):
+    def setUp(self):
+        super().setUp()
+        self.use_pool(size=1)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def use_pool(self, **kwargs):
+        self.pool.close()
+        forkserver = ["python", os.path.abspath("forkserver.py"), "--preload", "json,decimal"]
+        self.pool = SandboxPool(docker=FAKE_DOCKER, forkserver=forkserver, **kwargs)
+        self.pool.start()
+
+    def script(self, source):
+        path = os.path.join(self.tmp.name, "script.py")
+        with open(path, "w") as file:
+            file.write(source)
+        return path
+
+    def test_run_in_pool(self):
+        run_python_file.set_pool(self.pool)
+        stdout, stderr = run_python_file._run_python_file(
+            "calculator", "main.py", ["2 + 3 * 4"]
+        )
+        self.assertIn('"result": 14', stdout)
+        self.assertEqual(stderr, "")
+        # the fork server is started once and reused
+        container = next(iter(self.pool._containers))
+        worker = container.worker
+        self.assertTrue(worker)
+        run_python_file._run_python_file("calculator", "main.py", ["1 + 1"])
+        self.assertIs(container.worker, worker)
+        self.assertEqual(self.containers(), [container.name])
+
+    def test_recycle_after_max_runs(self):
+        self.use_pool(size=1, max_runs=2)
+        path = self.script("print('run')\n")
+        before = self.containers()
+        self.assertEqual(self.pool.run(["python", path]).stdout, "run\n")
+        worker = next(iter(self.pool._containers)).worker
+        self.assertTrue(worker)
+        self.assertEqual(self.pool.run(["python", path]).stdout, "run\n")
+        # the fork server is stopped with its container
+        self.assertIsNotNone(worker.poll())
+        self.assertEqual(self.pool.run(["python", path]).stdout, "run\n")
+        self.assertEqual(set(before) & set(self.containers()), set())
+        self.assertIsNot(next(iter(self.pool._containers)).worker, worker)
+        self.pool.close()
+        self.assertEqual(self.containers(), [])
+
+    def test_recycle_dirty_container(self):
+        self.use_pool(size=1, max_runs=10)
+        before = self.containers()
+        path = self.script("import os\nopen(os.path.join(os.environ['FAKE_DOCKER_ROOTFS'], 'tmp'), 'w').close()\n")
+        self.assertEqual(self.pool.run(["python", path]).returncode, 0)
+        result = self.pool.run(["python", self.script("print('clean')\n")])
+        self.assertEqual(result.stdout, "clean\n")
+        self.assertEqual(set(before) & set(self.containers()), set())
+
+    def test_exit_code_and_output(self):
+        path = self.script("import sys\nprint(sys.argv[1:])\nprint('oops', file=sys.stderr)\nsys.exit(3)\n")
+        result = self.pool.run(["python", path, "a", "b"])
+        self.assertEqual(result.returncode, 3)
+        self.assertEqual(result.stdout, "['a', 'b']\n")
+        self.assertEqual(result.stderr, "oops\n")
+
+    def test_exception(self):
+        result = self.pool.run(["python", self.script("raise ValueError('bad')\n")])
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("ValueError: bad", result.stderr)
+
+    def test_timeout_keeps_container(self):
+        before = self.containers()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            self.pool.run(["python", self.script("import time\ntime.sleep(30)\n")], timeout=0.5)
+        result = self.pool.run(["python", self.script("print('still here')\n")])
+        self.assertEqual(result.stdout, "still here\n")
+        self.assertEqual(self.containers(), before)
+
+    def test_falls_back_to_exec(self):
+        self.pool.close()
+        self.pool = SandboxPool(size=1, docker=FAKE_DOCKER, forkserver=["python", "-c", "pass"])
+        result = self.pool.run(["python", self.script("print('exec')\n")])
+        self.assertEqual(result.stdout, "exec\n")
+        self.assertIs(next(iter(self.pool._containers)).worker, False)
+
+
+class TestRunTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.state = tempfile.TemporaryDirectory()
+        self.environ = dict(os.environ)
+        os.environ["FAKE_DOCKER_STATE"] = self.state.name
+        os.environ["FAKE_DOCKER_WORKSPACE"] = self.tmp.name
+        os.environ["PYTHONDONTWRITEBYTECODE"] = "1"
+        self.pool = SandboxPool(size=1, docker=FAKE_DOCKER, workspace=self.tmp.name)
+        run_python_file.set_pool(self.pool)
+        self.dir = os.path.join(self.tmp.name, "project")
+        self.write("pkg/__init__.py", "")
+        self.write("pkg/add.py", "def add(a, b):\n    return a + b\n")
+        self.write("pkg/mul.py", "from .add import add\n\n\ndef mul(a, b):\n    return a * b\n")
+        self.write("test_add.py", self.make_test("from pkg.add import add", "add(2, 3)", 5))
+        self.write("test_mul.py", self.make_test("from pkg import mul", "mul.mul(2, 3)", 6))
+        self.write("main.py", "import pkg.mul\n")
+
+    def tearDown(self):
+        run_python_file.set_pool(None)
+        self.pool.close()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        self.state.cleanup()
+        self.tmp.cleanup()
+
+    def write(self, path, content):
+        write_file._write_file(self.dir, path, content)
+        # Same second writes may keep the mtime, make every change visible
+        os.utime(os.path.join(self.dir, path), ns=(time.time_ns(), time.time_ns()))
+
+    def make_test(self, imports, call, expected):
+        return (
+            f"import unittest\n{imports}\n\n\nclass Test(unittest.TestCase):\n"
+            f"    def test_it(self):\n        self.assertEqual({call}, {expected})\n"
+        )
+
+    def run_tests(self, **kwargs):
+        return run_tests.run_tests("project", **kwargs)
+
+    def test_affected_tests(self):
+        result = self.run_tests()
+        self.assertIn("Ran 2 tests from 2 of 2 test modules", result)
+        self.assertIn("2 passed", result)
+        self.assertIn("No tests affected", self.run_tests())
+
+        # pkg.mul imports pkg.add, both tests depend on it
+        self.write("pkg/add.py", "def add(a, b):\n    return a + b + 0\n")
+        self.assertIn("Ran 2 tests from 2 of 2", self.run_tests())
+        self.write("pkg/mul.py", "def mul(a, b):\n    return a + b\n")
+        result = self.run_tests()
+        self.assertIn("Ran 1 tests from 1 of 2 test modules", result)
+        self.assertIn("Selected by changes to: pkg/mul.py", result)
+        self.assertIn("1 failed", result)
+        self.assertIn("FAIL: test_mul.Test.test_it", result)
+        self.assertIn("AssertionError: 5 != 6", result)
+
+        # Failing tests run again until they pass
+        self.write("main.py", "\n")
+        self.assertIn("FAIL: test_mul.Test.test_it", self.run_tests())
+        self.write("pkg/mul.py", "def mul(a, b):\n    return a * b\n")
+        self.assertIn("1 passed", self.run_tests())
+        self.assertIn("No tests affected", self.run_tests())
+
+    def test_run_all_and_files(self):
+        self.run_tests()
+        self.assertIn("Ran 2 tests from 2 of 2", self.run_tests(run_all=True))
+        self.assertIn("Ran 1 tests from 1 of 2", self.run_tests(test_files=["test_add.py"]))
+        self.assertIn("not found", self.run_tests(test_files=["missing.py"]))
+        self.assertIn("outside", self.run_tests(test_files=["../test_add.py"]))
+
+    def test_import_error(self):
+        self.write("test_broken.py", "import missing_module\n")
+        result = self.run_tests()
+        self.assertIn("1 errors", result)
+        self.assertIn("ModuleNotFoundError", result)
+        self.assertIn("test_broken", self.run_tests())
+
+    def test_setup_class_error_runs_again(self):
+        self.run_tests()
+        self.write(
+            "test_add.py",
+            "import unittest\n\n\nclass Test(unittest.TestCase):\n    @classmethod\n"
+            "    def setUpClass(cls):\n        raise RuntimeError('no fixture')\n\n"
+            "    def test_it(self):\n        pass\n",
+        )
+        self.assertIn("ERROR: setUpClass (test_add.Test)", self.run_tests())
+        # Still failing, so selected again although nothing changed
+        self.assertIn("ERROR: setUpClass (test_add.Test)", self.run_tests())
+        self.assertTrue(run_tests._in_module("setUpModule (test_add)", "test_add"))
+        self.assertFalse(run_tests._in_module("setUpClass (test_mul.Test)", "test_add"))
+
+    def test_imports(self):
+        path = os.path.join(self.dir, "pkg", "mul.py")
+        self.assertEqual(run_tests._imports(path, "pkg.mul"), ["pkg", "pkg.add", "pkg.add.add"])
+
+    def test_schema(self):
+        self.assertEqual(run_tests.get_schema().name, "run_tests")
+
+
+class TestBoundedOutput(unittest.TestCase):
+    def test_head_and_tail(self):
+        output = BoundedOutput(max_bytes=10)
+        for i in range(100):
+            output.write(b"%d," % i)
+        output.close()
+        self.assertEqual(output.total, 290)
+        self.assertEqual(output.omitted, 280)
+        self.assertEqual(output.getvalue(), "0,1,2\n... [280 bytes omitted] ...\n8,99,")
+
+    def test_short_output(self):
+        output = BoundedOutput(max_bytes=10)
+        output.write(b"abc")
+        output.write(b"defg")
+        self.assertEqual(output.getvalue(), "abcdefg")
+
+    def test_skip_lines_across_chunks(self):
+        output = BoundedOutput(skip_line=run_python_file.is_container_message)
+        for data in [b" Container sandbox-1 Crea", b"ted\nhello\n Container x Creating\nwor", b"ld"]:
+            output.write(data)
+        output.close()
+        self.assertEqual(output.getvalue(), "hello\nworld")
+
+    def test_run_bounded(self):
+        with tempfile.TemporaryDirectory() as spill:
+            result = run_bounded(
+                [sys.executable, "-c", "print('x' * 100000)"], 10, max_bytes=100, spill=spill
+            )
+            self.assertEqual(result.returncode, 0)
+            self.assertIn("[99901 bytes omitted]", result.stdout)
+            self.assertEqual(os.listdir(spill), ["stdout.txt"])
+            with self.assertRaises(subprocess.TimeoutExpired):
+                run_bounded([sys.executable, "-c", "import time; time.sleep(10)"], 0.2)
+
+
 class TestWriteReadFile(unittest.TestCase):
     def test_write_file_within_working_directory(self):
         write_file._write_file("calculator", "test_output.txt", "Hello, World!")
@@ -158,6 +881,602 @@ class TestWriteReadFile(unittest.TestCase):
         )
         self.assertEqual(write_file.get_schema().name, "write_file")
 
+    def test_review_prompts_one_at_a_time(self):
+        active = []
+        overlapped = []
+
+        def slow_input(prompt):
+            active.append(prompt)
+            overlapped.append(len(active) > 1)
+            time.sleep(0.05)
+            active.pop()
+
+        with tempfile.TemporaryDirectory() as dir, unittest.mock.patch("builtins.input", slow_input), \
+                contextlib.redirect_stdout(io.StringIO()):
+            threads = [
+                threading.Thread(target=write_file.write_file, args=(dir, f"{name}.py", "x = 1\n"))
+                for name in "abc"
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(overlapped, [False] * 3)
+
+
+class TestFunctionCallScheduler(unittest.TestCase):
+    def call(self, name, **args):
+        return types.FunctionCall(name=name, args=args)
+
+    def test_results_in_call_order(self):
+        def run(item):
+            # later calls finish first
+            time.sleep(0.05 / (1 + len(item.args["file_path"])))
+            return item.args["file_path"]
+
+        calls = [self.call("get_file_content", file_path="a" * i) for i in range(5)]
+        with FunctionCallScheduler(run) as scheduler:
+            self.assertEqual(scheduler.map(calls), ["a" * i for i in range(5)])
+
+    def test_reads_run_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def run(item):
+            barrier.wait()
+            return item.name
+
+        calls = [
+            self.call("get_files_info", directory="."),
+            self.call("get_file_content", file_path="main.py"),
+            self.call("get_file_content", file_path="pkg/calculator.py"),
+        ]
+        with FunctionCallScheduler(run) as scheduler:
+            self.assertEqual(len(scheduler.map(calls)), 3)
+
+    def test_conflicting_calls_stay_ordered(self):
+        events = []
+
+        def run(item):
+            if item.name != "get_file_content":
+                time.sleep(0.05)
+            events.append((item.name, item.args.get("file_path")))
+
+        calls = [
+            self.call("write_file", file_path="pkg/a.py", content=""),
+            self.call("get_file_content", file_path="pkg/a.py"),
+            self.call("get_file_content", file_path="main.py"),
+            self.call("run_python_file", file_path="main.py"),
+            self.call("get_file_content", file_path="main.py"),
+        ]
+        with FunctionCallScheduler(run) as scheduler:
+            scheduler.map(calls)
+        self.assertLess(
+            events.index(("write_file", "pkg/a.py")),
+            events.index(("get_file_content", "pkg/a.py")),
+        )
+        # the independent read of main.py does not wait for the write
+        self.assertEqual(events[0], ("get_file_content", "main.py"))
+        self.assertEqual(events[-1], ("get_file_content", "main.py"))
+        self.assertEqual(events[-2], ("run_python_file", "main.py"))
+
+
+class TestStartup(unittest.TestCase):
+    def test_help_does_not_import_sdk(self):
+        code = "import sys, main; print('google.genai' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        self.assertEqual(result.stdout.strip(), "False")
+        result = subprocess.run([sys.executable, "main.py", "--help"], capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0)
+        self.assertIn("--base-url", result.stdout)
+
+    def test_tool_schemas(self):
+        names = [declaration.name for declaration in main.available_functions().function_declarations]
+        self.assertEqual(sorted(names), sorted(main.functions))
+
+
+class TestAgentLoop(unittest.TestCase):
+    def setUp(self):
+        self.functions = dict(main.functions)
+
+    def tearDown(self):
+        main.functions.clear()
+        main.functions.update(self.functions)
+
+    def test_streamed_text(self):
+        client = FakeClient(
+            [[chunk(types.Part(text="Hello")), chunk(types.Part(text=" world"))]]
+        )
+        text = []
+        messages = asyncio.run(main.run_agent(client, "hi", on_text=text.append))
+        self.assertEqual(text, ["Hello", " world"])
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(messages[-1].role, "model")
+
+    def test_tool_call_starts_while_streaming(self):
+        started = threading.Event()
+
+        def get_files_info(working_directory, directory="."):
+            started.set()
+            return "listing"
+
+        main.functions["get_files_info"] = get_files_info
+
+        async def wait_for_tool():
+            # only returns once the tool has started, before the stream ended
+            self.assertTrue(await asyncio.to_thread(started.wait, 5))
+            return chunk(types.Part(text="Listing files"))
+
+        call = types.FunctionCall(name="get_files_info", args={"directory": "."})
+        client = FakeClient(
+            [
+                [chunk(types.Part(function_call=call)), wait_for_tool],
+                [chunk(types.Part(text="Done"))],
+            ]
+        )
+        messages = asyncio.run(main.run_agent(client, "list", on_text=lambda t: None))
+        self.assertEqual(
+            [m.role for m in messages], ["user", "model", "user", "model"]
+        )
+        response = messages[2].parts[0].function_response.response
+        self.assertEqual(response, {"result": "listing"})
+        # the second request includes the function response
+        self.assertEqual(len(client.aio.models.requests[1]), 3)
+
+    def test_usage_is_recorded_for_the_prompt_sent(self):
+        main.functions["get_files_info"] = lambda working_directory, directory=".": "x" * 5000
+        history = History("list")
+        sent = history.estimate_tokens()
+        client = FakeClient([[call_chunk("get_files_info", directory=".")]])
+        with contextlib.redirect_stdout(io.StringIO()):
+            messages, _ = asyncio.run(main.call_agent(client, "list", history, None, on_text=lambda t: None))
+        self.assertEqual(history.usage, [(sent, None)])
+        self.assertGreater(history.estimate_tokens(), sent + 1000)
+        self.assertEqual(len(messages), 3)
+
+
+class TestHistory(unittest.TestCase):
+    def turn(self, history, name, result, **args):
+        call = types.FunctionCall(name=name, args=args)
+        history.messages.append(
+            types.Content(role="model", parts=[types.Part(function_call=call)])
+        )
+        history.messages.append(
+            types.Content(
+                role="user",
+                parts=[types.Part.from_function_response(name=name, response={"result": result})],
+            )
+        )
+
+    def responses(self, history):
+        return [
+            part.function_response.response["result"]
+            for content in history.messages
+            for part in content.parts
+            if part.function_response is not None
+        ]
+
+    def test_merge_model_parts(self):
+        history = History("prompt")
+        history.messages.append(types.Content(role="model", parts=[types.Part(text="Hel")]))
+        history.messages.append(types.Content(role="model", parts=[types.Part(text="lo")]))
+        history.compact()
+        self.assertEqual(len(history.messages), 2)
+        self.assertEqual(history.messages[1].parts[0].text, "Hello")
+
+    def test_stale_read_is_stubbed(self):
+        history = History("prompt")
+        self.turn(history, "get_file_content", "A" * 1000, file_path="main.py")
+        self.turn(history, "write_file", "ok", file_path="main.py", content="B")
+        self.turn(history, "get_file_content", "B" * 1000, file_path="main.py")
+        history.compact()
+        first, _, last = self.responses(history)
+        self.assertIn("omitted", first)
+        self.assertEqual(last, "B" * 1000)
+
+    def test_old_run_output_is_stubbed(self):
+        history = History("prompt")
+        self.turn(history, "run_python_file", "1" * 1000, file_path="main.py")
+        self.turn(history, "run_python_file", "2" * 1000, file_path="tests.py")
+        self.turn(history, "run_python_file", "3" * 1000, file_path="main.py")
+        history.compact()
+        self.assertEqual(
+            [len(r) for r in self.responses(history)][1:], [1000, 1000]
+        )
+        self.assertIn("omitted", self.responses(history)[0])
+
+    def test_drop_old_turns(self):
+        history = History("prompt", token_budget=600, keep_turns=2)
+        for i in range(10):
+            self.turn(history, "get_file_content", "x" * 1000, file_path=f"{i}.py")
+        history.compact()
+        self.assertLessEqual(len(history.messages), 1 + 2 * 2)
+        self.assertEqual(history.messages[0].parts[0].text, "prompt")
+        self.assertIn("get_file_content(0.py)", history.messages[0].parts[1].text)
+        # every function response follows the model content with its call
+        self.assertEqual(history.messages[1].role, "model")
+        self.assertEqual(self.responses(history), ["x" * 1000] * 2)
+
+
+class TestContextBudget(unittest.TestCase):
+    def response(self, name, result):
+        return types.Content(
+            role="user", parts=[types.Part.from_function_response(name=name, response={"result": result})]
+        )
+
+    def result(self, content):
+        return content.parts[0].function_response.response["result"]
+
+    def test_allocate(self):
+        self.assertEqual(allocate([100, 5000, 20000], 6000), [100, 2950, 2950])
+        self.assertEqual(allocate([100, 200], 6000), [100, 200])
+        # Never below MIN_CHARS
+        self.assertEqual(allocate([1000, 1000], 10), [256, 256])
+
+    def test_truncate(self):
+        text = "".join(f"line {i}\n" for i in range(1000))
+        cut = truncate(text, 500)
+        self.assertLessEqual(len(cut), 500)
+        self.assertTrue(cut.startswith("line 0\n"))
+        self.assertTrue(cut.endswith("line 999\n"))
+        self.assertIn("chars omitted", cut)
+        self.assertEqual(truncate("short", 500), "short")
+
+    def test_fit(self):
+        budget = ContextBudget(turn_tokens=1000)
+        contents = [
+            self.response("get_files_info", "small"),
+            self.response("get_file_content", "a" * 20000),
+            self.response("run_python_file", "b" * 3000),
+        ]
+        fitted = budget.fit(contents, history_tokens=100)
+        results = [self.result(content) for content in fitted]
+        self.assertEqual(results[0], "small")
+        self.assertLessEqual(sum(len(result) for result in results), 4000)
+        self.assertTrue(all(TRUNCATED.split("{}")[0] in result for result in results[1:]))
+        self.assertEqual(fitted[1].parts[0].function_response.name, "get_file_content")
+        self.assertGreater(budget.omitted_chars, 18000)
+        # Unchanged when everything fits
+        small = contents[:1]
+        self.assertIs(budget.fit(small, history_tokens=100), small)
+
+    def test_fit_keeps_call_id_and_forgets_seen(self):
+        self.addCleanup(tool_cache.clear)
+        self.addCleanup(setattr, tool_cache, "notify_unchanged", False)
+        tool_cache.notify_unchanged = True
+        with tempfile.TemporaryDirectory() as dir:
+            write_file._write_file(dir, "big.txt", "a" * 9000)
+            read = get_file_content.get_file_content(dir, "big.txt")
+            part = types.Part(
+                function_response=types.FunctionResponse(id="call-1", name="get_file_content", response={"result": read})
+            )
+            budget = ContextBudget(turn_tokens=500, on_truncate=tool_cache.forget_seen)
+            fitted = budget.fit([types.Content(role="user", parts=[part])], history_tokens=0)
+            self.assertEqual(fitted[0].parts[0].function_response.id, "call-1")
+            self.assertIn("chars omitted", self.result(fitted[0]))
+            # The model only got part of it, reading again returns the whole file
+            self.assertEqual(get_file_content.get_file_content(dir, "big.txt"), read)
+            self.assertIn("unchanged", get_file_content.get_file_content(dir, "big.txt"))
+
+    def test_turn_budget(self):
+        budget = ContextBudget(turn_tokens=1000, context_tokens=10000, reserve_tokens=0)
+        self.assertEqual(budget.turn_budget(100), 1000)
+        self.assertEqual(budget.turn_budget(9500), 500)
+        self.assertEqual(budget.turn_budget(20000), 0)
+
+    def test_agent_loop(self):
+        self.addCleanup(main.functions.__setitem__, "get_files_info", main.functions["get_files_info"])
+        main.functions["get_files_info"] = lambda working_directory, directory=".": "x" * 50000
+        responses = [
+            [call_chunk("get_files_info", directory="a"), call_chunk("get_files_info", directory="b")],
+            [text_chunk("Done")],
+        ]
+        with contextlib.redirect_stdout(io.StringIO()):
+            messages = asyncio.run(main.run_agent(FakeClient(responses), "list", on_text=lambda t: None, turn_budget=1000))
+        results = [
+            part.function_response.response["result"]
+            for content in messages
+            for part in content.parts
+            if part.function_response is not None
+        ]
+        self.assertEqual(len(results), 2)
+        self.assertLessEqual(sum(len(result) for result in results), 4000)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            messages = asyncio.run(main.run_agent(FakeClient(responses), "list", on_text=lambda t: None, turn_budget=None))
+        self.assertEqual(self.result(messages[2]), "x" * 50000)
+
+
+class TestCassette(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "cassette.jsonl.gz")
+
+    def stream(self, client, prompt):
+        async def collect():
+            contents = [types.Content(role="user", parts=[types.Part(text=prompt)])]
+            stream = await client.aio.models.generate_content_stream(
+                model="model", contents=contents
+            )
+            return [item.text async for item in stream]
+
+        return asyncio.run(collect())
+
+    def test_record_then_replay(self):
+        fake = FakeClient(
+            [[chunk(types.Part(text="Hel")), chunk(types.Part(text="lo"))], [chunk(types.Part(text="Bye"))]]
+        )
+        client = CassetteClient(fake, self.path, mode="record")
+        self.assertEqual(self.stream(client, "hi"), ["Hel", "lo"])
+        self.assertEqual(self.stream(client, "bye"), ["Bye"])
+
+        # a new client reads both appended records, without a real client
+        client = CassetteClient(None, self.path, mode="replay")
+        self.assertEqual(self.stream(client, "bye"), ["Bye"])
+        self.assertEqual(self.stream(client, "hi"), ["Hel", "lo"])
+        self.assertEqual(client.hits, 2)
+        with self.assertRaises(KeyError):
+            self.stream(client, "unknown")
+
+    def test_cache_calls_model_on_miss(self):
+        fake = FakeClient([[chunk(types.Part(text="one"))], [chunk(types.Part(text="two"))]])
+        client = CassetteClient(fake, self.path, mode="cache")
+        self.assertEqual(self.stream(client, "a"), ["one"])
+        self.assertEqual(self.stream(client, "a"), ["one"])
+        self.assertEqual(self.stream(client, "b"), ["two"])
+        self.assertEqual(len(fake.aio.models.requests), 2)
+        self.assertEqual((client.hits, client.misses), (1, 2))
+
+    def test_replay_agent_run(self):
+        call = types.FunctionCall(name="get_files_info", args={"directory": "."})
+        responses = [[chunk(types.Part(function_call=call))], [chunk(types.Part(text="Done"))]]
+        self.addCleanup(main.functions.__setitem__, "get_files_info", main.functions["get_files_info"])
+        main.functions["get_files_info"] = lambda working_directory, directory=".": "listing"
+        client = CassetteClient(FakeClient(responses), self.path, mode="record")
+        recorded = asyncio.run(main.run_agent(client, "list", on_text=lambda t: None))
+
+        client = CassetteClient(None, self.path, mode="replay")
+        replayed = asyncio.run(main.run_agent(client, "list", on_text=lambda t: None))
+        self.assertEqual(replayed, recorded)
+
+
+class TestTracer(unittest.TestCase):
+    def test_disabled_records_nothing(self):
+        t = Tracer()
+        with t.span("model") as span:
+            span["prompt_tokens"] = 1
+        self.assertEqual(t.spans, [])
+
+    def test_export(self):
+        t = Tracer()
+        t.enable()
+        with t.span("iteration"):
+            with t.span("model") as span:
+                span["prompt_tokens"] = 10
+        with self.assertRaises(ValueError):
+            with t.span("model", prompt_tokens=5):
+                raise ValueError()
+        self.assertEqual([s["name"] for s in t.spans], ["model", "iteration", "model"])
+        self.assertEqual(t.spans[2]["attrs"]["error"], "ValueError")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            t.export_jsonl(os.path.join(tmp, "trace.jsonl"))
+            with open(os.path.join(tmp, "trace.jsonl")) as file:
+                self.assertEqual(len(file.readlines()), 3)
+            t.export_chrome(os.path.join(tmp, "trace.json"))
+            with open(os.path.join(tmp, "trace.json")) as file:
+                events = json.load(file)["traceEvents"]
+        self.assertEqual({e["ph"] for e in events}, {"X"})
+
+        summary = t.summary()
+        self.assertIn("prompt_tokens=15", summary)
+        self.assertEqual(summary.splitlines()[0].split()[0], "span")
+
+    def test_agent_session(self):
+        call = types.FunctionCall(name="get_files_info", args={"directory": "."})
+        client = FakeClient(
+            [[chunk(types.Part(function_call=call), prompt_tokens=7)], [chunk(types.Part(text="Done"))]]
+        )
+        tracer.enable()
+        try:
+            asyncio.run(main.run_agent(client, "list", on_text=lambda t: None))
+        finally:
+            tracer.disable()
+        names = [s["name"] for s in tracer.spans]
+        self.assertEqual(names.count("iteration"), 2)
+        self.assertEqual(names.count("model"), 2)
+        self.assertEqual(names.count("call_function"), 1)
+        model = next(s for s in tracer.spans if s["name"] == "model")
+        self.assertEqual(model["attrs"]["prompt_tokens"], 7)
+        self.assertGreater(model["attrs"]["request_bytes"], 0)
+
+
+class TestWorkspace(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source = os.path.join(tmp.name, "source")
+        self.dest = os.path.join(tmp.name, "sandbox", "project")
+        self.write(self.source, "main.py", "print(1)")
+        self.write(self.source, "pkg/calc.py", "x = 1")
+
+    def write(self, root, rel, content):
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            file.write(content)
+
+    def read(self, rel):
+        with open(os.path.join(self.dest, rel)) as file:
+            return file.read()
+
+    def test_incremental(self):
+        stats = sync_workspace(self.source, self.dest)
+        self.assertEqual(stats, {"copied": 2, "unchanged": 0, "removed": 0})
+        self.assertTrue(os.path.isfile(manifest_path(self.dest)))
+        self.assertFalse(os.path.exists(os.path.join(self.dest, os.path.basename(manifest_path(self.dest)))))
+        self.assertEqual(sync_workspace(self.source, self.dest)["copied"], 0)
+
+        # changed in the source, and changed in the workspace
+        self.write(self.source, "main.py", "print(2)")
+        self.write(self.dest, "pkg/calc.py", "x = 2")
+        stats = sync_workspace(self.source, self.dest)
+        self.assertEqual(stats["copied"], 2)
+        self.assertEqual(self.read("main.py"), "print(2)")
+        self.assertEqual(self.read("pkg/calc.py"), "x = 1")
+
+        # touched without changing the content
+        os.utime(os.path.join(self.source, "main.py"), (0, 0))
+        self.assertEqual(sync_workspace(self.source, self.dest)["copied"], 0)
+
+    def test_removed_and_reset(self):
+        sync_workspace(self.source, self.dest)
+        self.write(self.dest, "extra/notes.txt", "agent was here")
+        os.remove(os.path.join(self.source, "pkg/calc.py"))
+
+        stats = sync_workspace(self.source, self.dest)
+        self.assertEqual(stats["removed"], 1)
+        self.assertEqual(self.read("extra/notes.txt"), "agent was here")
+
+        stats = sync_workspace(self.source, self.dest, reset=True)
+        self.assertEqual(stats["removed"], 1)
+        # the empty pkg directory is still in the source
+        self.assertEqual(sorted(os.listdir(self.dest)), ["main.py", "pkg"])
+
+    def test_link(self):
+        sync_workspace(self.source, self.dest, link=True)
+        self.assertTrue(
+            os.path.samefile(os.path.join(self.source, "main.py"), os.path.join(self.dest, "main.py"))
+        )
+        # write_file replaces the file, the source is left untouched
+        write_file._write_file(self.dest, "main.py", "print(3)")
+        with open(os.path.join(self.source, "main.py")) as file:
+            self.assertEqual(file.read(), "print(1)")
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        sandbox = main.sandbox
+        self.addCleanup(setattr, main, "sandbox", sandbox)
+        main.sandbox = tmp.name
+        review = write_file.REVIEW_CHANGES
+        self.addCleanup(setattr, write_file, "REVIEW_CHANGES", review)
+        write_file.REVIEW_CHANGES = False
+
+    def script(self, name):
+        return [
+            [call_chunk("write_file", file_path=name, content=name)],
+            [call_chunk("get_files_info", directory=".")],
+            [text_chunk(f"Wrote {name}")],
+        ]
+
+    def test_isolated_sessions(self):
+        client = FakeClient({"first": self.script("a.txt"), "second": self.script("b.txt")})
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results = asyncio.run(batch.run_batch(client, ["first", "second"], concurrency=2))
+
+        self.assertEqual([r["status"] for r in results], ["done", "done"])
+        self.assertEqual([r["answer"] for r in results], ["Wrote a.txt", "Wrote b.txt"])
+        self.assertEqual([r["tool_calls"] for r in results], [2, 2])
+        first, second = (r["workspace"] for r in results)
+        self.assertTrue(os.path.isfile(os.path.join(first, "a.txt")))
+        self.assertFalse(os.path.exists(os.path.join(first, "b.txt")))
+        self.assertTrue(os.path.isfile(os.path.join(second, "b.txt")))
+        self.assertTrue(os.path.isfile(os.path.join(second, "main.py")))
+
+    def test_error_is_reported(self):
+        client = FakeClient({"first": self.script("a.txt")})
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results = asyncio.run(batch.run_batch(client, ["first", "missing"], concurrency=1))
+        self.assertEqual([r["status"] for r in results], ["done", "error"])
+        self.assertIn("IndexError", results[1]["error"])
+        report = batch.format_report(results, 2.0)
+        self.assertIn("1/2 sessions done", report)
+
+
+class TestRateLimit(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def stream(self, client):
+        async def collect():
+            contents = [types.Content(role="user", parts=[types.Part(text="hi")])]
+            stream = await client.aio.models.generate_content_stream(model="model", contents=contents)
+            return [item.text async for item in stream]
+
+        return asyncio.run(collect())
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(60, capacity=2, clock=self.clock)
+        self.assertEqual([bucket.reserve(1) for _ in range(3)], [0.0, 0.0, 1.0])
+        self.now = 1.0
+        self.assertEqual(bucket.reserve(1), 1.0)
+        self.now = 10.0
+        self.assertEqual(bucket.reserve(2), 0.0)
+
+    def test_throttled_pauses_and_recovers(self):
+        limiter = RateLimiter(requests_per_minute=600, clock=self.clock)
+        limiter.throttled(5)
+        self.assertEqual(limiter.reserve(0), 5.0)
+        self.assertEqual(limiter.requests.rate, 5)
+        for _ in range(10):
+            limiter.succeeded()
+        self.assertEqual(limiter.requests.rate, 10)
+
+    def test_retry_after(self):
+        with FakeGeminiServer([error(429, retry_after=7), error(429, retry_delay=1.5)]) as server:
+            client = server.client()
+            for expected in (7.0, 1.5):
+                with self.assertRaises(errors.APIError) as cm:
+                    self.stream(client)
+                self.assertEqual(retry_after(cm.exception), expected)
+
+    def test_retry_429_and_503(self):
+        responses = [error(429, retry_after=0), error(503), [text_chunk("Hel"), text_chunk("lo")]]
+        with FakeGeminiServer(responses) as server:
+            client = RetryingClient(server.client(), base_delay=0.01)
+            self.assertEqual(self.stream(client), ["Hel", "lo"])
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(client.metrics["retries"], 2)
+        self.assertEqual(client.metrics["throttled"], 1)
+        self.assertGreater(client.metrics["backoff_s"], 0)
+
+    def test_no_retry(self):
+        with FakeGeminiServer([error(400), [text_chunk("unused")]]) as server:
+            client = RetryingClient(server.client(), base_delay=0.01)
+            with self.assertRaises(errors.ClientError):
+                self.stream(client)
+        self.assertEqual(len(server.requests), 1)
+
+        with FakeGeminiServer([error(503)] * 3) as server:
+            client = RetryingClient(server.client(), max_retries=2, base_delay=0.01)
+            with self.assertRaises(errors.ServerError):
+                self.stream(client)
+        self.assertEqual(len(server.requests), 3)
+
+    def test_deadline(self):
+        with FakeGeminiServer([error(429, retry_after=30)]) as server:
+            client = RetryingClient(server.client(), deadline=1.0)
+            start = time.monotonic()
+            with self.assertRaises(TimeoutError):
+                self.stream(client)
+            self.assertLess(time.monotonic() - start, 1.0)
+
+    def test_shared_limiter(self):
+        limiter = RateLimiter(requests_per_minute=60)
+        limiter.requests.level = 1
+        client = RetryingClient(FakeClient([[text_chunk("a")], [text_chunk("b")]]), limiter)
+        self.assertEqual(self.stream(client), ["a"])
+        start = time.monotonic()
+        self.assertEqual(self.stream(client), ["b"])
+        self.assertGreater(time.monotonic() - start, 0.5)
+        self.assertGreater(client.metrics["limiter_wait_s"], 0.5)
+
 
 if __name__ == "__main__":
     # manual test
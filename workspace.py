@@ -0,0 +1,176 @@
+"""Incremental sync of the seeded project into the sandbox workspace.
+
+sync_workspace() replaces a full copytree on every start. A manifest next to
+the workspace records the size, mtime and sha256 of every synced file, so a
+sync only stats files and copies the ones that changed, either in the source
+or in the workspace. Files are cloned with a reflink where the filesystem
+supports it (btrfs, xfs), falling back to a plain copy.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # windows, always copy
+    fcntl = None
+
+from functions.cache import tool_cache
+
+# ioctl from linux/fs.h, makes the destination share the extents of the source
+FICLONE = 0x40049409
+# Errors meaning the filesystem cannot reflink, stop trying for this sync
+_NO_REFLINK = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS}
+
+
+def manifest_path(dest):
+    dest = os.path.abspath(dest)
+    return os.path.join(os.path.dirname(dest), f".{os.path.basename(dest)}.manifest.json")
+
+
+def _load_manifest(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(path, manifest):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    with os.fdopen(fd, "w") as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, path)
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _walk(root):
+    """Yields the relative path of every file under root."""
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        rel_dir = os.path.relpath(dir_path, root)
+        for name in sorted(file_names):
+            yield os.path.normpath(os.path.join(rel_dir, name))
+
+
+class _Cloner:
+    def __init__(self, link=False):
+        self.link = link
+        self.reflink = fcntl is not None
+
+    def clone(self, src, dst):
+        """Replaces dst with a copy of src, never writing through an existing dst."""
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst), prefix=".", suffix=".tmp")
+        os.close(fd)
+        try:
+            if self.link:
+                os.remove(tmp_path)
+                os.link(src, tmp_path)
+            elif not (self.reflink and self._reflink(src, tmp_path)):
+                shutil.copy2(src, tmp_path)
+            os.replace(tmp_path, dst)
+        except BaseException:
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _reflink(self, src, dst):
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            except OSError as e:
+                if e.errno not in _NO_REFLINK:
+                    raise
+                self.reflink = False
+                return False
+        shutil.copystat(src, dst)
+        return True
+
+
+def sync_workspace(source, dest, reset=False, link=False) -> dict:
+    """Makes dest hold a copy of every file in source, copying only what changed.
+
+    A file is copied when it is new or changed in source, or was changed in
+    dest since the last sync. Files that were synced earlier and are gone
+    from source are removed unless they were changed in dest. With reset,
+    files in dest that are not in source are removed as well, giving a
+    pristine copy. With link, files are hardlinked instead of copied, only
+    safe when nothing writes to the files in place.
+
+    Returns the number of files copied, unchanged and removed.
+    """
+    source = os.path.abspath(source)
+    dest = os.path.abspath(dest)
+    os.makedirs(dest, exist_ok=True)
+    path = manifest_path(dest)
+    old = _load_manifest(path)
+    if old.get("source") != source:
+        old = {}
+    old_files = old.get("files", {})
+    files = {}
+    stats = {"copied": 0, "unchanged": 0, "removed": 0}
+    cloner = _Cloner(link=link)
+
+    for rel in _walk(source):
+        src = os.path.join(source, rel)
+        dst = os.path.join(dest, rel)
+        src_sig = _signature(src)
+        dst_sig = _signature(dst)
+        entry = old_files.get(rel)
+        dst_synced = entry is not None and dst_sig == entry["dst"]
+        if dst_synced and src_sig == entry["src"]:
+            files[rel] = entry
+            stats["unchanged"] += 1
+            continue
+
+        # Only hash when the cheap signatures disagree, e.g. the source was touched
+        digest = entry["hash"] if entry is not None and src_sig == entry["src"] else _sha256(src)
+        if not (dst_synced and digest == entry["hash"]):
+            cloner.clone(src, dst)
+            tool_cache.invalidate(dst)
+            dst_sig = _signature(dst)
+            stats["copied"] += 1
+        else:
+            stats["unchanged"] += 1
+        files[rel] = {"src": src_sig, "dst": dst_sig, "hash": digest}
+
+    for rel, entry in old_files.items():
+        dst = os.path.join(dest, rel)
+        if rel not in files and _signature(dst) == entry["dst"]:
+            os.remove(dst)
+            tool_cache.invalidate(dst)
+            stats["removed"] += 1
+
+    if reset:
+        for rel in list(_walk(dest)):
+            if rel not in files:
+                os.remove(os.path.join(dest, rel))
+                tool_cache.invalidate(os.path.join(dest, rel))
+                stats["removed"] += 1
+        for dir_path, dir_names, file_names in os.walk(dest, topdown=False):
+            rel = os.path.relpath(dir_path, dest)
+            if rel != "." and not os.listdir(dir_path) and not os.path.isdir(os.path.join(source, rel)):
+                os.rmdir(dir_path)
+
+    _save_manifest(path, {"source": source, "files": files})
+    return stats